@@ -1,7 +1,25 @@
 """This file fetches weather information for various locations."""
+import asyncio
+import json
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from time import perf_counter
+from urllib.parse import urlparse
 
-from grequests import get, map
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from metrics import count
+
+OPEN_METEO_URL = 'https://api.open-meteo.com/v1/forecast'
+AIR_QUALITY_URL = 'https://api.api-ninjas.com/v1/airquality'
+WEATHER_VARIABLES = 'apparent_temperature,cloud_cover,relative_humidity_2m,lightning_potential,precipitation,precipitation_probability,rain,snowfall,temperature_2m,uv_index,visibility,wind_direction_10m,wind_gusts_10m,wind_speed_10m,weather_code'
+MAX_BATCH_SIZE = 100
+WEEK_HOURS = 168
+REQUEST_TIMEOUT = 20
+MAX_CONNECTIONS_PER_HOST = 10
+HOST_REQUESTS_PER_SECOND = {urlparse(OPEN_METEO_URL).hostname: 10,
+                            urlparse(AIR_QUALITY_URL).hostname: 10}
 
 
 def time_rounder(timestamp: datetime, get_fifteen: bool = True) -> datetime:
@@ -11,52 +29,175 @@ def time_rounder(timestamp: datetime, get_fifteen: bool = True) -> datetime:
     return (timestamp.replace(second=0, microsecond=0, minute=0))
 
 
-def generate_time_strings(get_today: bool = True) -> list[str]:
-    """Returns the times for either today and tomorrow, or tomorrow and next week."""
+def generate_time_strings(get_today: bool = True, hourly_hours: int = WEEK_HOURS) -> list[str]:
+    """Returns the times for either today and tomorrow, or tomorrow and the end of
+    the hourly window, hourly_hours ahead."""
     if get_today:
         today = time_rounder(datetime.now())
         time_str = today.isoformat(timespec='minutes')
         tomorrow = time_rounder(today, get_fifteen=False) + timedelta(days=1)
     else:
         today = time_rounder(datetime.now(), get_fifteen=False)
-        next_week = today + timedelta(weeks=1)
+        next_week = today + timedelta(hours=hourly_hours)
         time_str = next_week.isoformat(timespec='minutes')
         tomorrow = today + timedelta(hours=25)
     tomorrow_str = tomorrow.isoformat(timespec='minutes')
     return time_str, tomorrow_str
 
 
-def get_weather_details_for_week(latitude: float, longitude: float) -> dict:
-    """Returns a request object for the weather details for the coming week."""
-    next_week_str, tomorrow_str = generate_time_strings(get_today=False)
-    return get(
-        f'https://api.open-meteo.com/v1/forecast?latitude={str(latitude)}&longitude={str(longitude)}&hourly=apparent_temperature,cloud_cover,relative_humidity_2m,lightning_potential,precipitation,precipitation_probability,rain,snowfall,temperature_2m,uv_index,visibility,wind_direction_10m,wind_gusts_10m,wind_speed_10m,weather_code&start_hour={tomorrow_str}&end_hour={next_week_str}&timezone=Europe/London',
-        timeout=6)
+def get_weather_details_for_week(latitude: float | str, longitude: float | str,
+                                 hourly_hours: int = WEEK_HOURS) -> str:
+    """Returns the URL for the hourly weather details from tomorrow until hourly_hours ahead.
+    Latitude and longitude may also be comma-separated lists of coordinates."""
+    next_week_str, tomorrow_str = generate_time_strings(get_today=False,
+                                                        hourly_hours=hourly_hours)
+    return f'{OPEN_METEO_URL}?latitude={str(latitude)}&longitude={str(longitude)}&hourly={WEATHER_VARIABLES}&start_hour={tomorrow_str}&end_hour={next_week_str}&timezone=Europe/London'
 
 
-def get_weather_details_for_24hrs(latitude: float, longitude: float) -> dict:
-    """Returns a request object for the weather details for the next 24 hours."""
+def get_weather_details_for_24hrs(latitude: float | str, longitude: float | str) -> str:
+    """Returns the URL for the weather details for the next 24 hours.
+    Latitude and longitude may also be comma-separated lists of coordinates."""
     today_str, tomorrow_str = generate_time_strings()
-    return get(
-        f'https://api.open-meteo.com/v1/forecast?latitude={str(latitude)}&longitude={str(longitude)}&minutely_15=apparent_temperature,cloud_cover,relative_humidity_2m,lightning_potential,precipitation,precipitation_probability,rain,snowfall,temperature_2m,uv_index,visibility,wind_direction_10m,wind_gusts_10m,wind_speed_10m,weather_code&start_minutely_15={today_str}&end_minutely_15={tomorrow_str}&timezone=Europe/London',
-        timeout=6)
-
-
-def get_air_quality(latitude: float, longitude: float, config: dict) -> dict:
-    """Returns a request object for the air quality given a latitude and longitude."""
-    api_url = f'https://api.api-ninjas.com/v1/airquality?lat={latitude}&lon={longitude}'
-    return get(api_url, headers={'X-Api-Key': config['API_KEY']}, timeout=6)
-
-
-def async_api_calls(latitude: float, longitude: float, config: dict) -> dict:
-    """Returns a dictionary of a JSON response for each request."""
-
-    requests = [get_weather_details_for_week(latitude, longitude),
-                get_weather_details_for_24hrs(latitude, longitude),
-                get_air_quality(latitude, longitude, config)]
-
-    responses = map(requests)
-
-    return {"weather_for_week": responses[0].json(),
-            "weather_for_24hr": responses[1].json(),
-            "air_quality": responses[2].json()}
+    return f'{OPEN_METEO_URL}?latitude={str(latitude)}&longitude={str(longitude)}&minutely_15={WEATHER_VARIABLES}&start_minutely_15={today_str}&end_minutely_15={tomorrow_str}&timezone=Europe/London'
+
+
+def get_air_quality(latitude: float, longitude: float) -> str:
+    """Returns the URL for the air quality given a latitude and longitude."""
+    return f'{AIR_QUALITY_URL}?lat={latitude}&lon={longitude}'
+
+
+def join_coordinates(locations: list[dict]) -> tuple[str]:
+    """Returns the latitudes and longitudes of the locations as comma-separated strings."""
+    return (','.join(str(loc["latitude"]) for loc in locations),
+            ','.join(str(loc["longitude"]) for loc in locations))
+
+
+def split_batch_response(data: dict | list, expected: int) -> list[dict]:
+    """Returns one Open-Meteo response per location from a multi-location response.
+    Open-Meteo answers a single coordinate with an object and several with a list,
+    in the same order as the coordinates were given."""
+    if isinstance(data, dict):
+        if data.get("error"):
+            raise ValueError(f"Open-Meteo error: {data.get('reason')}")
+        data = [data]
+    if len(data) != expected:
+        raise ValueError(
+            f"Expected {expected} Open-Meteo responses, received {len(data)}.")
+    return data
+
+
+def create_rate_limiters() -> dict:
+    """Returns a rate limiter for each host, spacing out the start of its requests."""
+    return {host: {"interval": 1 / rate, "next_start": 0.0, "lock": asyncio.Lock()}
+            for host, rate in HOST_REQUESTS_PER_SECOND.items()}
+
+
+async def wait_for_rate_limit(limiter: dict) -> None:
+    """Waits until the host's rate limit allows another request to start."""
+    loop = asyncio.get_running_loop()
+    async with limiter["lock"]:
+        now = loop.time()
+        start = max(now, limiter["next_start"])
+        limiter["next_start"] = start + limiter["interval"]
+    await asyncio.sleep(start - now)
+
+
+async def fetch_json(session: ClientSession, rate_limiters: dict, url: str,
+                     headers: dict = None) -> dict | list:
+    """Returns the JSON response of a GET request, respecting the host's rate limit."""
+    await wait_for_rate_limit(rate_limiters[urlparse(url).hostname])
+    async with session.get(url, headers=headers) as response:
+        body = await response.read()
+    count("http_requests")
+    count("http_bytes", len(body))
+    return json.loads(body)
+
+
+async def fetch_hourly(session: ClientSession, rate_limiters: dict,
+                       batch: list[dict]) -> list[dict | None]:
+    """Returns the hourly weather for each location in a batch, with one request per
+    distinct hourly window. Locations with an hourly_hours of 0 are not fetched."""
+    windows = {}
+    for i, loc in enumerate(batch):
+        windows.setdefault(loc.get("hourly_hours", WEEK_HOURS), []).append(i)
+    windows.pop(0, None)
+
+    responses = await asyncio.gather(*[
+        fetch_json(session, rate_limiters,
+                   get_weather_details_for_week(*join_coordinates([batch[i] for i in indices]),
+                                                hourly_hours))
+        for hourly_hours, indices in windows.items()])
+
+    hourly = [None] * len(batch)
+    for indices, response in zip(windows.values(), responses):
+        for i, data in zip(indices, split_batch_response(response, len(indices))):
+            hourly[i] = data
+    return hourly
+
+
+async def fetch_batch(session: ClientSession, rate_limiters: dict,
+                      batch: list[dict], config: dict) -> list[dict]:
+    """Returns a dictionary of JSON responses for each location in a batch, with
+    one Open-Meteo request per forecast window and one air-quality request each."""
+    latitudes, longitudes = join_coordinates(batch)
+    weekly, daily, *air = await asyncio.gather(
+        fetch_hourly(session, rate_limiters, batch),
+        fetch_json(session, rate_limiters,
+                   get_weather_details_for_24hrs(latitudes, longitudes)),
+        *[fetch_json(session, rate_limiters,
+                     get_air_quality(loc["latitude"], loc["longitude"]),
+                     headers={'X-Api-Key': config['API_KEY']})
+          for loc in batch])
+
+    return [{"weather_for_week": week,
+             "weather_for_24hr": day,
+             "air_quality": air_quality}
+            for week, day, air_quality
+            in zip(weekly, split_batch_response(daily, len(batch)), air)]
+
+
+async def fetch_locations(locations: list[dict], config: dict,
+                          batch_size: int = MAX_BATCH_SIZE,
+                          on_batch: Callable[[int, list[dict], float], None] = None,
+                          max_in_flight: int = None) -> list[dict]:
+    """Returns a dictionary of JSON responses for each location, fetching the
+    batches concurrently over one keep-alive connection pool per host.
+    on_batch is called with the index of a batch's first location, its responses
+    and the seconds it took to fetch as soon as that batch has arrived. It runs on
+    a thread of its own, so it may block without stalling the other fetches; up to
+    max_in_flight batches are fetched or waiting for it at a time."""
+
+    rate_limiters = create_rate_limiters()
+    connector = TCPConnector(limit_per_host=MAX_CONNECTIONS_PER_HOST)
+    in_flight = asyncio.Semaphore(max_in_flight or len(locations) or 1)
+    loop = asyncio.get_running_loop()
+
+    async with ClientSession(connector=connector,
+                             timeout=ClientTimeout(total=REQUEST_TIMEOUT)) as session:
+
+        async def fetch_and_report(start: int, reporter: ThreadPoolExecutor) -> list[dict]:
+            async with in_flight:
+                fetch_start = perf_counter()
+                responses = await fetch_batch(session, rate_limiters,
+                                              locations[start:start+batch_size], config)
+                if on_batch:
+                    await loop.run_in_executor(reporter, on_batch, start, responses,
+                                               perf_counter() - fetch_start)
+            return responses
+
+        with ThreadPoolExecutor(max_workers=1) as reporter:
+            batches = await asyncio.gather(*[fetch_and_report(start, reporter)
+                                             for start in range(0, len(locations), batch_size)])
+
+    return [responses for batch in batches for responses in batch]
+
+
+def batch_api_calls(locations: list[dict], config: dict,
+                    batch_size: int = MAX_BATCH_SIZE,
+                    on_batch: Callable[[int, list[dict], float], None] = None,
+                    max_in_flight: int = None) -> list[dict]:
+    """Returns a dictionary of JSON responses for each location, in the same order as
+    the locations. The weather for up to batch_size locations is fetched with one
+    request per forecast window; air quality is still requested per location."""
+    return asyncio.run(fetch_locations(locations, config, batch_size, on_batch,
+                                       max_in_flight))
@@ -1,42 +1,12 @@
-"""This file is the load aspect of the cloud monitor ETL Pipeline."""
+"""This file is the load aspect of the cloud monitor ETL Pipeline.
+None of these functions commit; the pipeline commits each location once."""
 
 from datetime import datetime
 
-from psycopg2 import connect
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
 from psycopg2.extensions import connection
 
 
-def get_db_connection(config: dict) -> connection:
-    """Returns a connection to the database."""
-
-    return connect(
-        user=config["DB_USER"],
-        password=config["DB_PASSWORD"],
-        host=config["DB_HOST"],
-        port=config["DB_PORT"],
-        database=config["DB_NAME"],
-        cursor_factory=RealDictCursor
-    )
-
-
-def get_location_id(conn: connection, latitude: float, longitude: float) -> int:
-    """Returns the location ID for a given latitude and longitude."""
-
-    sql_query = """
-        SELECT loc_id
-        FROM location
-        WHERE latitude = %s
-        AND longitude = %s;
-        """
-
-    with conn.cursor() as cur:
-        cur.execute(sql_query, (latitude, longitude))
-        location_id = cur.fetchone()["loc_id"]
-
-    return location_id
-
-
 def insert_weather_report(conn: connection, location_id: int) -> int:
     """Returns a weather report ID from the database having inserted a weather report."""
 
@@ -51,152 +21,163 @@ def insert_weather_report(conn: connection, location_id: int) -> int:
     with conn.cursor() as cur:
         cur.execute(sql_query, (datetime.now(), location_id))
         weather_report_id = cur.fetchone()
-    conn.commit()
 
     return weather_report_id["weather_report_id"]
 
 
-def check_forecasts(conn: connection, forecast: dict, location_id: int) -> int:
-    """Check if a forecast with a matching timestamp and return it's id."""
-    sql_query = f"""
-        SELECT forecast_id FROM forecast AS f
-        JOIN weather_report AS wr
-        ON (wr.weather_report_id = f.weather_report_id)
-        WHERE f.forecast_timestamp = '{forecast["forecast_timestamp"]}'
-        AND wr.loc_id = {location_id}
+FORECAST_COLUMNS = ["forecast_timestamp", "visibility", "humidity", "precipitation",
+                    "precipitation_prob", "rainfall", "snowfall", "wind_speed",
+                    "wind_direction", "wind_gusts", "lightning_potential", "uv_index",
+                    "cloud_cover", "temperature", "apparent_temperature", "weather_code_id",
+                    "content_hash"]
+
+
+def get_forecast_rows(forecasts: list[dict], weather_report_id: int, location_id: int) -> list[tuple]:
+    """Returns the forecasts as rows for the forecast table, one per timestamp.
+    If a timestamp appears more than once the last forecast for it is kept."""
+    rows = {}
+    for forecast in forecasts:
+        rows[forecast["forecast_timestamp"]] = tuple(
+            forecast[column] for column in FORECAST_COLUMNS) + (weather_report_id, location_id)
+    return list(rows.values())
+
+
+def get_stored_hashes(conn: connection, loc_ids: list[int],
+                      timestamps: list[datetime]) -> dict[tuple, int]:
+    """Returns the content hash of each stored forecast for the given locations and
+    timestamps, keyed by (location ID, forecast timestamp)."""
+    if not loc_ids or not timestamps:
+        return {}
+
+    sql_query = """
+        SELECT loc_id, forecast_timestamp, content_hash
+        FROM forecast
+        WHERE loc_id = ANY(%s) AND forecast_timestamp = ANY(%s);
+        """
+
+    with conn.cursor() as cur:
+        cur.execute(sql_query, (loc_ids, timestamps))
+        rows = cur.fetchall()
+
+    return {(row["loc_id"], row["forecast_timestamp"]): row["content_hash"] for row in rows}
+
+
+def get_changed_weather(weather: list[dict], stored_hashes: dict[tuple, int],
+                        location_id: int) -> list[dict]:
+    """Returns the weather whose forecast differs from the one stored for a location."""
+    return [w for w in weather
+            if stored_hashes.get((location_id, w["forecast"]["forecast_timestamp"]))
+            != w["forecast"]["content_hash"]]
+
+
+def upsert_forecasts(conn: connection, forecasts: list[dict], weather_report_id: int,
+                     location_id: int) -> list[int]:
+    """Returns the forecast IDs, in the order of the given forecasts, having inserted
+    or updated every forecast for a location in a single statement."""
+    if not forecasts:
+        return []
+
+    sql_query = """
+        INSERT INTO forecast
+            (forecast_timestamp, visibility, humidity, precipitation,
+            precipitation_prob, rainfall, snowfall, wind_speed, wind_direction,
+            wind_gusts, lightning_potential, uv_index, cloud_cover, temperature,
+            apparent_temp, weather_code_id, content_hash, weather_report_id, loc_id)
+        VALUES %s
+        ON CONFLICT (loc_id, forecast_timestamp) DO UPDATE
+        SET
+            visibility = EXCLUDED.visibility,
+            humidity = EXCLUDED.humidity,
+            precipitation = EXCLUDED.precipitation,
+            precipitation_prob = EXCLUDED.precipitation_prob,
+            rainfall = EXCLUDED.rainfall,
+            snowfall = EXCLUDED.snowfall,
+            wind_speed = EXCLUDED.wind_speed,
+            wind_direction = EXCLUDED.wind_direction,
+            wind_gusts = EXCLUDED.wind_gusts,
+            lightning_potential = EXCLUDED.lightning_potential,
+            uv_index = EXCLUDED.uv_index,
+            cloud_cover = EXCLUDED.cloud_cover,
+            temperature = EXCLUDED.temperature,
+            apparent_temp = EXCLUDED.apparent_temp,
+            weather_code_id = EXCLUDED.weather_code_id,
+            content_hash = EXCLUDED.content_hash,
+            weather_report_id = EXCLUDED.weather_report_id
+        RETURNING forecast_id, forecast_timestamp;
         """
+
+    rows = get_forecast_rows(forecasts, weather_report_id, location_id)
     with conn.cursor() as cur:
-        cur.execute(sql_query)
-        forecast_id = cur.fetchone()
-    if forecast_id:
-        return forecast_id["forecast_id"]
-    return 0
-
-
-def insert_forecast(conn: connection, forecast: dict, weather_report_id: int, location_id: int) -> int:
-    """Returns the forecast ID from the database having inserted a forecast."""
-    forecast_id = check_forecasts(conn, forecast, location_id)
-    if forecast_id:
-        sql_query = """UPDATE forecast as f 
-                        SET
-                        visibility = u.new_vis,
-                        humidity = u.new_hum,
-                        precipitation = u.new_prec,
-                        precipitation_prob = u.new_prec_prob,
-                        rainfall = u.new_rain,
-                        snowfall = u.new_snow,
-                        wind_speed = u.new_speed,
-                        wind_direction = u.new_dir,
-                        wind_gusts = u.new_gust,
-                        lightning_potential = u.new_light,
-                        uv_index = u.new_uv,
-                        cloud_cover = u.new_cloud,
-                        temperature = u.new_temp,
-                        apparent_temp = u.new_apptemp,
-                        weather_report_id = u.new_rep,
-                        weather_code_id = u.new_code
-                        FROM (VALUES
-                        (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ) AS u(forecast_id, new_vis, new_hum, new_prec, new_prec_prob, new_rain, 
-                        new_snow, new_speed, new_dir, new_gust, new_light, new_uv, 
-                        new_cloud, new_temp, new_apptemp, new_rep, new_code)
-                        WHERE f.forecast_timestamp = %s
-                        AND f.forecast_id = u.forecast_id
-                        ;"""
-        with conn.cursor() as cur:
-            cur.execute(sql_query, (forecast_id,
-                                    forecast["visibility"],
-                                    forecast["humidity"],
-                                    forecast["precipitation"],
-                                    forecast["precipitation_prob"],
-                                    forecast["rainfall"],
-                                    forecast["snowfall"],
-                                    forecast["wind_speed"],
-                                    forecast["wind_direction"],
-                                    forecast["wind_gusts"],
-                                    forecast["lightning_potential"],
-                                    forecast["uv_index"],
-                                    forecast["cloud_cover"],
-                                    forecast["temperature"],
-                                    forecast["apparent_temperature"],
-                                    weather_report_id,
-                                    forecast["weather_code_id"],
-                                    forecast["forecast_timestamp"]))
-        conn.commit()
-    else:
-        sql_query = """
-            INSERT INTO forecast
-                (forecast_timestamp, visibility, humidity, precipitation,
-                precipitation_prob, rainfall, snowfall, wind_speed, wind_direction,
-                wind_gusts, lightning_potential, uv_index, cloud_cover, temperature,
-                apparent_temp, weather_report_id, weather_code_id)
-            VALUES
-                (%s, %s, %s, %s, %s, %s, %s, %s, %s,
-                %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING forecast_id;
-            """
-
-        with conn.cursor() as cur:
-            cur.execute(sql_query, (forecast["forecast_timestamp"],
-                                    forecast["visibility"],
-                                    forecast["humidity"],
-                                    forecast["precipitation"],
-                                    forecast["precipitation_prob"],
-                                    forecast["rainfall"],
-                                    forecast["snowfall"],
-                                    forecast["wind_speed"],
-                                    forecast["wind_direction"],
-                                    forecast["wind_gusts"],
-                                    forecast["lightning_potential"],
-                                    forecast["uv_index"],
-                                    forecast["cloud_cover"],
-                                    forecast["temperature"],
-                                    forecast["apparent_temperature"],
-                                    weather_report_id,
-                                    forecast["weather_code_id"]))
-            forecast_id = cur.fetchone()["forecast_id"]
-        conn.commit()
-
-    return forecast_id
-
-
-def insert_weather_alert(conn: connection, weather_alert: dict, forecast_id: int) -> None:
-    """Inserts a weather alert into the database."""
+        returned = execute_values(cur, sql_query, rows,
+                                  page_size=len(rows), fetch=True)
+
+    forecast_ids = {row["forecast_timestamp"]: row["forecast_id"]
+                    for row in returned}
+    return [forecast_ids[forecast["forecast_timestamp"]] for forecast in forecasts]
+
+
+def insert_weather_alerts(conn: connection, weather: list[dict],
+                          forecast_ids: list[int]) -> list[int]:
+    """Returns the IDs of the new weather alerts, having inserted the alerts for
+    every forecast in a single statement, skipping alerts already in the database."""
+    rows = sorted({(warning["alert_type_id"], forecast_id, warning["severity_type_id"])
+                   for w, forecast_id in zip(weather, forecast_ids)
+                   for warning in w["warnings"] or []})
+    if not rows:
+        return []
+
+    sql_query = """
+        INSERT INTO weather_alert
+            (alert_type_id, forecast_id, severity_level_id)
+        SELECT *
+        FROM unnest(%s::SMALLINT[], %s::BIGINT[], %s::SMALLINT[])
+        ON CONFLICT (forecast_id, alert_type_id, severity_level_id) DO NOTHING
+        RETURNING alert_id;
+        """
+
+    alert_type_ids, alert_forecast_ids, severity_level_ids = map(list, zip(*rows))
     with conn.cursor() as cur:
-        select_sql_query = """SELECT * FROM weather_alert
-                        WHERE alert_type_id = %s
-                        AND forecast_id = %s
-                        AND severity_level_id = %s"""
-        cur.execute(select_sql_query, (weather_alert["alert_type_id"],
-                                       forecast_id,
-                                       weather_alert["severity_type_id"]))
-        alert = cur.fetchone()
-        if not alert:
-            insert_sql_query = """
-                INSERT INTO weather_alert
-                    (alert_type_id, forecast_id, severity_level_id)
-                VALUES
-                    (%s, %s, %s);
-                """
-
-            cur.execute(insert_sql_query, (weather_alert["alert_type_id"],
-                                           forecast_id,
-                                           weather_alert["severity_type_id"]))
-        conn.commit()
-
-
-def insert_air_quality(conn: connection, air_quality: dict, weather_report_id: int) -> None:
-    """Inserts an air quality reading to the database."""
+        cur.execute(sql_query, (alert_type_ids, alert_forecast_ids, severity_level_ids))
+        return [row["alert_id"] for row in cur.fetchall()]
+
+
+def insert_air_quality(conn: connection, air_quality: dict, weather_report_id: int) -> int:
+    """Returns the ID of an air quality reading having inserted it to the database."""
 
     sql_query = """
         INSERT INTO air_quality
             (o3_concentration, severity_level_id, weather_report_id)
         VALUES
-            (%s, %s, %s);
+            (%s, %s, %s)
+        RETURNING air_quality_id;
         """
 
     with conn.cursor() as cur:
         cur.execute(sql_query, (air_quality["o3_concentration"],
                                 air_quality["severity_id"],
                                 weather_report_id))
-    conn.commit()
+        return cur.fetchone()["air_quality_id"]
+
+
+def record_processing_times(conn: connection, seconds_per_location: dict[int, float]) -> None:
+    """Records how long each location took to process, smoothed with its previous
+    times, for the location splitter to size and balance its chunks."""
+    if not seconds_per_location:
+        return
+
+    sql_query = """
+        INSERT INTO location_processing_time
+            (loc_id, seconds, recorded_at)
+        VALUES %s
+        ON CONFLICT (loc_id) DO UPDATE
+        SET
+            seconds = 0.7 * location_processing_time.seconds + 0.3 * EXCLUDED.seconds,
+            recorded_at = EXCLUDED.recorded_at;
+        """
+
+    now = datetime.now()
+    with conn.cursor() as cur:
+        execute_values(cur, sql_query,
+                       [(loc_id, seconds, now) for loc_id, seconds
+                        in sorted(seconds_per_location.items())],
+                       page_size=len(seconds_per_location))
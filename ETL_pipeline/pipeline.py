@@ -1,45 +1,195 @@
-"""This script is the full ETL pipeline for a single location."""
+"""This script is the full ETL pipeline for the locations in a forecast grid cell."""
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from os import environ as ENV
+from queue import Queue
+from time import perf_counter
 
 from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
 from psycopg2.extensions import connection
 
-from extract import async_api_calls
+from alert_outbox import enqueue_weather_alerts, enqueue_air_quality, NO_AIR_QUALITY_ALERT_ID
+from db_pool import db_connection, reset_connection_stats, get_connection_stats
+from metrics import count, flush_metrics, span
+from query_stats import reset_query_stats, get_query_stats
+from extract import batch_api_calls
 from transform import gather_weather_data, gather_air_quality
-from load import (get_db_connection, get_location_id, insert_weather_report,
-                  insert_forecast, insert_weather_alert, insert_air_quality)
+from load import (insert_weather_report, get_stored_hashes, get_changed_weather,
+                  upsert_forecasts, insert_weather_alerts, insert_air_quality,
+                  record_processing_times)
+from refresh_policy import (get_refresh_policies, get_hourly_hours,
+                            measure_volatility, update_refresh_policies)
 
+DEFAULT_WORKERS = 4
+DEFAULT_EXTRACT_BATCH_SIZE = 10
+# Extracted cells waiting to be loaded are capped at this many per load worker.
+QUEUED_CELLS_PER_WORKER = 2
 
-def pipeline(conn: connection, config: dict, latitude: float, longitude: float) -> None:
-    """Loads data from weather APIs to a database."""
 
-    api_data = async_api_calls(latitude, longitude, config)
+def load_location(conn: connection, loc_id: int, weather: list[dict], air_quality: dict) -> None:
+    """Loads a location's transformed weather data to a database.
+    The whole location is written in one transaction, so a partially loaded
+    weather report is never visible, and new alerts are added to the alert outbox
+    in the same transaction. Only changed forecasts need to be given."""
 
-    weather = gather_weather_data(api_data["weather_for_24hr"],
-                                  api_data["weather_for_week"])
-    air_quality = gather_air_quality(api_data["air_quality"])
+    with conn:
+        weather_report_id = insert_weather_report(conn, loc_id)
+        forecast_ids = upsert_forecasts(conn, [w["forecast"] for w in weather],
+                                        weather_report_id, loc_id)
+        enqueue_weather_alerts(conn, insert_weather_alerts(conn, weather, forecast_ids))
+        air_quality_id = insert_air_quality(conn, air_quality, weather_report_id)
+        if air_quality["severity_id"] != NO_AIR_QUALITY_ALERT_ID:
+            enqueue_air_quality(conn, [air_quality_id])
 
-    loc_id = get_location_id(conn, latitude, longitude)
-    weather_report_id = insert_weather_report(conn, loc_id)
 
-    for w in weather:
-        forecast_id = insert_forecast(
-            conn, w["forecast"], weather_report_id, loc_id)
-        if w["warnings"]:
-            for warning in w["warnings"]:
-                insert_weather_alert(conn, warning, forecast_id)
+def pipeline(conn: connection, api_data: dict, loc_ids: list[int]) -> tuple[int, int]:
+    """Loads a grid cell's data from the weather API responses to a database,
+    transforming it once for every location in the cell. The locations share a
+    forecast, so the hourly horizons' volatility is measured once for the cell.
+    Forecasts identical to the stored ones are skipped; returns how many forecasts
+    were skipped out of the total."""
 
-    insert_air_quality(conn, air_quality, weather_report_id)
+    now = datetime.now()
+    with span("transform"):
+        weather = gather_weather_data(api_data["weather_for_24hr"],
+                                      api_data["weather_for_week"])
+        air_quality = gather_air_quality(api_data["air_quality"])
+        count("forecasts", len(weather))
+    forecasts = [w["forecast"] for w in weather]
+
+    with span("load"):
+        with conn:
+            volatility = measure_volatility(conn, loc_ids[0], forecasts, now)
+            stored_hashes = get_stored_hashes(conn, loc_ids,
+                                              [f["forecast_timestamp"] for f in forecasts])
+
+        skipped = 0
+        for loc_id in loc_ids:
+            changed = get_changed_weather(weather, stored_hashes, loc_id)
+            skipped += len(weather) - len(changed)
+            load_location(conn, loc_id, changed, air_quality)
+            count("forecasts_loaded", len(changed))
+
+        with conn:
+            update_refresh_policies(conn, loc_ids, volatility, now)
+        count("locations", len(loc_ids))
+        count("forecasts_skipped", skipped)
+
+    return skipped, len(weather) * len(loc_ids)
+
+
+def get_batches_in_flight(stage_queue: Queue, batch_size: int) -> int:
+    """Returns how many batches may be fetched at once: enough to fill the stage
+    queue, and one more to be fetching while the last is queued."""
+    return -(-stage_queue.maxsize // batch_size) + 1 if stage_queue.maxsize else None
+
+
+def extract_stage(event: list[dict], config: dict, stage_queue: Queue,
+                  batch_size: int, workers: int) -> None:
+    """Fetches the event's grid cells in batches, queueing each cell for the load
+    workers as soon as its batch has arrived, with its share of the batch's fetch
+    time, then tells every worker to stop. While the queue is full, no more batches
+    are fetched than it has room for; the time spent waiting for room is counted as
+    queue_wait_ms."""
+
+    queue_seconds = 0.0
+
+    def queue_batch(first: int, batch_data: list[dict], seconds: float) -> None:
+        nonlocal queue_seconds
+        extract_seconds = seconds / len(batch_data)
+        start = perf_counter()
+        for e, api_data in zip(event[first:], batch_data):
+            stage_queue.put((e["loc_ids"], api_data, extract_seconds))
+        queue_seconds += perf_counter() - start
+
+    try:
+        with span("extract"):
+            batch_api_calls(event, config, batch_size, queue_batch,
+                            get_batches_in_flight(stage_queue, batch_size))
+            count("grid_cells", len(event))
+            count("queue_wait_ms", queue_seconds * 1000)
+    finally:
+        for _ in range(workers):
+            stage_queue.put(None)
+
+
+def load_stage(config: dict, stage_queue: Queue) -> tuple[dict[int, float], int, int]:
+    """Transforms and loads queued grid cells on its own connection until told to
+    stop, returning the seconds each location took and how many forecasts were
+    skipped as unchanged out of the total. A failed worker, including one that
+    could not connect, keeps taking cells off the queue until told to stop, so the
+    extract is never left waiting on it."""
+
+    seconds_per_location = {}
+    skipped, total = 0, 0
+    stopped = False
+    try:
+        with db_connection(config, RealDictCursor) as conn:
+            while (cell := stage_queue.get()) is not None:
+                loc_ids, api_data, extract_seconds = cell
+                start = perf_counter()
+                cell_skipped, cell_total = pipeline(conn, api_data, loc_ids)
+                skipped += cell_skipped
+                total += cell_total
+                cell_seconds = extract_seconds + perf_counter() - start
+                for loc_id in loc_ids:
+                    seconds_per_location[loc_id] = cell_seconds / len(loc_ids)
+            stopped = True
+    except Exception:
+        while not stopped and stage_queue.get() is not None:
+            pass
+        raise
+    return seconds_per_location, skipped, total
+
+
+def schedule_refreshes(conn: connection, event: list[dict]) -> list[dict]:
+    """Returns the grid cells with how far ahead each one's hourly forecast is due
+    to be re-fetched, according to its locations' refresh policies."""
+    policies = get_refresh_policies(conn, [loc_id for e in event for loc_id in e["loc_ids"]])
+    now = datetime.now()
+    return [{**e, "hourly_hours": get_hourly_hours(policies, e["loc_ids"], now)}
+            for e in event]
 
 
 def handler(event: list[dict], context: dict = None) -> None:
-    """AWS Lambda function handler of the pipeline for multiple locations."""
+    """AWS Lambda function handler of the pipeline for multiple grid cells.
+    Extracting later batches overlaps with transforming and loading earlier ones,
+    which are shared between PIPELINE_WORKERS workers with a connection each
+    through a bounded queue.
+    Hourly forecasts are only re-fetched for the horizons that are due."""
 
     load_dotenv()
-    connection = get_db_connection(ENV)
+    reset_connection_stats()
+    reset_query_stats()
+    workers = int(ENV.get("PIPELINE_WORKERS", DEFAULT_WORKERS))
+    batch_size = int(ENV.get("EXTRACT_BATCH_SIZE", DEFAULT_EXTRACT_BATCH_SIZE))
+    stage_queue = Queue(maxsize=workers * QUEUED_CELLS_PER_WORKER)
+
+    with span("schedule"), db_connection(ENV, RealDictCursor) as conn:
+        with conn:
+            event = schedule_refreshes(conn, event)
+
+    with ThreadPoolExecutor(max_workers=workers + 1) as executor:
+        extracting = executor.submit(extract_stage, event, ENV, stage_queue,
+                                     batch_size, workers)
+        loading = [executor.submit(load_stage, ENV, stage_queue)
+                   for _ in range(workers)]
+        extracting.result()
+        seconds_per_location, skipped, total = {}, 0, 0
+        for worker in loading:
+            worker_seconds, worker_skipped, worker_total = worker.result()
+            seconds_per_location.update(worker_seconds)
+            skipped += worker_skipped
+            total += worker_total
 
-    for e in event:
-        pipeline(connection, ENV, e["latitude"], e["longitude"])
+    with span("record_times"), db_connection(ENV, RealDictCursor) as conn:
+        with conn:
+            record_processing_times(conn, seconds_per_location)
 
-    connection.close()
+    print(f"Unchanged forecasts skipped: {skipped}/{total}"
+          f" ({skipped / max(total, 1):.1%})")
+    print("Database connections:", get_connection_stats())
+    print("Database queries:", get_query_stats())
+    flush_metrics("pipeline")
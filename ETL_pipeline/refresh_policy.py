@@ -0,0 +1,144 @@
+"""This file decides how far ahead each location's hourly forecast is re-fetched.
+
+The 15-minutely window is refreshed on every run. The hourly window is split into
+horizons that are refreshed less often the further ahead they are, and more often
+for locations whose forecast for that horizon has recently been changing."""
+
+from datetime import datetime, timedelta
+
+from psycopg2.extras import execute_values
+from psycopg2.extensions import connection
+
+# (horizon, last hour ahead it covers, minutes between refreshes); the hourly
+# window starts 25 hours ahead, where the 15-minutely window ends.
+REFRESH_HORIZONS = (("day_2_3", 72, 60),
+                    ("day_4_7", 168, 180))
+
+# A horizon is volatile when its temperature or precipitation probability moved
+# by at least this much since the last refresh; volatile horizons are refreshed
+# twice as often, but never more often than every run.
+VOLATILE_TEMPERATURE_CHANGE = 2.0
+VOLATILE_PRECIPITATION_CHANGE = 20
+MIN_REFRESH_MINUTES = 15
+
+# Runs start a few minutes late, so a horizon counts as due slightly early.
+REFRESH_TOLERANCE = timedelta(minutes=5)
+
+
+def get_refresh_policies(conn: connection, loc_ids: list[int]) -> dict[int, dict]:
+    """Returns the refresh policy of each location, keyed by location ID and then horizon."""
+
+    sql_query = """
+        SELECT loc_id, horizon, refresh_minutes, refreshed_at
+        FROM forecast_refresh_policy
+        WHERE loc_id = ANY(%s);
+        """
+
+    with conn.cursor() as cur:
+        cur.execute(sql_query, (loc_ids,))
+        rows = cur.fetchall()
+
+    policies = {}
+    for row in rows:
+        policies.setdefault(row["loc_id"], {})[row["horizon"]] = row
+    return policies
+
+
+def is_due(policy: dict | None, now: datetime) -> bool:
+    """Returns whether a horizon with the given policy should be refreshed."""
+    if policy is None:
+        return True
+    next_refresh = policy["refreshed_at"] + timedelta(minutes=policy["refresh_minutes"])
+    return next_refresh - REFRESH_TOLERANCE <= now
+
+
+def get_hourly_hours(policies: dict[int, dict], loc_ids: list[int], now: datetime) -> int:
+    """Returns how many hours ahead the hourly window of a grid cell must be fetched,
+    which is to the end of the furthest horizon due for any of its locations.
+    Returns 0 if no hourly forecast is needed."""
+    hours = 0
+    for horizon, last_hour, _ in REFRESH_HORIZONS:
+        if any(is_due(policies.get(loc_id, {}).get(horizon), now) for loc_id in loc_ids):
+            hours = last_hour
+    return hours
+
+
+def get_horizon(timestamp: datetime, now: datetime) -> str | None:
+    """Returns the horizon of a forecast timestamp, or None if it is not in the hourly window."""
+    hours_ahead = (timestamp - now) / timedelta(hours=1)
+    first_hour = 24
+    for horizon, last_hour, _ in REFRESH_HORIZONS:
+        if first_hour < hours_ahead <= last_hour:
+            return horizon
+        first_hour = last_hour
+    return None
+
+
+def measure_volatility(conn: connection, loc_id: int, forecasts: list[dict],
+                       now: datetime) -> dict[str, float]:
+    """Returns how much each refreshed horizon changed since it was last loaded for a
+    location, as a multiple of the volatile change; a horizon with no previous
+    forecasts has a volatility of 0."""
+
+    horizons = {f["forecast_timestamp"]: get_horizon(f["forecast_timestamp"], now)
+                for f in forecasts}
+    refreshed = [f for f in forecasts if horizons[f["forecast_timestamp"]]]
+    volatility = {horizons[f["forecast_timestamp"]]: 0.0 for f in refreshed}
+    if not refreshed:
+        return volatility
+
+    sql_query = """
+        SELECT forecast_timestamp, temperature, precipitation_prob
+        FROM forecast
+        WHERE loc_id = %s AND forecast_timestamp = ANY(%s);
+        """
+
+    with conn.cursor() as cur:
+        cur.execute(sql_query, (loc_id, [f["forecast_timestamp"] for f in refreshed]))
+        previous = {row["forecast_timestamp"]: row for row in cur.fetchall()}
+
+    for forecast in refreshed:
+        before = previous.get(forecast["forecast_timestamp"])
+        if before is None:
+            continue
+        change = max(
+            abs(forecast["temperature"] - before["temperature"])
+            / VOLATILE_TEMPERATURE_CHANGE,
+            abs(forecast["precipitation_prob"] - before["precipitation_prob"])
+            / VOLATILE_PRECIPITATION_CHANGE)
+        horizon = horizons[forecast["forecast_timestamp"]]
+        volatility[horizon] = max(volatility[horizon], change)
+    return volatility
+
+
+def get_refresh_minutes(horizon: str, volatility: float) -> int:
+    """Returns the minutes until a horizon should next be refreshed."""
+    minutes = dict((name, minutes) for name, _, minutes in REFRESH_HORIZONS)[horizon]
+    if volatility >= 1:
+        minutes = max(minutes // 2, MIN_REFRESH_MINUTES)
+    return minutes
+
+
+def update_refresh_policies(conn: connection, loc_ids: list[int],
+                            volatility: dict[str, float], now: datetime) -> None:
+    """Records that the given horizons were refreshed for the locations,
+    scheduling their next refresh from how volatile they were."""
+    if not volatility or not loc_ids:
+        return
+
+    sql_query = """
+        INSERT INTO forecast_refresh_policy
+            (loc_id, horizon, refresh_minutes, volatility, refreshed_at)
+        VALUES %s
+        ON CONFLICT (loc_id, horizon) DO UPDATE
+        SET
+            refresh_minutes = EXCLUDED.refresh_minutes,
+            volatility = EXCLUDED.volatility,
+            refreshed_at = EXCLUDED.refreshed_at;
+        """
+
+    rows = [(loc_id, horizon, get_refresh_minutes(horizon, change), change, now)
+            for loc_id in sorted(loc_ids)
+            for horizon, change in sorted(volatility.items())]
+    with conn.cursor() as cur:
+        execute_values(cur, sql_query, rows, page_size=len(rows))
@@ -0,0 +1,182 @@
+"""Tests for the extract stage of the weather pipeline."""
+import asyncio
+from time import sleep
+from unittest.mock import patch
+
+import pytest
+
+from extract import (join_coordinates, split_batch_response, batch_api_calls,
+                     create_rate_limiters, wait_for_rate_limit)
+
+
+def test_join_coordinates():
+    """Test that coordinates are joined in location order."""
+    locations = [{'latitude': 51.4893335, 'longitude': -0.14406},
+                 {'latitude': 53.4794892, 'longitude': -2.2451148}]
+    assert join_coordinates(locations) == ('51.4893335,53.4794892',
+                                           '-0.14406,-2.2451148')
+
+
+def test_split_batch_response_single_location():
+    """Test that a single-location object is wrapped in a list."""
+    assert split_batch_response({'hourly': {}}, 1) == [{'hourly': {}}]
+
+
+def test_split_batch_response_wrong_length():
+    """Test that a response missing locations raises an error."""
+    with pytest.raises(ValueError):
+        split_batch_response([{'hourly': {}}], 2)
+
+
+def test_split_batch_response_error():
+    """Test that an Open-Meteo error object raises an error."""
+    with pytest.raises(ValueError):
+        split_batch_response({'error': True, 'reason': 'Bad latitude'}, 1)
+
+
+def test_rate_limiter_spaces_requests():
+    """Test that requests to one host start no faster than its rate limit."""
+    async def start_times():
+        limiter = {"interval": 0.05, "next_start": 0.0, "lock": asyncio.Lock()}
+        loop = asyncio.get_running_loop()
+        begin = loop.time()
+
+        async def timed():
+            await wait_for_rate_limit(limiter)
+            return loop.time() - begin
+        return sorted(await asyncio.gather(*[timed() for _ in range(4)]))
+
+    times = asyncio.run(start_times())
+    assert times[-1] >= 0.14
+
+
+def test_create_rate_limiters():
+    """Test that both APIs have a rate limiter."""
+    assert set(create_rate_limiters()) == {'api.open-meteo.com', 'api.api-ninjas.com'}
+
+
+@patch('extract.fetch_json')
+def test_batch_api_calls(mock_fetch_json):
+    """Test that the weather for a chunk is fetched with two requests
+    and split back per location."""
+    locations = [{'latitude': 1.0, 'longitude': 2.0},
+                 {'latitude': 3.0, 'longitude': 4.0}]
+
+    async def fake_fetch_json(session, rate_limiters, url, headers=None):
+        if 'hourly=' in url:
+            return [{'hourly': 'week_1'}, {'hourly': 'week_2'}]
+        if 'minutely_15=' in url:
+            return [{'minutely_15': 'day_1'}, {'minutely_15': 'day_2'}]
+        return {'O3': url}
+    mock_fetch_json.side_effect = fake_fetch_json
+
+    output = batch_api_calls(locations, {'API_KEY': 'key'})
+
+    assert mock_fetch_json.call_count == 4
+    assert 'latitude=1.0,3.0&longitude=2.0,4.0' in mock_fetch_json.call_args_list[0].args[2]
+    assert output == [{'weather_for_week': {'hourly': 'week_1'},
+                       'weather_for_24hr': {'minutely_15': 'day_1'},
+                       'air_quality': {'O3': 'https://api.api-ninjas.com/v1/airquality?lat=1.0&lon=2.0'}},
+                      {'weather_for_week': {'hourly': 'week_2'},
+                       'weather_for_24hr': {'minutely_15': 'day_2'},
+                       'air_quality': {'O3': 'https://api.api-ninjas.com/v1/airquality?lat=3.0&lon=4.0'}}]
+
+
+@patch('extract.fetch_json')
+def test_batch_api_calls_reports_each_batch(mock_fetch_json):
+    """Test that each batch is reported as soon as it arrives, with its offset."""
+    locations = [{'latitude': float(i), 'longitude': 0.0} for i in range(3)]
+
+    async def fake_fetch_json(session, rate_limiters, url, headers=None):
+        if 'api-ninjas' in url:
+            return {'O3': url}
+        count = url.split('latitude=')[1].split('&')[0].count(',') + 1
+        return [{'hourly': None}] * count if count > 1 else {'hourly': None}
+    mock_fetch_json.side_effect = fake_fetch_json
+    reported = []
+
+    output = batch_api_calls(locations, {'API_KEY': 'key'}, batch_size=2,
+                             on_batch=lambda start, data, seconds: reported.append((start, len(data))))
+
+    assert sorted(reported) == [(0, 2), (2, 1)]
+    assert len(output) == 3
+    assert output[2]['air_quality']['O3'].endswith('lat=2.0&lon=0.0')
+
+
+async def fake_single_fetch_json(session, rate_limiters, url, headers=None):
+    """Returns a one-location response after a delay, shorter for latitude 0."""
+    latitude = url.split('lat=')[1].split('&')[0] if 'api-ninjas' in url \
+        else url.split('latitude=')[1].split('&')[0]
+    await asyncio.sleep(0.01 if latitude == '0.0' else 0.1)
+    return {'O3': None} if 'api-ninjas' in url else {'hourly': None}
+
+
+@patch('extract.HOST_REQUESTS_PER_SECOND', {'api.open-meteo.com': 1000,
+                                            'api.api-ninjas.com': 1000})
+@patch('extract.fetch_json', side_effect=fake_single_fetch_json)
+def test_slow_batch_report_does_not_stall_other_fetches(mock_fetch_json):
+    """Test that a report blocked waiting for the load workers neither holds up the
+    other batches' requests nor adds to their fetch times."""
+    locations = [{'latitude': float(i), 'longitude': 0.0} for i in range(4)]
+    reported = {}
+
+    def slow_on_batch(start, data, seconds):
+        reported[start] = seconds
+        if start == 0:
+            sleep(0.5)
+
+    batch_api_calls(locations, {'API_KEY': 'key'}, batch_size=1, on_batch=slow_on_batch)
+
+    assert sorted(reported) == [0, 1, 2, 3]
+    assert max(reported[start] for start in (1, 2, 3)) < 0.3
+
+
+@patch('extract.HOST_REQUESTS_PER_SECOND', {'api.open-meteo.com': 1000,
+                                            'api.api-ninjas.com': 1000})
+@patch('extract.fetch_json')
+def test_batches_in_flight_are_limited(mock_fetch_json):
+    """Test that no more than max_in_flight batches are fetched or waiting to be
+    reported at once."""
+    locations = [{'latitude': float(i), 'longitude': 0.0} for i in range(4)]
+    fetching, most_fetching = set(), []
+
+    async def tracked_fetch_json(session, rate_limiters, url, headers=None):
+        latitude = url.split('lat=')[1].split('&')[0] if 'api-ninjas' in url \
+            else url.split('latitude=')[1].split('&')[0]
+        fetching.add(latitude)
+        most_fetching.append(len(fetching))
+        response = await fake_single_fetch_json(session, rate_limiters, url, headers)
+        return response
+    mock_fetch_json.side_effect = tracked_fetch_json
+
+    def on_batch(start, data, seconds):
+        fetching.discard(str(float(start)))
+
+    batch_api_calls(locations, {'API_KEY': 'key'}, batch_size=1, on_batch=on_batch,
+                    max_in_flight=2)
+
+    assert max(most_fetching) == 2
+
+
+@patch('extract.fetch_json')
+def test_batch_api_calls_skips_hourly_when_not_due(mock_fetch_json):
+    """Test that each hourly window is fetched once and cells needing none get None."""
+    locations = [{'latitude': 1.0, 'longitude': 0.0, 'hourly_hours': 0},
+                 {'latitude': 2.0, 'longitude': 0.0, 'hourly_hours': 72},
+                 {'latitude': 3.0, 'longitude': 0.0, 'hourly_hours': 72}]
+
+    async def fake_fetch_json(session, rate_limiters, url, headers=None):
+        if 'hourly=' in url:
+            return [{'hourly': url}, {'hourly': url}]
+        if 'minutely_15=' in url:
+            return [{'minutely_15': None}] * 3
+        return {'O3': None}
+    mock_fetch_json.side_effect = fake_fetch_json
+
+    output = batch_api_calls(locations, {'API_KEY': 'key'})
+
+    hourly_urls = [c.args[2] for c in mock_fetch_json.call_args_list if 'hourly=' in c.args[2]]
+    assert len(hourly_urls) == 1
+    assert 'latitude=2.0,3.0' in hourly_urls[0]
+    assert output[0]['weather_for_week'] is None
+    assert output[1]['weather_for_week'] == output[2]['weather_for_week']
@@ -0,0 +1,84 @@
+"""Tests for the load stage of the weather pipeline."""
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+from load import (FORECAST_COLUMNS, get_forecast_rows, get_changed_weather,
+                  upsert_forecasts, insert_weather_alerts)
+
+
+def make_forecast(timestamp: datetime, temperature: float) -> dict:
+    """Returns a forecast dictionary as produced by the transform stage."""
+    forecast = {column: 0 for column in FORECAST_COLUMNS}
+    forecast["forecast_timestamp"] = timestamp
+    forecast["temperature"] = temperature
+    return forecast
+
+
+def test_get_forecast_rows_keeps_last_duplicate():
+    """Test that only one row per timestamp is staged."""
+    timestamp = datetime(2024, 5, 1, 12)
+    rows = get_forecast_rows([make_forecast(timestamp, 10),
+                              make_forecast(timestamp, 12)], 7, 3)
+    assert len(rows) == 1
+    assert rows[0][FORECAST_COLUMNS.index("temperature")] == 12
+    assert rows[0][-2:] == (7, 3)
+
+
+def test_get_changed_weather():
+    """Test that only forecasts whose hash differs from the stored one are kept."""
+    first, second = datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 13)
+    weather = [{"forecast": {"forecast_timestamp": first, "content_hash": 1}},
+               {"forecast": {"forecast_timestamp": second, "content_hash": 2}}]
+    stored_hashes = {(3, first): 1, (3, second): 5, (4, first): 1}
+
+    assert get_changed_weather(weather, stored_hashes, 3) == weather[1:]
+    assert get_changed_weather(weather, stored_hashes, 4) == weather[1:]
+    assert get_changed_weather(weather, {}, 3) == weather
+
+
+@patch('load.execute_values')
+def test_upsert_forecasts_returns_ids_in_order(mock_execute_values):
+    """Test that the forecast IDs are matched back to the given forecasts."""
+    first, second = datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 13)
+    mock_execute_values.return_value = [
+        {"forecast_id": 20, "forecast_timestamp": second},
+        {"forecast_id": 10, "forecast_timestamp": first}]
+    conn = MagicMock()
+
+    output = upsert_forecasts(conn, [make_forecast(first, 1),
+                                     make_forecast(second, 2),
+                                     make_forecast(first, 3)], 7, 3)
+
+    assert output == [10, 20, 10]
+    assert mock_execute_values.call_count == 1
+    conn.commit.assert_not_called()
+
+
+def test_upsert_forecasts_empty():
+    """Test that no statement is run without forecasts."""
+    conn = MagicMock()
+    assert upsert_forecasts(conn, [], 7, 3) == []
+    conn.cursor.assert_not_called()
+
+
+def test_insert_weather_alerts_in_one_statement():
+    """Test that every alert for a location is inserted with one statement."""
+    weather = [{"warnings": [{"alert_type_id": 1, "severity_type_id": 3},
+                             {"alert_type_id": 8, "severity_type_id": 2}]},
+               {"warnings": None},
+               {"warnings": [{"alert_type_id": 1, "severity_type_id": 3}]}]
+    conn = MagicMock()
+    cur = conn.cursor.return_value.__enter__.return_value
+
+    cur.fetchall.return_value = [{"alert_id": 5}, {"alert_id": 6}]
+
+    assert insert_weather_alerts(conn, weather, [10, 11, 12]) == [5, 6]
+    assert cur.execute.call_count == 1
+    assert cur.execute.call_args.args[1] == ([1, 1, 8], [10, 12, 10], [3, 3, 2])
+
+
+def test_insert_weather_alerts_without_alerts():
+    """Test that no statement is run when there are no alerts."""
+    conn = MagicMock()
+    assert insert_weather_alerts(conn, [{"warnings": None}], [10]) == []
+    conn.cursor.assert_not_called()
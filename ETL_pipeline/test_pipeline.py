@@ -0,0 +1,109 @@
+"""Tests for the pipelined handler of the weather pipeline."""
+from queue import Queue
+from threading import Thread
+from unittest.mock import patch, MagicMock
+
+from psycopg2 import OperationalError
+
+from pipeline import extract_stage, load_stage, handler
+
+
+@patch('pipeline.batch_api_calls')
+def test_extract_stage_queues_cells_then_stops_workers(mock_batch_api_calls):
+    """Test that every cell is queued with its locations and its batch's fetch time,
+    followed by a stop per worker."""
+    event = [{"loc_ids": [1, 2]}, {"loc_ids": [3]}]
+
+    def fake_batch_api_calls(locations, config, batch_size, on_batch, max_in_flight):
+        on_batch(1, ["second"], 0.5)
+        on_batch(0, ["first"], 0.25)
+    mock_batch_api_calls.side_effect = fake_batch_api_calls
+    stage_queue = Queue()
+
+    extract_stage(event, {}, stage_queue, 1, 2)
+
+    queued = [stage_queue.get() for _ in range(4)]
+    assert queued == [([3], "second", 0.5), ([1, 2], "first", 0.25), None, None]
+
+
+@patch('pipeline.batch_api_calls', side_effect=TimeoutError)
+def test_extract_stage_stops_workers_on_error(mock_batch_api_calls):
+    """Test that the workers are still told to stop if the extract fails."""
+    stage_queue = Queue()
+    try:
+        extract_stage([], {}, stage_queue, 10, 3)
+    except TimeoutError:
+        pass
+    assert [stage_queue.get() for _ in range(3)] == [None, None, None]
+
+
+@patch('pipeline.pipeline')
+@patch('pipeline.db_connection')
+def test_load_stage_loads_until_stopped(mock_db_connection, mock_pipeline):
+    """Test that a worker loads every queued cell and splits its time between locations."""
+    mock_db_connection.return_value.__enter__.return_value = MagicMock()
+    mock_pipeline.side_effect = [(3, 4), (0, 2)]
+    stage_queue = Queue()
+    stage_queue.put(([1, 2], "first", 1.0))
+    stage_queue.put(([3], "second", 0.5))
+    stage_queue.put(None)
+    stage_queue.put(([4], "never loaded", 0.5))
+
+    seconds, skipped, total = load_stage({}, stage_queue)
+
+    assert mock_pipeline.call_count == 2
+    assert set(seconds) == {1, 2, 3}
+    assert seconds[1] == seconds[2] >= 0.5
+    assert seconds[3] >= 0.5
+    assert (skipped, total) == (3, 6)
+
+
+@patch('pipeline.pipeline', side_effect=ValueError)
+@patch('pipeline.db_connection')
+def test_failed_load_stage_drains_the_queue(mock_db_connection, mock_pipeline):
+    """Test that a worker which fails keeps emptying the queue until told to stop,
+    so a bounded queue cannot block the extract."""
+    mock_db_connection.return_value.__enter__.return_value = MagicMock()
+    stage_queue = Queue()
+    for cell in [([1], "first", 0.5), ([2], "second", 0.5), None]:
+        stage_queue.put(cell)
+
+    try:
+        load_stage({}, stage_queue)
+    except ValueError:
+        pass
+
+    assert mock_pipeline.call_count == 1
+    assert stage_queue.empty()
+
+
+@patch('pipeline.batch_api_calls')
+@patch('pipeline.schedule_refreshes', side_effect=lambda conn, event: event)
+@patch('pipeline.db_connection')
+@patch('pipeline.load_dotenv')
+def test_handler_raises_when_load_workers_cannot_connect(mock_load_dotenv, mock_db_connection,
+                                                         mock_schedule_refreshes,
+                                                         mock_batch_api_calls, monkeypatch):
+    """Test that load workers which cannot connect still drain the bounded queue,
+    so the handler raises their error instead of hanging."""
+    monkeypatch.setenv("PIPELINE_WORKERS", "2")
+    event = [{"loc_ids": [i]} for i in range(40)]
+
+    def fake_batch_api_calls(locations, config, batch_size, on_batch, max_in_flight):
+        for first in range(0, len(locations), batch_size):
+            on_batch(first, ["data"] * batch_size, 0.1)
+    mock_batch_api_calls.side_effect = fake_batch_api_calls
+    mock_db_connection.side_effect = [MagicMock(), OperationalError, OperationalError]
+    raised = []
+
+    def run_handler():
+        try:
+            handler(event)
+        except OperationalError as error:
+            raised.append(error)
+    thread = Thread(target=run_handler, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert len(raised) == 1
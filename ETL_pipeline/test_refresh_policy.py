@@ -0,0 +1,54 @@
+"""Tests for the forecast refresh policy of the weather pipeline."""
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+from refresh_policy import (is_due, get_hourly_hours, get_horizon,
+                            measure_volatility, get_refresh_minutes)
+
+NOW = datetime(2024, 5, 1, 12, 2)
+
+
+def test_is_due():
+    """Test that a horizon is due once its refresh interval has (nearly) passed."""
+    assert is_due(None, NOW)
+    assert is_due({"refreshed_at": NOW - timedelta(minutes=57),
+                   "refresh_minutes": 60}, NOW)
+    assert not is_due({"refreshed_at": NOW - timedelta(minutes=15),
+                       "refresh_minutes": 60}, NOW)
+
+
+def test_get_hourly_hours_fetches_to_the_furthest_due_horizon():
+    """Test that a cell's hourly window ends at the furthest horizon due for any location."""
+    recent = {"refreshed_at": NOW, "refresh_minutes": 60}
+    policies = {1: {"day_2_3": recent, "day_4_7": recent},
+                2: {"day_2_3": recent}}
+    assert get_hourly_hours(policies, [1], NOW) == 0
+    assert get_hourly_hours(policies, [1, 2], NOW) == 168
+    assert get_hourly_hours({1: {"day_4_7": recent}}, [1], NOW) == 72
+
+
+def test_get_horizon():
+    """Test that forecast timestamps are placed in their horizon."""
+    assert get_horizon(NOW + timedelta(hours=3), NOW) is None
+    assert get_horizon(NOW + timedelta(hours=30), NOW) == "day_2_3"
+    assert get_horizon(NOW + timedelta(hours=100), NOW) == "day_4_7"
+
+
+def test_measure_volatility():
+    """Test that volatility is the largest change in each horizon relative to the volatile change."""
+    near, far = NOW + timedelta(hours=30), NOW + timedelta(hours=100)
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value.fetchall.return_value = [
+        {"forecast_timestamp": near, "temperature": 10.0, "precipitation_prob": 50}]
+    forecasts = [{"forecast_timestamp": NOW, "temperature": 0.0, "precipitation_prob": 0},
+                 {"forecast_timestamp": near, "temperature": 13.0, "precipitation_prob": 60},
+                 {"forecast_timestamp": far, "temperature": 5.0, "precipitation_prob": 0}]
+
+    assert measure_volatility(conn, 1, forecasts, NOW) == {"day_2_3": 1.5, "day_4_7": 0.0}
+
+
+def test_get_refresh_minutes():
+    """Test that volatile horizons are refreshed twice as often."""
+    assert get_refresh_minutes("day_4_7", 0.5) == 180
+    assert get_refresh_minutes("day_4_7", 1.0) == 90
+    assert get_refresh_minutes("day_2_3", 3.0) == 30
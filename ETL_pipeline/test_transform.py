@@ -0,0 +1,123 @@
+"""Tests for the transform stage of the weather pipeline."""
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from transform import (ALERT_THRESHOLDS, classify_alerts, get_warning_array,
+                       create_warning_lists, create_warning_list, get_weather_alerts,
+                       get_content_hashes, merge_resolutions, gather_weather_data)
+
+BOUNDARY_VALUES = [np.nan, -20, -10, -9.9, -5, -4, -3, -1, 0, 0.05, 0.1, 0.5, 1, 2,
+                   2.5, 3, 5, 6, 8, 10, 11, 20, 21, 22, 27, 32, 49, 50, 65, 80, 90,
+                   110, 130, 149, 150, 1000]
+
+
+def make_weather_data(values: list[float]) -> pd.DataFrame:
+    """Returns a weather dataframe with every alert column set to the given values,
+    and the wind gusts and speeds paired in every combination."""
+    gusts, speeds = np.meshgrid(values, values)
+    size = gusts.size
+    data = pd.DataFrame({'forecast_timestamp': [datetime.now()] * size,
+                         'wind_gusts': gusts.ravel(), 'wind_speed': speeds.ravel()})
+    for column in ['temperature', 'lightning_potential', 'snowfall',
+                   'visibility', 'uv_index', 'rainfall']:
+        data[column] = np.resize(values, size)
+    return data
+
+
+def test_classify_alerts_matches_scalar_functions():
+    """Test that the vectorised thresholds agree with the scalar alert functions."""
+    data = make_weather_data(BOUNDARY_VALUES)
+    expected = get_weather_alerts(data)
+    output = classify_alerts(data)
+    assert list(expected.columns) == [name for name, _ in ALERT_THRESHOLDS]
+    assert (output == expected.to_numpy()).all()
+
+
+def test_classify_alerts_ignores_later_forecasts():
+    """Test that forecasts beyond twelve hours have no alerts."""
+    data = make_weather_data([40])
+    data['forecast_timestamp'] = datetime.now() + timedelta(hours=13)
+    assert (classify_alerts(data) == 4).all()
+
+
+def test_create_warning_lists_matches_create_warning_list():
+    """Test that the long-format alerts give the same warnings per forecast."""
+    data = make_weather_data(BOUNDARY_VALUES)
+    expected = [create_warning_list(alerts) for alerts
+                in get_weather_alerts(data).itertuples(index=False, name=None)]
+    output = create_warning_lists(get_warning_array(classify_alerts(data)), len(data))
+    assert output == expected
+
+
+@pytest.mark.parametrize("severities,expected", [
+    ([[4, 2, 4, 4, 4, 4, 4, 1]], [[0, 2, 2], [0, 8, 1]]),
+    ([[4] * 8], np.empty((0, 3)))])
+def test_get_warning_array(severities, expected):
+    """Test that only alerts in force appear in the long-format array."""
+    output = get_warning_array(np.array(severities))
+    assert output.shape[1] == 3
+    assert (output == np.array(expected)).all()
+
+
+def test_get_content_hashes_change_with_values_and_alerts():
+    """Test that a forecast's hash only changes when its values or alerts change."""
+    data = make_weather_data([1, 2, 3])
+    severities = classify_alerts(data)
+    hashes = get_content_hashes(data, severities)
+
+    assert all(-2 ** 63 <= content_hash < 2 ** 63 for content_hash in hashes)
+    assert get_content_hashes(data.copy(), severities.copy()) == hashes
+
+    data.loc[0, 'temperature'] = 30
+    changed = get_content_hashes(data, severities)
+    assert changed[0] != hashes[0]
+    assert changed[1:] == hashes[1:]
+
+    severities[1, 0] = 1
+    assert get_content_hashes(data, severities)[1] != changed[1]
+
+
+def test_merge_resolutions_prefers_finer_forecasts():
+    """Test that overlapping timestamps keep the 15-minutely forecast, once, in time order."""
+    start = datetime(2024, 5, 1, 23)
+    minutely = {'forecast_timestamp': [start + timedelta(minutes=15 * i) for i in range(5)],
+                'temperature': [15.0] * 5, 'resolution': [15] * 5}
+    hourly = {'forecast_timestamp': [start + timedelta(hours=i) for i in range(3)],
+              'temperature': [60.0] * 3, 'resolution': [60] * 3}
+
+    merged = merge_resolutions([hourly, minutely])
+
+    assert merged['forecast_timestamp'] == sorted(set(merged['forecast_timestamp']))
+    assert len(merged['forecast_timestamp']) == 6
+    assert merged['resolution'] == [15] * 5 + [60]
+    assert merged['temperature'][4] == 15.0
+
+
+def test_gather_weather_data_without_pandas():
+    """Test that a report is transformed from the API columns without importing pandas."""
+    start = datetime.now().replace(minute=0, second=0, microsecond=0)
+    columns = ['temperature_2m', 'wind_gusts_10m', 'wind_speed_10m', 'snowfall',
+               'uv_index', 'rain', 'relative_humidity_2m']
+
+    def api_block(step: timedelta, count: int) -> dict:
+        block = {'time': [(start + step * i).isoformat(timespec='minutes')
+                          for i in range(count)],
+                 'visibility': [10000.0] * count, 'lightning_potential': [None] * count}
+        block.update({column: [30.0] * count for column in columns})
+        return block
+
+    with patch.dict(sys.modules, {'pandas': None}):
+        weather = gather_weather_data({'minutely_15': api_block(timedelta(minutes=15), 8)},
+                                      {'hourly': api_block(timedelta(hours=1), 4)})
+
+    assert len(weather) == 10
+    assert weather[0]['forecast']['forecast_timestamp'] == start
+    assert weather[0]['forecast']['visibility'] == 10000
+    assert weather[0]['forecast']['lightning_potential'] == 0
+    assert {'alert_type_id': 1, 'severity_type_id': 2} in weather[0]['warnings']
+    assert [w['forecast']['resolution'] for w in weather] == [15] * 8 + [60, 60]
@@ -1,29 +1,59 @@
-"""Transform a JSON of a single weather report into a list of dictionaries for use in load.py"""
-from datetime import datetime, timedelta
-from itertools import zip_longest
-
-import pandas as pd
-
-
-def rename_columns(data: pd.DataFrame) -> pd.DataFrame:
-    """Rename the dataframe columns to match database."""
-    data = data.rename(columns={'time': 'forecast_timestamp',
-                                'relative_humidity_2m': 'humidity',
-                                'precipitation_probability': 'precipitation_prob',
-                                'rain': 'rainfall',
-                                'temperature_2m': 'temperature',
-                                'wind_direction_10m': 'wind_direction',
-                                'wind_gusts_10m': 'wind_gusts',
-                                'wind_speed_10m': 'wind_speed',
-                                'weather_code': 'weather_code_id'})
-    return data
+"""Transform a JSON of a single weather report into a list of dictionaries for use in load.py
 
-
-def change_data_types(data: pd.DataFrame) -> pd.DataFrame:
+A report only holds a few hundred forecasts, so they are kept as columns of plain
+lists with NumPy for the alert thresholds; pandas is only imported by the scalar
+reference functions, which the Lambda never calls."""
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from operator import ge, le, lt
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+NO_ALERT = 4
+RESOLUTION_MINUTES = {'minutely_15': 15, 'hourly': 60}
+
+# Thresholds for each weather alert, in alert_type_id order (see emergencies.txt).
+# Each alert lists the columns it is measured on with the (comparison, threshold)
+# for a severe warning, warning and alert; a row takes the most severe level any
+# of its columns reach, mirroring the calculate_*_alerts functions.
+ALERT_THRESHOLDS = (
+    ('heat_warning', (('temperature', ((ge, 32), (ge, 27), (ge, 22))),)),
+    ('wind_warning', (('wind_gusts', ((ge, 130), (ge, 110), (ge, 90))),
+                      ('wind_speed', ((ge, 80), (ge, 65), (ge, 50))))),
+    ('ice_warning', (('temperature', ((le, -10), (lt, -5), (lt, -3))),)),
+    ('lightning_warning', (('lightning_potential', ((ge, 2.5), (ge, 1), (ge, 0))),)),
+    ('snowfall_warning', (('snowfall', ((ge, 2), (ge, 0.5), (ge, 0.1))),)),
+    ('visibility_warning', (('visibility', ((le, 20), (lt, 50), (lt, 150))),)),
+    ('uv_warning', (('uv_index', ((ge, 11), (ge, 8), (ge, 6))),)),
+    ('rainfall_warning', (('rainfall', ((ge, 10), (ge, 5), (ge, 3))),))
+)
+
+
+COLUMN_NAMES = {'time': 'forecast_timestamp',
+                'relative_humidity_2m': 'humidity',
+                'precipitation_probability': 'precipitation_prob',
+                'rain': 'rainfall',
+                'temperature_2m': 'temperature',
+                'wind_direction_10m': 'wind_direction',
+                'wind_gusts_10m': 'wind_gusts',
+                'wind_speed_10m': 'wind_speed',
+                'weather_code': 'weather_code_id'}
+
+
+def rename_columns(data: dict[str, list]) -> dict[str, list]:
+    """Rename the columns to match database."""
+    return {COLUMN_NAMES.get(column, column): values for column, values in data.items()}
+
+
+def change_data_types(data: dict[str, list]) -> dict[str, list]:
     """Convert incorrect datatypes to match database."""
-    data['forecast_timestamp'] = data['forecast_timestamp'].apply(
-        pd.to_datetime)
-    data['visibility'] = data['visibility'].apply(int)
+    data['forecast_timestamp'] = [datetime.fromisoformat(timestamp)
+                                  for timestamp in data['forecast_timestamp']]
+    data['visibility'] = [int(visibility) for visibility in data['visibility']]
     return data
 
 
@@ -72,7 +102,7 @@ def calculate_ice_alerts(temperature: float) -> int:
     return 4
 
 
-def calculate_lightning_alerts(lightning: pd.Series) -> int:
+def calculate_lightning_alerts(lightning: 'pd.Series') -> int:
     """Find extreme lightning alerts amongst lightning potential data."""
     if 2.5 <= lightning:
         return 1
@@ -83,7 +113,7 @@ def calculate_lightning_alerts(lightning: pd.Series) -> int:
     return 4
 
 
-def calculate_snowfall_alerts(snowfall: pd.Series) -> int:
+def calculate_snowfall_alerts(snowfall: 'pd.Series') -> int:
     """Find extreme lightning alerts amongst lightning potential data."""
     if 2 <= snowfall:
         return 1
@@ -94,7 +124,7 @@ def calculate_snowfall_alerts(snowfall: pd.Series) -> int:
     return 4
 
 
-def calculate_visibility_alerts(visibility: pd.Series) -> int:
+def calculate_visibility_alerts(visibility: 'pd.Series') -> int:
     """Find low visibility alerts amongst visibility data."""
     if visibility <= 20:
         return 1
@@ -138,8 +168,10 @@ def calculate_rain_alerts(rainfall: float) -> int:
     return 4
 
 
-def get_weather_alerts(weather_data: pd.DataFrame) -> pd.DataFrame:
-    """Obtain a dataframe of alerts for a forecast."""
+def get_weather_alerts(weather_data: 'pd.DataFrame') -> 'pd.DataFrame':
+    """Obtain a dataframe of alerts for a forecast with the scalar alert functions,
+    the reference implementation for classify_alerts."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
     alerts = pd.DataFrame()
     twelve_hour_data = weather_data[weather_data['forecast_timestamp'] < datetime.now(
     ) + timedelta(hours=12)]
@@ -162,25 +194,110 @@ def get_weather_alerts(weather_data: pd.DataFrame) -> pd.DataFrame:
     return alerts
 
 
-def gather_data_from_json(json_data: dict, key: str) -> list[dict]:
-    """Obtain transformed forecast data from hourly or 15-minutely data."""
-    data = pd.DataFrame(json_data[key])
-    data['lightning_potential'] = data['lightning_potential'].fillna(0)
-    data = rename_columns(data)
+def get_timestamps(weather_data: 'dict[str, list] | pd.DataFrame') -> np.ndarray:
+    """Obtain the forecast timestamps as a NumPy datetime array."""
+    return np.asarray(weather_data['forecast_timestamp'], dtype='datetime64[us]')
+
+
+def classify_alerts(weather_data: 'dict[str, list] | pd.DataFrame') -> np.ndarray:
+    """Obtain an array of severity levels with a row per forecast and a column per
+    alert type, for forecasts in the next twelve hours; later forecasts have no alerts."""
+    timestamps = get_timestamps(weather_data)
+    within_twelve_hours = timestamps < np.datetime64(datetime.now() + timedelta(hours=12))
+    severities = np.full((len(timestamps), len(ALERT_THRESHOLDS)), NO_ALERT)
+    for i, (_, measurements) in enumerate(ALERT_THRESHOLDS):
+        levels = np.full(len(timestamps), NO_ALERT)
+        for column, thresholds in measurements:
+            values = np.asarray(weather_data[column], dtype=float)
+            levels = np.minimum(levels, np.select(
+                [compare(values, threshold) for compare, threshold in thresholds],
+                [1, 2, 3], default=NO_ALERT))
+        severities[:, i] = np.where(within_twelve_hours, levels, NO_ALERT)
+    return severities
+
+
+def get_warning_array(severities: np.ndarray) -> np.ndarray:
+    """Obtain the alerts in long format, one (forecast position, alert_type_id,
+    severity_level_id) row per alert that is in force."""
+    rows, alert_types = np.nonzero(severities != NO_ALERT)
+    return np.column_stack((rows, alert_types + 1, severities[rows, alert_types]))
+
+
+def create_warning_lists(warnings: np.ndarray, forecast_count: int) -> list[list[dict]]:
+    """Create the list of weather warnings for each forecast from long-format alerts."""
+    warning_lists = [None] * forecast_count
+    for row, alert_type_id, severity in warnings.tolist():
+        if warning_lists[row] is None:
+            warning_lists[row] = []
+        warning_lists[row].append(
+            {'alert_type_id': alert_type_id, 'severity_type_id': severity})
+    return warning_lists
+
+
+def get_content_hashes(weather_data: 'dict[str, list] | pd.DataFrame',
+                       severities: np.ndarray) -> list[int]:
+    """Obtain a 64-bit hash of each forecast's values and alert severities, so the
+    loader can tell which forecasts differ from the ones already stored."""
+    columns = sorted(column for column in weather_data
+                     if column not in ('forecast_timestamp', 'content_hash'))
+    content = np.column_stack(
+        [get_timestamps(weather_data).view(np.int64).view(np.float64)]
+        + [np.asarray(weather_data[column], dtype=float) for column in columns]
+        + [severities.astype(float)])
+    return [int.from_bytes(blake2b(row.tobytes(), digest_size=8).digest(),
+                           'little', signed=True)
+            for row in content]
+
+
+def read_forecast_data(json_data: dict, key: str) -> dict[str, list]:
+    """Obtain the columns of hourly or 15-minutely forecasts, tagged with their
+    resolution in minutes."""
+    data = rename_columns(json_data[key])
+    data['lightning_potential'] = [0 if lightning is None else lightning
+                                   for lightning in data['lightning_potential']]
     data = change_data_types(data)
-    alerts = get_weather_alerts(data)
-    forecasts = data.to_dict(orient="records")
-    warnings = alerts.itertuples(index=False, name=None)
-    forecast_warnings = (create_warning_list(forecast)
-                         for forecast in warnings)
+    data['resolution'] = [RESOLUTION_MINUTES[key]] * len(data['forecast_timestamp'])
+    return data
+
+
+def merge_resolutions(forecast_data: list[dict[str, list]]) -> dict[str, list]:
+    """Merge forecasts of different resolutions into one time index with a single
+    forecast per timestamp, preferring the finest resolution where they overlap."""
+    chosen = {}
+    for source, data in enumerate(forecast_data):
+        for row, (timestamp, resolution) in enumerate(zip(data['forecast_timestamp'],
+                                                          data['resolution'])):
+            if timestamp not in chosen or resolution < chosen[timestamp][0]:
+                chosen[timestamp] = (resolution, source, row)
+    order = [chosen[timestamp] for timestamp in sorted(chosen)]
+    return {column: [forecast_data[source][column][row] for _, source, row in order]
+            for column in forecast_data[0]}
+
+
+def gather_data_from_columns(data: dict[str, list]) -> list[dict]:
+    """Obtain transformed forecast data, with warnings, from forecast columns."""
+    severities = classify_alerts(data)
+    warnings = get_warning_array(severities)
+    data['content_hash'] = get_content_hashes(data, severities)
+    forecasts = [dict(zip(data, row)) for row in zip(*data.values())]
+    forecast_warnings = create_warning_lists(warnings, len(forecasts))
     return list({'forecast': x, 'warnings': y} for x, y
-                in zip_longest(forecasts, forecast_warnings))
+                in zip(forecasts, forecast_warnings))
+
+
+def gather_data_from_json(json_data: dict, key: str) -> list[dict]:
+    """Obtain transformed forecast data from hourly or 15-minutely data."""
+    return gather_data_from_columns(read_forecast_data(json_data, key))
 
 
-def gather_weather_data(minutely_data: dict, hourly_data: dict) -> list[dict]:
-    """Obtain transformed forecast data for the whole weather report."""
-    return gather_data_from_json(minutely_data, 'minutely_15') +\
-        gather_data_from_json(hourly_data, 'hourly')
+def gather_weather_data(minutely_data: dict, hourly_data: dict | None) -> list[dict]:
+    """Obtain transformed forecast data for the whole weather report, with one
+    forecast per timestamp so the loader never sees the same timestamp twice.
+    hourly_data is None when no hourly forecast was due to be refreshed."""
+    forecast_data = [read_forecast_data(minutely_data, 'minutely_15')]
+    if hourly_data is not None:
+        forecast_data.append(read_forecast_data(hourly_data, 'hourly'))
+    return gather_data_from_columns(merge_resolutions(forecast_data))
 
 
 def gather_air_quality(air_quality_data: dict) -> dict:
@@ -46,6 +46,7 @@ def submit_location():
     conn = get_db_connection(ENV)
     setup_user_location(details, name, email,
                         sub_newsletter, sub_alerts, password, conn)
+    conn.close()
     return jsonify({'message': 'User location added successfully'}), SUCCESS_CODE
 
 
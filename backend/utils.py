@@ -1,6 +1,18 @@
 """This file, provides the functions needed to fetch the data."""
+from functools import cache
+from typing import TYPE_CHECKING
+
 import requests
-from geopy.geocoders import Nominatim
+
+if TYPE_CHECKING:
+    from geopy.geocoders import Nominatim
+
+
+@cache
+def get_geolocator() -> 'Nominatim':
+    """Returns the geolocator, importing geopy the first time it is needed."""
+    from geopy.geocoders import Nominatim  # pylint: disable=import-outside-toplevel
+    return Nominatim(user_agent="my_application")
 
 
 def get_details_from_post_code(postcode: str) -> dict:
@@ -47,8 +59,7 @@ def get_country(address: dict) -> str:
 
 def get_location_names(longitude: float, latitude: float) -> tuple[str]:
     """Extract the location names from a longitude and latitude."""
-    geolocator = Nominatim(user_agent="my_application")
-    location_obj = geolocator.reverse(
+    location_obj = get_geolocator().reverse(
         f"{latitude}, {longitude}")
     address = location_obj.raw['address']
     country = get_country(address)
@@ -63,6 +74,5 @@ def get_location_names(longitude: float, latitude: float) -> tuple[str]:
 
 def get_standard_long_lat(location: str) -> tuple[float]:
     """Get the latitude and longitude from a location."""
-    geolocator = Nominatim(user_agent="my_application")
-    location_details = geolocator.geocode(location)
+    location_details = get_geolocator().geocode(location)
     return round(location_details.longitude, 7), round(location_details.latitude, 7)
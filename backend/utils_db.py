@@ -1,8 +1,12 @@
 """This file provides useful functions needed to do database related things."""
+from typing import TYPE_CHECKING
+
 from psycopg2 import connect
 from psycopg2.extensions import connection
 from utils import get_standard_long_lat, get_postcode_long_lat, get_location_names
-import pandas as pd
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 ERROR_CODE = -1
 
@@ -85,8 +89,6 @@ def setup_user_location(details, name, email, sub_newsletter, sub_alerts, passwo
                      'report_opt_in': sub_newsletter, 'alert_opt_in': sub_alerts}
     add_to_database('user_location_assignment',
                     user_loc_data, conn)
-
-    conn.close()
     return None
 
 
@@ -115,8 +117,9 @@ def check_row_exists(conn: connection, table_name: str, column1: str, value1: st
     return bool(exists)
 
 
-def query_to_df(conn: connection, query: str) -> pd.DataFrame:
+def query_to_df(conn: connection, query: str) -> 'pd.DataFrame':
     """Executes a SQL query and returns the results as a pandas DataFrame."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
     with conn.cursor() as cur:
         cur.execute(query)
         rows = cur.fetchall()
@@ -125,7 +128,7 @@ def query_to_df(conn: connection, query: str) -> pd.DataFrame:
     return pd.DataFrame(rows, columns=columns)
 
 
-def get_locations_for_user(conn: connection, email: str) -> pd.DataFrame:
+def get_locations_for_user(conn: connection, email: str) -> 'pd.DataFrame':
     """This gets the locations associated with a particular user."""
     user_details_query = """
         SELECT *
@@ -157,6 +160,7 @@ def update_loc_assignment(conn: connection, _id_name: str, _id: int, column: str
 def delete_user(conn: connection, _id: int) -> None:
     """Deletes a users records."""
     with conn.cursor() as cur:
+        cur.execute("DELETE FROM alert_outbox WHERE user_id = %s;", (_id,))
         cur.execute(
             "DELETE FROM user_location_assignment WHERE user_id = %s;", (_id,))
         cur.execute("DELETE FROM user_details WHERE user_id = %s;", (_id,))
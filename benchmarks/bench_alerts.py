@@ -0,0 +1,60 @@
+"""Benchmark the weather alert classification against the scalar alert functions.
+
+Run from the repository root with `python benchmarks/bench_alerts.py`."""
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from timeit import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'ETL_pipeline'))
+
+from transform import (classify_alerts, create_warning_list, create_warning_lists,  # pylint: disable=wrong-import-position
+                       get_warning_array, get_weather_alerts)
+
+ROWS = 10_000
+REPEATS = 5
+
+
+def make_weather_data(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Returns a random weather dataframe with every forecast in the alert window."""
+    rng = np.random.default_rng(seed)
+    start = datetime.now()
+    return pd.DataFrame({
+        'forecast_timestamp': [start + timedelta(seconds=i) for i in range(rows)],
+        'temperature': rng.uniform(-15, 35, rows),
+        'wind_gusts': rng.uniform(0, 150, rows),
+        'wind_speed': rng.uniform(0, 90, rows),
+        'lightning_potential': rng.uniform(0, 3, rows),
+        'snowfall': rng.uniform(0, 3, rows),
+        'visibility': rng.uniform(0, 30000, rows),
+        'uv_index': rng.uniform(0, 12, rows),
+        'rainfall': rng.uniform(0, 12, rows)})
+
+
+def scalar_warnings(data: pd.DataFrame) -> list:
+    """Returns the warnings per forecast using the scalar alert functions."""
+    return [create_warning_list(alerts) for alerts
+            in get_weather_alerts(data).itertuples(index=False, name=None)]
+
+
+def vectorised_warnings(data: pd.DataFrame) -> list:
+    """Returns the warnings per forecast using the alert threshold table."""
+    return create_warning_lists(get_warning_array(classify_alerts(data)), len(data))
+
+
+def main() -> None:
+    """Times both implementations and prints the speedup."""
+    data = make_weather_data(ROWS)
+    assert scalar_warnings(data) == vectorised_warnings(data)
+    scalar = timeit(lambda: scalar_warnings(data), number=REPEATS) / REPEATS
+    vectorised = timeit(lambda: vectorised_warnings(data),
+                        number=REPEATS) / REPEATS
+    print(f"{ROWS} rows: scalar {scalar * 1000:.1f} ms, "
+          f"vectorised {vectorised * 1000:.1f} ms, speedup {scalar / vectorised:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
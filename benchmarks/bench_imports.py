@@ -0,0 +1,64 @@
+"""Benchmark how long each handler module takes to import, as on a Lambda cold start.
+
+Every import runs in a fresh interpreter with the handler's directory and common/
+on the path, as in its image. Run from the repository root with
+`python benchmarks/bench_imports.py`."""
+import json
+import subprocess
+import sys
+from os import pathsep
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+REPEATS = 5
+
+# (directory, module) of every handler; the backend is a Flask app rather than a Lambda.
+HANDLERS = {
+    "pipeline": ("ETL_pipeline", "pipeline"),
+    "location_splitter": ("location_splitter", "location_splitter"),
+    "flood": ("flood_ETL", "pipeline_flood"),
+    "email_alerts": ("email_alerts", "send_email"),
+    "daily_report": ("daily_report", "report"),
+    "delete_old": ("delete_old", "delete"),
+    "backend": ("backend", "app"),
+}
+
+# Modules slow enough to import that handlers should only load them when needed.
+HEAVY_MODULES = ("pandas", "geopy", "aioboto3", "boto3", "numpy")
+
+IMPORT_SCRIPT = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+print(json.dumps({{"seconds": perf_counter() - start,
+                  "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def time_import(directory: str, module: str) -> dict:
+    """Returns the seconds to import a module in a fresh interpreter and the heavy
+    modules it loaded."""
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=ROOT / directory, capture_output=True, text=True, check=True,
+        env={"PYTHONPATH": pathsep.join([str(ROOT / directory), str(ROOT / "common")]),
+             "PYTHONDONTWRITEBYTECODE": "1"})
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    """Times the import of every handler, keeping the fastest of REPEATS runs."""
+    for name, (directory, module) in HANDLERS.items():
+        try:
+            runs = [time_import(directory, module) for _ in range(REPEATS)]
+        except subprocess.CalledProcessError as error:
+            print(f"{name:<18} failed to import: {error.stderr.strip().splitlines()[-1]}")
+            continue
+        best = min(run["seconds"] for run in runs)
+        heavy = ", ".join(runs[0]["heavy"]) or "none"
+        print(f"{name:<18} {best * 1000:7.1f} ms   heavy modules: {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Benchmark the database-bound stages at multiples of today's data volume.
+
+For each scale a throwaway database is filled by synthetic_data.py, then the
+pipeline load of one Lambda's chunk, the email alerts, the daily report, the
+dashboard's location page queries and the delete job are timed against it, in that
+order as the delete job removes the history. External APIs answer from the replay
+fixtures (see replay/replay_stubs.py). The handlers' span metrics are collected in the
+JSON written by --output.
+
+The database round trips each stage makes per location are compared with the
+budget in round_trip_budget.json, and the run fails if any stage makes more than
+ROUND_TRIP_TOLERANCE over its budget at a scale; --update-budget records the
+round trips measured instead, after a change that is meant to alter them.
+
+Run from the repository root with `python benchmarks/bench_scale.py`. Databases are
+created as by replay/replay.py: on a temporary cluster with the initdb on the PATH
+(or --pg-bin), or with --use-env-server on the server in the DB_* variables."""
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from os import environ as ENV
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from dotenv import load_dotenv
+from psycopg2.errors import QueryCanceled
+from psycopg2.extras import RealDictCursor
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / directory) for directory in
+                ("replay", "benchmarks", "common", "ETL_pipeline", "location_splitter",
+                 "email_alerts", "daily_report", "delete_old", "dashboard")]
+
+# pylint: disable=wrong-import-position
+import delete
+import location_splitter
+import pipeline
+import report
+import send_email
+import synthetic_data
+from metrics import flush_metrics, span
+from query_stats import CountingConnection, get_query_stats, reset_query_stats
+from replay import (REPLAY_CONFIG, connect_to, count_rows, existing_server,
+                    temporary_cluster, throwaway_database)
+from replay_stubs import replayed_services
+# pylint: enable=wrong-import-position
+
+DEFAULT_SCALES = (10, 100, 1000)
+# Grid cells in the pipeline chunk, about a Map Lambda's share at today's size.
+PIPELINE_CELLS = 20
+# Daily reports are formatted for this many recipients and the mean is reported.
+REPORT_SAMPLE = 5
+# Statements running longer than this are cancelled and their stage reported as
+# timed out, so one pathological query plan cannot stall the whole suite.
+DEFAULT_STATEMENT_TIMEOUT = 300
+BUDGET_FILE = Path(__file__).with_name("round_trip_budget.json")
+# Fraction by which a stage's round trips per location may exceed its budget.
+ROUND_TRIP_TOLERANCE = 0.1
+STAGES = ("generate", "pipeline_load", "email_alerts", "daily_report_query",
+          "daily_report_per_email", "dashboard", "delete_old")
+
+
+def time_stage(timings: dict, statements: dict, stage: str, function, *args):
+    """Runs a stage as a span with its output silenced, recording its seconds in the
+    timings, or None if a statement timed out, and its database statements, and
+    returns its result."""
+    reset_query_stats()
+    start = perf_counter()
+    try:
+        with redirect_stdout(StringIO()), span(stage):
+            result = function(*args)
+    except QueryCanceled:
+        print(f"{stage} timed out")
+        timings[stage] = None
+        return None
+    timings[stage] = perf_counter() - start
+    statements[stage] = get_query_stats()["statements"]
+    return result
+
+
+def run_pipeline_load(config: dict) -> int:
+    """Runs the pipeline handler on a chunk of the first PIPELINE_CELLS grid cells,
+    returning the number of locations in it."""
+    conn = connect_to(config, config["DB_NAME"])
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT loc_id, latitude, longitude FROM location ORDER BY loc_id;")
+        locations = cur.fetchall()
+    conn.close()
+    cells = location_splitter.group_by_grid_cell(locations)[:PIPELINE_CELLS]
+    with replayed_services():
+        pipeline.handler(cells)
+    return sum(len(cell["loc_ids"]) for cell in cells)
+
+
+def run_email_alerts(config: dict) -> None:
+    """Drains the alert outbox, sending every recipient's alerts to the replayed SES."""
+    tables = [ENV["WEATHER_WARNING_TABLE"], ENV["AIR_QUALITY_TABLE"], ENV["FLOOD_WARNING_TABLE"]]
+    with replayed_services():
+        send_email.send_to_each_recipient(config, tables)
+
+
+def query_daily_report(config: dict):
+    """Returns the daily report's data frame of users and forecasts."""
+    conn = report.get_db_connection(config)
+    try:
+        return report.prepare_data_frame(conn)
+    finally:
+        conn.close()
+
+
+def format_daily_reports(data, emails: list[str]) -> None:
+    """Formats the daily report of each of the given recipients."""
+    for email in emails:
+        asyncio.run(report.format_forecast_report(data, email))
+
+
+def import_dashboard():
+    """Returns the dashboard's home page module, or None if Streamlit and its
+    charting libraries are not installed."""
+    try:
+        import Home  # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        print(f"Skipping the dashboard: {error}")
+        return None
+    return Home
+
+
+def run_dashboard_queries(home, config: dict, location: str) -> None:
+    """Runs the queries the dashboard's home page makes for a location."""
+    conn = connect_to(config, config["DB_NAME"], CountingConnection)
+    try:
+        home.get_locations(conn)
+        home.get_weather_alerts(conn, location)
+        home.get_air_quality_alerts(conn, location)
+        home.get_current_weather(conn, location)
+        home.get_location_forecast_day(conn, location)
+        home.get_location_forecast_week(conn, location)
+        home.get_air_quality(conn, location)
+        home.get_forecast_data(conn)
+    finally:
+        conn.close()
+
+
+def get_busiest_location(config: dict) -> str:
+    """Returns the name of the location with the most subscribers."""
+    with connect_to(config, config["DB_NAME"]) as conn, conn.cursor() as cur:
+        cur.execute("""SELECT L.loc_name
+                    FROM location AS L
+                    JOIN user_location_assignment AS ULA ON (L.loc_id = ULA.loc_id)
+                    GROUP BY L.loc_id
+                    ORDER BY COUNT(*) DESC
+                    LIMIT 1;""")
+        location = cur.fetchone()[0]
+    conn.close()
+    return location
+
+
+def time_stages(timings: dict, statements: dict, config: dict) -> int:
+    """Times every stage against a filled database, the delete job last, and
+    returns the number of locations loaded by the pipeline."""
+    loaded = time_stage(timings, statements, "pipeline_load", run_pipeline_load, config)
+    time_stage(timings, statements, "email_alerts", run_email_alerts, config)
+
+    data = time_stage(timings, statements, "daily_report_query", query_daily_report, config)
+    if data is not None:
+        emails = list(data["email"].unique()[:REPORT_SAMPLE])
+        time_stage(timings, statements, "daily_report_per_email", format_daily_reports,
+                   data, emails)
+        timings["daily_report_per_email"] /= max(len(emails), 1)
+        del data
+
+    dashboard = import_dashboard()
+    if dashboard is not None:
+        time_stage(timings, statements, "dashboard", run_dashboard_queries, dashboard,
+                   config, get_busiest_location(config))
+
+    time_stage(timings, statements, "delete_old", delete.clear_the_data, config)
+    return loaded
+
+
+def read_metrics(metrics_file: Path) -> list[dict]:
+    """Returns the span metrics the handlers wrote, without their EMF metadata."""
+    if not metrics_file.exists():
+        return []
+    with open(metrics_file, encoding="utf-8") as file:
+        return [{key: value for key, value in json.loads(line).items() if key != "_aws"}
+                for line in file]
+
+
+def get_round_trips(statements: dict, locations: int, loaded: int) -> dict:
+    """Returns the database statements per location of each timed stage, per
+    location loaded for the pipeline load and per location stored otherwise."""
+    return {stage: round(statements[stage] / max(loaded if stage == "pipeline_load"
+                                                  else locations, 1), 3)
+            for stage in STAGES[1:] if stage in statements}
+
+
+def benchmark_scale(config: dict, scale: int, history_days: int,
+                    statement_timeout: int) -> dict:
+    """Fills a database to a scale and times every stage against it, returning the
+    timings, the row counts before the delete job and the round trips per location."""
+    timings, statements = {}, {}
+    with TemporaryDirectory(prefix="bench-metrics-") as directory:
+        metrics_file = Path(directory) / "metrics.jsonl"
+        ENV["METRICS_FILE"] = str(metrics_file)
+        try:
+            conn = connect_to(config, config["DB_NAME"])
+            time_stage(timings, statements, "generate", synthetic_data.generate,
+                       conn, scale, history_days)
+            flush_metrics("bench_scale")
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"ALTER DATABASE {config['DB_NAME']} "
+                            f"SET statement_timeout = '{statement_timeout}s';")
+            conn.close()
+            rows = count_rows(config)
+            locations = count_locations(config)
+
+            loaded = time_stages(timings, statements, config)
+            flush_metrics("bench_scale")
+        finally:
+            del ENV["METRICS_FILE"]
+        spans = read_metrics(metrics_file)
+    return {"scale": scale, "rows": rows, "timings": timings, "spans": spans,
+            "round_trips": get_round_trips(statements, locations, loaded or 0)}
+
+
+def count_locations(config: dict) -> int:
+    """Returns the number of locations stored."""
+    with connect_to(config, config["DB_NAME"]) as conn, conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM location;")
+        locations = cur.fetchone()[0]
+    conn.close()
+    return locations
+
+
+def get_regressions(results: list[dict], budget: dict) -> list[str]:
+    """Returns a description of every stage exceeding its round trip budget."""
+    regressions = []
+    for result in results:
+        scale_budget = budget.get(str(result["scale"]), {})
+        for stage, round_trips in result["round_trips"].items():
+            allowed = scale_budget.get(stage)
+            if allowed is not None and round_trips > allowed * (1 + ROUND_TRIP_TOLERANCE):
+                regressions.append(f"{stage} at {result['scale']}x: {round_trips} round trips"
+                                   f" per location, budget {allowed}")
+    return regressions
+
+
+def update_budget(results: list[dict]) -> None:
+    """Records the round trips per location measured at each scale as the budget."""
+    budget = json.loads(BUDGET_FILE.read_text(encoding="utf-8")) if BUDGET_FILE.exists() else {}
+    for result in results:
+        budget[str(result["scale"])] = result["round_trips"]
+    BUDGET_FILE.write_text(json.dumps(budget, indent=2, sort_keys=True) + "\n",
+                           encoding="utf-8")
+
+
+def format_timing(timings: dict, stage: str) -> str:
+    """Returns a stage's time for the results table."""
+    if stage not in timings:
+        return f"{'-':>12}"
+    if timings[stage] is None:
+        return f"{'timed out':>12}"
+    return f"{timings[stage] * 1000:>9.1f} ms"
+
+
+def print_results(results: list[dict]) -> None:
+    """Prints the rows generated and each stage's time at every scale."""
+    print(f"\n{'':<32}" + "".join(f"{result['scale']:>11}x" for result in results))
+    for table in results[0]["rows"]:
+        print(f"{table + ' rows':<32}"
+              + "".join(f"{result['rows'][table]:>12}" for result in results))
+    for stage in STAGES:
+        print(f"{stage:<32}" + "".join(
+            format_timing(result["timings"], stage) for result in results))
+    for stage in STAGES[1:]:
+        print(f"{stage + ' round trips':<32}" + "".join(
+            f"{result['round_trips'].get(stage, '-'):>12}" for result in results))
+
+
+def main() -> None:
+    """Benchmarks every scale on its own throwaway database."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="multiples of today's locations and users")
+    parser.add_argument("--history-days", type=int,
+                        default=synthetic_data.DEFAULT_HISTORY_DAYS)
+    parser.add_argument("--statement-timeout", type=int, default=DEFAULT_STATEMENT_TIMEOUT,
+                        help="seconds after which a stage's statement is cancelled")
+    parser.add_argument("--pg-bin", type=Path,
+                        help="directory containing initdb and pg_ctl")
+    parser.add_argument("--use-env-server", action="store_true",
+                        help="create the throwaway databases on the DB_* server")
+    parser.add_argument("--output", type=Path, help="also write the results as JSON")
+    parser.add_argument("--update-budget", action="store_true",
+                        help="record the round trips measured as the budget")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.use_env_server:
+        server = existing_server()
+    else:
+        initdb = shutil.which("initdb", path=args.pg_bin)
+        if initdb is None:
+            parser.error("initdb not found; pass --pg-bin or --use-env-server")
+        server = temporary_cluster(Path(initdb).parent)
+
+    results = []
+    with server as server_config:
+        for scale in args.scales:
+            with throwaway_database(server_config) as config:
+                ENV.update(REPLAY_CONFIG)
+                ENV.update(config)
+                results.append(benchmark_scale(config, scale, args.history_days,
+                                               args.statement_timeout))
+                print(f"Finished {scale}x")
+
+    print_results(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if args.update_budget:
+        update_budget(results)
+        return
+    budget = json.loads(BUDGET_FILE.read_text(encoding="utf-8")) if BUDGET_FILE.exists() else {}
+    regressions = get_regressions(results, budget)
+    if regressions:
+        sys.exit("Round trips per location regressed:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
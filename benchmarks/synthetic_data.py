@@ -0,0 +1,347 @@
+"""Fill the database with synthetic locations, users and forecast history.
+
+The volumes are a multiple of today's: the 19 metadata locations watched by around
+20 users. Extra locations are scattered around the metadata towns in the same
+counties, and users subscribe to one to three of them, favouring the larger towns.
+Every location gets an hourly weather report with an air quality reading, and
+forecasts every 15 minutes from history_days ago until a day ahead, then hourly
+to the end of the week, as the pipeline stores them. Forecasts follow the season,
+the time of day and a few days of passing weather; their alerts come from the
+pipeline's own thresholds, and alerts, air quality and flood warnings are notified
+except those of the latest pipeline run, which are waiting in the alert outbox.
+
+Run from the repository root against a database created from database/schema.sql
+with its metadata, with `python benchmarks/synthetic_data.py --scale 10`."""
+import argparse
+import sys
+from csv import writer
+from datetime import datetime, timedelta
+from io import StringIO
+from os import environ as ENV
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from psycopg2 import connect
+from psycopg2.extras import execute_values
+from psycopg2.extensions import connection, cursor
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / 'ETL_pipeline'), str(ROOT / 'common')]
+
+# pylint: disable=wrong-import-position
+from alert_outbox import enqueue_unnotified_alerts
+from transform import calculate_air_quality_alert, classify_alerts, get_warning_array
+# pylint: enable=wrong-import-position
+
+BASE_LOCATIONS = 19
+BASE_USERS = 20
+DEFAULT_HISTORY_DAYS = 1
+WEEK_HOURS = 168
+
+# Extra locations lie this many degrees (standard deviation) from their town.
+LOCATION_SPREAD = 0.35
+MAX_LOCATIONS_PER_USER = 3
+POPULARITY_EXPONENT = 0.8
+REPORT_OPT_IN_RATE = 0.7
+ALERT_OPT_IN_RATE = 0.8
+FLOODS_PER_LOCATION_DAY = 0.02
+SYNOPTIC_DAYS = 4
+# Locations are generated this many at a time to bound the memory used.
+LOCATION_BATCH_SIZE = 500
+
+FORECAST_COLUMNS = ["visibility", "humidity", "precipitation", "precipitation_prob",
+                    "rainfall", "snowfall", "wind_speed", "wind_direction", "wind_gusts",
+                    "lightning_potential", "uv_index", "cloud_cover", "temperature",
+                    "apparent_temp", "weather_code_id", "content_hash"]
+
+
+def get_metadata_locations() -> list[list[str]]:
+    """Returns the latitude, longitude, name and county ID of each metadata location."""
+    with open(ROOT / 'database' / 'metadata' / 'locations.txt', encoding='utf-8') as file:
+        return [line.strip().split(', ') for line in file if line.strip()]
+
+
+def copy_rows(cur: cursor, table: str, rows) -> None:
+    """Copies rows into a table through COPY."""
+    buffer = StringIO()
+    writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def round_to_quarter_hour(timestamp: datetime) -> datetime:
+    """Returns the timestamp rounded down to the most recent quarter hour."""
+    return timestamp.replace(minute=timestamp.minute // 15 * 15, second=0, microsecond=0)
+
+
+def get_forecast_timestamps(now: datetime, history_days: int) -> np.ndarray:
+    """Returns the timestamps stored for every location: each quarter hour from
+    history_days ago until a day ahead, then each hour to the end of the week."""
+    start = np.datetime64(round_to_quarter_hour(now), 'm')
+    day = np.timedelta64(1, 'D')
+    hour = np.timedelta64(1, 'h')
+    minutely = np.arange(start - history_days * day, start + day, np.timedelta64(15, 'm'))
+    hourly = np.arange(start.astype('datetime64[h]'), start + WEEK_HOURS * hour,
+                       hour).astype('datetime64[m]')
+    hourly = hourly[hourly >= start + day]
+    return np.concatenate([minutely, hourly]).astype('datetime64[us]')
+
+
+def get_report_times(now: datetime, history_days: int) -> np.ndarray:
+    """Returns the time of every weather report for a location, one per hour."""
+    latest = np.datetime64(now.replace(minute=0, second=0, microsecond=0), 'h')
+    return np.arange(latest - history_days * 24, latest + 1).astype('datetime64[us]')
+
+
+def get_weather_codes(columns: dict[str, np.ndarray], snowing: np.ndarray,
+                      raining: np.ndarray) -> np.ndarray:
+    """Returns the WMO weather code best describing each forecast."""
+    return np.select(
+        [snowing & (columns["snowfall"] >= 1), snowing & (columns["snowfall"] >= 0.3), snowing,
+         columns["lightning_potential"] > 0, columns["rainfall"] >= 4,
+         columns["rainfall"] >= 1, raining, columns["visibility"] < 1000,
+         columns["cloud_cover"] >= 80, columns["cloud_cover"] >= 50, columns["cloud_cover"] >= 20],
+        [75, 73, 71, 95, 65, 63, 61, 45, 3, 2, 1], default=0)
+
+
+def make_forecasts(rng: np.random.Generator, latitudes: np.ndarray,
+                   timestamps: np.ndarray, now: datetime) -> dict[str, np.ndarray]:
+    """Returns forecast columns with a row per location and timestamp, location by
+    location, drawn from distributions typical of British weather."""
+    shape = (len(latitudes), len(timestamps))
+    day_of_year = now.timetuple().tm_yday
+    hours = (timestamps - timestamps.astype('datetime64[D]')) / np.timedelta64(1, 'h')
+    days = (timestamps - np.datetime64(now)) / np.timedelta64(1, 'D')
+
+    diurnal = np.sin(2 * np.pi * (hours - 9) / 24)
+    synoptic = np.sin(2 * np.pi * days / SYNOPTIC_DAYS + rng.uniform(0, 2 * np.pi, (shape[0], 1)))
+    seasonal = 10 - 6 * np.cos(2 * np.pi * (day_of_year - 15) / 365)
+    temperature = (seasonal - 0.5 * (latitudes[:, None] - 52) + 4 * synoptic + 4 * diurnal
+                   + rng.normal(0, 0.8, shape))
+
+    cloud_cover = np.clip(50 - 40 * synoptic + rng.normal(0, 20, shape), 0, 100)
+    precipitation_prob = np.clip(cloud_cover - 20 + rng.normal(0, 15, shape), 0, 100)
+    wet = rng.random(shape) < precipitation_prob / 200
+    amount = np.where(wet, rng.gamma(0.8, 1.5, shape), 0.0)
+    snowing = wet & (temperature < 1)
+    raining = wet & ~snowing
+
+    wind_speed = (rng.weibull(2, shape) * rng.uniform(12, 25, (shape[0], 1))
+                  * (1 + 0.3 * np.maximum(-synoptic, 0)))
+    uv_peak = 4 + 3 * np.cos(2 * np.pi * (day_of_year - 172) / 365)
+    fog = rng.random(shape) < 0.02
+
+    columns = {
+        "visibility": np.where(fog, rng.uniform(20, 1000, shape),
+                               rng.uniform(8000, 30000, shape)).astype(int),
+        "humidity": np.clip(80 - 10 * diurnal + 0.1 * cloud_cover + rng.normal(0, 6, shape),
+                            25, 100).astype(int),
+        "precipitation": amount.round(1),
+        "precipitation_prob": precipitation_prob.astype(int),
+        "rainfall": np.where(raining, amount, 0.0).round(1),
+        "snowfall": np.where(snowing, amount / 3, 0.0).round(2),
+        "wind_speed": wind_speed.round(1),
+        "wind_direction": ((220 + rng.normal(0, 60, shape)) % 360).astype(int),
+        "wind_gusts": (wind_speed * rng.uniform(1.3, 1.8, shape)).round(1),
+        "lightning_potential": np.where(raining & (rng.random(shape) < 0.05),
+                                        rng.integers(1, 3000, shape), 0),
+        "uv_index": (uv_peak * np.clip(np.sin(np.pi * (hours - 6) / 12), 0, None)
+                     * (1 - cloud_cover / 150)).round(2),
+        "cloud_cover": cloud_cover.astype(int),
+        "temperature": temperature.round(1),
+        "apparent_temp": (temperature - 0.15 * wind_speed + rng.normal(0, 0.5, shape)).round(1),
+    }
+    columns["weather_code_id"] = get_weather_codes(columns, snowing, raining)
+    columns["content_hash"] = rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max,
+                                           shape, dtype=np.int64)
+    return {column: values.ravel() for column, values in columns.items()}
+
+
+def get_forecast_rows(loc_ids: list[int], timestamps: np.ndarray,
+                      report_times: np.ndarray, columns: dict[str, np.ndarray]) -> zip:
+    """Returns rows of the location, forecast timestamp and report time followed by
+    the forecast columns, for the forecast staging table."""
+    return zip(np.repeat(loc_ids, len(timestamps)).tolist(),
+               np.tile(timestamps, len(loc_ids)).tolist(),
+               np.tile(report_times, len(loc_ids)).tolist(),
+               *(columns[column].tolist() for column in FORECAST_COLUMNS))
+
+
+def get_alert_rows(loc_ids: list[int], timestamps: np.ndarray,
+                   columns: dict[str, np.ndarray], now: datetime) -> zip:
+    """Returns a row per weather alert the pipeline would have raised for the
+    forecasts, notified unless it entered the alert window in the latest run."""
+    forecast_timestamps = np.tile(timestamps, len(loc_ids))
+    warnings = get_warning_array(classify_alerts(
+        {"forecast_timestamp": forecast_timestamps, **columns}))
+    positions = warnings[:, 0]
+    alert_times = forecast_timestamps[positions]
+    return zip(np.repeat(loc_ids, len(timestamps))[positions].tolist(), alert_times.tolist(),
+               warnings[:, 1].tolist(), warnings[:, 2].tolist(),
+               (alert_times < np.datetime64(now + timedelta(hours=11))).tolist())
+
+
+def get_air_quality_rows(rng: np.random.Generator, loc_ids: list[int],
+                         report_times: np.ndarray) -> list[tuple]:
+    """Returns an ozone reading per location and report time, each notified unless it
+    is from the latest report."""
+    hours = (report_times - report_times.astype('datetime64[D]')) / np.timedelta64(1, 'h')
+    ozone = np.clip(rng.normal(60, 25, (len(loc_ids), len(report_times)))
+                    + 15 * np.sin(2 * np.pi * (hours - 9) / 24), 5, 400).astype(int)
+    latest = report_times[-1].item()
+    return [(loc_id, time, int(o3), calculate_air_quality_alert(o3), time != latest)
+            for loc_id, readings in zip(loc_ids, ozone)
+            for time, o3 in zip(report_times.tolist(), readings)]
+
+
+def insert_locations(conn: connection, rng: np.random.Generator, count: int) -> list[int]:
+    """Returns the ID of every location having added synthetic ones, around the
+    metadata towns, until there are count locations."""
+    towns = get_metadata_locations()
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM location;")
+        existing = cur.fetchone()[0]
+        rows = []
+        for i in range(existing, count):
+            latitude, longitude, name, county_id = towns[i % len(towns)]
+            rows.append((float(latitude) + rng.normal(0, LOCATION_SPREAD),
+                         float(longitude) + rng.normal(0, LOCATION_SPREAD),
+                         f"{name} {i // len(towns) + 1}", int(county_id)))
+        execute_values(cur, """INSERT INTO location (latitude, longitude, loc_name, county_id)
+                            VALUES %s;""", rows, page_size=1000)
+        cur.execute("SELECT loc_id FROM location ORDER BY loc_id;")
+        return [row[0] for row in cur.fetchall()]
+
+
+def insert_users(conn: connection, rng: np.random.Generator, count: int,
+                 loc_ids: list[int]) -> None:
+    """Adds users, each subscribed to a few locations, favouring the first ones."""
+    popularity = 1 / np.arange(1, len(loc_ids) + 1) ** POPULARITY_EXPONENT
+    popularity /= popularity.sum()
+    with conn.cursor() as cur:
+        execute_values(cur, """INSERT INTO user_details (email, name, password)
+                            VALUES %s;""",
+                       [(f"user{i}@example.com", f"User {i}", "synthetic")
+                        for i in range(count)], page_size=1000)
+        cur.execute("SELECT user_id FROM user_details ORDER BY user_id;")
+        user_ids = [row[0] for row in cur.fetchall()]
+        rows = []
+        for user_id in user_ids:
+            subscriptions = min(rng.geometric(0.6), MAX_LOCATIONS_PER_USER, len(loc_ids))
+            for loc_id in rng.choice(loc_ids, subscriptions, replace=False, p=popularity):
+                rows.append((user_id, int(loc_id), bool(rng.random() < REPORT_OPT_IN_RATE),
+                             bool(rng.random() < ALERT_OPT_IN_RATE)))
+        copy_rows(cur, "user_location_assignment (user_id, loc_id, report_opt_in, alert_opt_in)",
+                  rows)
+
+
+def insert_flood_warnings(conn: connection, rng: np.random.Generator, loc_ids: list[int],
+                          now: datetime, history_days: int) -> None:
+    """Adds flood warnings raised at random locations and times over the history."""
+    count = rng.binomial(len(loc_ids) * history_days, FLOODS_PER_LOCATION_DAY)
+    raised = [now - timedelta(minutes=int(minutes))
+              for minutes in rng.integers(0, history_days * 24 * 60, count)]
+    rows = [(int(severity), time, int(loc_id), time < now - timedelta(hours=1))
+            for severity, time, loc_id in zip(rng.choice([1, 2, 3], count, p=[0.1, 0.3, 0.6]),
+                                              raised, rng.choice(loc_ids, count))]
+    with conn.cursor() as cur:
+        copy_rows(cur, "flood_warnings (severity_level_id, time_raised, loc_id, notified)", rows)
+
+
+def insert_weather_history(conn: connection, rng: np.random.Generator, loc_ids: list[int],
+                           now: datetime, history_days: int) -> None:
+    """Adds the weather reports, air quality readings, forecasts and weather alerts of
+    every location, staging each table so the generated IDs can be joined up."""
+    timestamps = get_forecast_timestamps(now, history_days)
+    report_times = get_report_times(now, history_days)
+    forecast_report_times = np.minimum(timestamps.astype('datetime64[h]'),
+                                       report_times[-1]).astype('datetime64[us]')
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT loc_id, latitude FROM location WHERE loc_id = ANY(%s);", (loc_ids,))
+        latitudes = dict(cur.fetchall())
+        cur.execute("""
+            INSERT INTO weather_report (report_time, loc_id)
+            SELECT report_time, loc_id
+            FROM unnest(%s::INT[]) AS loc_id
+            CROSS JOIN unnest(%s::TIMESTAMP[]) AS report_time;""",
+                    (loc_ids, report_times.tolist()))
+        cur.execute(f"""
+            CREATE TEMP TABLE forecast_staging ON COMMIT DROP AS
+                SELECT loc_id, forecast_timestamp, NULL::TIMESTAMP AS report_time,
+                    {', '.join(FORECAST_COLUMNS)}
+                FROM forecast
+                WITH NO DATA;
+            CREATE TEMP TABLE alert_staging (loc_id INT, forecast_timestamp TIMESTAMP,
+                alert_type_id SMALLINT, severity_level_id SMALLINT, notified BOOLEAN)
+                ON COMMIT DROP;
+            CREATE TEMP TABLE air_quality_staging (loc_id INT, report_time TIMESTAMP,
+                o3_concentration SMALLINT, severity_level_id SMALLINT, notified BOOLEAN)
+                ON COMMIT DROP;""")
+
+        for first in range(0, len(loc_ids), LOCATION_BATCH_SIZE):
+            batch = loc_ids[first:first + LOCATION_BATCH_SIZE]
+            columns = make_forecasts(rng, np.array([latitudes[loc_id] for loc_id in batch]),
+                                     timestamps, now)
+            copy_rows(cur, "forecast_staging", get_forecast_rows(
+                batch, timestamps, forecast_report_times, columns))
+            copy_rows(cur, "alert_staging", get_alert_rows(batch, timestamps, columns, now))
+            copy_rows(cur, "air_quality_staging", get_air_quality_rows(rng, batch, report_times))
+
+        cur.execute(f"""
+            INSERT INTO forecast (forecast_timestamp, {', '.join(FORECAST_COLUMNS)},
+                weather_report_id, loc_id)
+            SELECT S.forecast_timestamp, {', '.join(f'S.{c}' for c in FORECAST_COLUMNS)},
+                WR.weather_report_id, S.loc_id
+            FROM forecast_staging AS S
+            JOIN weather_report AS WR ON (WR.loc_id = S.loc_id AND WR.report_time = S.report_time);
+
+            INSERT INTO weather_alert (alert_type_id, forecast_id, severity_level_id, notified)
+            SELECT S.alert_type_id, F.forecast_id, S.severity_level_id, S.notified
+            FROM alert_staging AS S
+            JOIN forecast AS F ON (F.loc_id = S.loc_id
+                AND F.forecast_timestamp = S.forecast_timestamp);
+
+            INSERT INTO air_quality (o3_concentration, severity_level_id, weather_report_id,
+                notified)
+            SELECT S.o3_concentration, S.severity_level_id, WR.weather_report_id, S.notified
+            FROM air_quality_staging AS S
+            JOIN weather_report AS WR ON (WR.loc_id = S.loc_id
+                AND WR.report_time = S.report_time);""")
+
+
+def generate(conn: connection, scale: int, history_days: int = DEFAULT_HISTORY_DAYS,
+             seed: int = 0) -> None:
+    """Fills a database holding only the metadata with scale times today's locations
+    and users, and history_days of their weather, in a single transaction."""
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+    with conn:
+        loc_ids = insert_locations(conn, rng, BASE_LOCATIONS * scale)
+        insert_users(conn, rng, BASE_USERS * scale, loc_ids)
+        insert_weather_history(conn, rng, loc_ids, now, history_days)
+        insert_flood_warnings(conn, rng, loc_ids, now, history_days)
+        enqueue_unnotified_alerts(conn)
+    with conn, conn.cursor() as cur:
+        cur.execute("ANALYZE;")
+
+
+def main() -> None:
+    """Fills the database in the DB_* environment variables."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiple of today's locations and users")
+    parser.add_argument("--history-days", type=int, default=DEFAULT_HISTORY_DAYS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load_dotenv()
+    conn = connect(user=ENV["DB_USER"], password=ENV["DB_PASSWORD"], host=ENV["DB_HOST"],
+                   port=ENV["DB_PORT"], database=ENV["DB_NAME"])
+    generate(conn, args.scale, args.history_days, args.seed)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Query plan regression tests: the key queries must keep using their indexes.
+
+A throwaway database is filled by synthetic_data.py at PLAN_SCALE times today's
+volumes, and the plans of the queries the Lambdas and dashboard make against it are
+checked for the indexes in database/schema.sql. The plans come from query_stats,
+which logs every statement with its EXPLAIN plan when SLOW_QUERY_MS is 0.
+
+The tests need a Postgres server in the DB_* environment variables, where the
+database is created as by `python replay/replay.py --use-env-server`, and are
+skipped without one."""
+import re
+from os import environ as ENV
+
+import pytest
+
+if "DB_HOST" not in ENV:
+    pytest.skip("no database server in the DB_* environment variables",
+                allow_module_level=True)
+
+# pylint: disable=wrong-import-position
+from psycopg2 import OperationalError
+
+# Importing bench_scale puts the Lambda directories on the path.
+from bench_scale import connect_to, existing_server, synthetic_data, throwaway_database
+import delete
+import query_stats
+from alert_outbox import MAX_DELIVERY_ATTEMPTS, claim_alerts, enqueue_unnotified_alerts
+from query_stats import CountingConnection, reset_query_stats
+# pylint: enable=wrong-import-position
+
+PLAN_SCALE = 10
+# Notified flood warnings added to give the flood warnings a history.
+FLOOD_HISTORY = 5000
+INDEX_PATTERN = re.compile(r"Index (?:Only )?Scan (?:using|on) (\w+)")
+
+# The joins the dashboard's location page makes from a location to its forecasts
+# and air quality readings.
+LOCATION_FORECASTS = """
+    SELECT F.forecast_timestamp, F.temperature
+    FROM location AS L
+    JOIN weather_report AS WR ON (L.loc_id = WR.loc_id)
+    JOIN forecast AS F ON (F.weather_report_id = WR.weather_report_id)
+    WHERE F.forecast_timestamp > NOW() AND L.loc_name = %s;
+    """
+LOCATION_AIR_QUALITY = """
+    SELECT MIN(WR.report_time) AS min_time, MAX(WR.report_time) AS max_time
+    FROM air_quality AS AQ
+    JOIN weather_report AS WR ON (WR.weather_report_id = AQ.weather_report_id)
+    JOIN location AS L ON (WR.loc_id = L.loc_id)
+    WHERE L.loc_name = %s AND AQ.severity_level_id < 4;
+    """
+
+
+@pytest.fixture(scope="module")
+def database():
+    """Yields the configuration of a throwaway database of synthetic data."""
+    try:
+        with existing_server() as server, throwaway_database(server) as config:
+            conn = connect_to(config, config["DB_NAME"])
+            synthetic_data.generate(conn, PLAN_SCALE)
+            conn.close()
+            yield config
+    except OperationalError as error:
+        pytest.skip(f"cannot reach the database server: {error}")
+
+
+class UncommittedConnection(CountingConnection):
+    """Counting connection whose commits do nothing, so that everything run on it
+    is rolled back with its transaction."""
+
+    def commit(self):
+        """Leaves the transaction open to be rolled back."""
+
+
+@pytest.fixture
+def conn(database, monkeypatch):
+    """Yields a connection logging the plan of every statement it runs, whose
+    transaction is rolled back afterwards even if the code under test commits."""
+    monkeypatch.setenv("SLOW_QUERY_MS", "0")
+    reset_query_stats()
+    connection = connect_to(database, database["DB_NAME"], UncommittedConnection)
+    yield connection
+    connection.rollback()
+    connection.close()
+
+
+def get_indexes_used() -> list[set[str]]:
+    """Returns the indexes scanned by each statement run since the counts were reset."""
+    return [set(INDEX_PATTERN.findall("\n".join(query["plan"])))
+            for query in query_stats.slow_queries]
+
+
+def test_unnotified_alerts_use_partial_indexes(conn):
+    """Test that finding the alerts not yet notified scans only their partial indexes.
+    The synthetic data raises too few flood warnings for an index to beat reading
+    them all, so a history of notified ones is added first."""
+    with conn.cursor() as cur:
+        cur.execute("""INSERT INTO flood_warnings (severity_level_id, time_raised, loc_id, notified)
+                    SELECT SL.severity_level_id, NOW() - N.hours * INTERVAL '1 hour', L.loc_id, TRUE
+                    FROM generate_series(1, %s) AS N(hours)
+                    CROSS JOIN (SELECT MIN(severity_level_id) AS severity_level_id
+                                FROM severity_level) AS SL
+                    CROSS JOIN (SELECT MIN(loc_id) AS loc_id FROM location) AS L;""",
+                    (FLOOD_HISTORY,))
+        cur.execute("ANALYZE flood_warnings;")
+    reset_query_stats()
+
+    enqueue_unnotified_alerts(conn)
+
+    indexes = get_indexes_used()
+    assert "weather_alert_unnotified" in indexes[0]
+    assert "air_quality_unnotified" in indexes[1]
+    assert "flood_warnings_unnotified" in indexes[2]
+
+
+def test_claim_uses_pending_outbox_index(conn):
+    """Test that claiming recipients finds their due rows through the pending index."""
+    assert claim_alerts(conn, 25)
+
+    assert "alert_outbox_pending" in get_indexes_used()[0]
+
+
+def test_claim_skips_rows_out_of_attempts(conn):
+    """Test that a recipient whose rows have all failed MAX_DELIVERY_ATTEMPTS times
+    is no longer claimed."""
+    recipient = claim_alerts(conn, 1)[0]
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute("UPDATE alert_outbox SET attempts = %s WHERE outbox_id = ANY(%s);",
+                    (MAX_DELIVERY_ATTEMPTS, recipient["outbox_ids"]))
+
+    assert recipient["email"] not in [claimed["email"] for claimed in claim_alerts(conn, 25)]
+
+
+def test_location_page_uses_foreign_key_indexes(conn):
+    """Test that a location's forecasts and air quality are found through the
+    foreign key indexes rather than scanning the history."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT loc_name FROM location ORDER BY loc_id LIMIT 1;")
+        location = cur.fetchone()[0]
+        cur.execute(LOCATION_FORECASTS, (location,))
+        cur.execute(LOCATION_AIR_QUALITY, (location,))
+
+    forecasts, air_quality = get_indexes_used()[1:]
+    assert {"weather_report_location", "forecast_weather_report"} <= forecasts
+    assert {"weather_report_location", "air_quality_weather_report"} <= air_quality
+
+
+def test_delete_job_anti_joins_use_foreign_key_index(conn):
+    """Test that finding weather reports without forecasts probes the foreign key
+    index instead of comparing every report with every forecast."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM weather_report;")
+        reports = cur.fetchone()[0]
+    delete.delete_weather_reports(conn)
+    conn.rollback()
+
+    assert "forecast_weather_report" in get_indexes_used()[1]
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM weather_report;")
+        assert cur.fetchone()[0] == reports
@@ -0,0 +1,161 @@
+"""The outbox of alert emails still to be sent.
+
+The loaders add an outbox row per alert and subscribed user in the same transaction
+as the alert itself, with the details the email needs as its payload. The email
+Lambda claims recipients in batches with FOR NO KEY UPDATE SKIP LOCKED, so several
+workers can drain the outbox at once without emailing anyone twice, and records
+each row as sent, or to be retried after RETRY_AFTER_MINUTES. Rows that have failed
+MAX_DELIVERY_ATTEMPTS times are no longer claimed, so an address SES keeps rejecting
+is given up on until the row is deleted a day later."""
+
+from psycopg2.extensions import connection
+from psycopg2.extras import RealDictCursor
+
+RETRY_AFTER_MINUTES = 15
+MAX_DELIVERY_ATTEMPTS = 5
+# Air quality readings at this severity level are not alerts.
+NO_AIR_QUALITY_ALERT_ID = 4
+
+
+def enqueue_weather_alerts(conn: connection, alert_ids: list[int]) -> None:
+    """Adds the weather alerts to the outbox of every user subscribed to alerts for
+    their location."""
+    if not alert_ids:
+        return
+
+    sql_query = """
+        INSERT INTO alert_outbox (user_id, alert_table, alert_id, payload)
+        SELECT ULA.user_id, 'weather_alert', WA.alert_id,
+            jsonb_build_object('county', C.name, 'severity_level', SL.severity_level,
+                               'severity_level_id', SL.severity_level_id,
+                               'loc_name', L.loc_name, 'alert_type', AL.name,
+                               'forecast_timestamp', F.forecast_timestamp,
+                               'description', WC.description)
+        FROM weather_alert AS WA
+        JOIN severity_level AS SL ON (WA.severity_level_id = SL.severity_level_id)
+        JOIN forecast AS F ON (WA.forecast_id = F.forecast_id)
+        JOIN alert_type AS AL ON (WA.alert_type_id = AL.alert_type_id)
+        JOIN weather_code AS WC ON (F.weather_code_id = WC.weather_code_id)
+        JOIN location AS L ON (F.loc_id = L.loc_id)
+        JOIN county AS C ON (L.county_id = C.county_id)
+        JOIN user_location_assignment AS ULA ON (L.loc_id = ULA.loc_id)
+        WHERE WA.alert_id = ANY(%s) AND ULA.alert_opt_in = TRUE
+        ON CONFLICT (user_id, alert_table, alert_id) DO NOTHING;
+        """
+
+    with conn.cursor() as cur:
+        cur.execute(sql_query, (alert_ids,))
+
+
+def enqueue_air_quality(conn: connection, air_quality_ids: list[int]) -> None:
+    """Adds the air quality readings that are alerts to the outbox of every user
+    subscribed to alerts for their location."""
+    if not air_quality_ids:
+        return
+
+    sql_query = """
+        INSERT INTO alert_outbox (user_id, alert_table, alert_id, payload)
+        SELECT ULA.user_id, 'air_quality', AQ.air_quality_id,
+            jsonb_build_object('severity_level', SL.severity_level,
+                               'loc_name', L.loc_name, 'county', C.name,
+                               'o3_concentration', AQ.o3_concentration)
+        FROM air_quality AS AQ
+        JOIN severity_level AS SL ON (AQ.severity_level_id = SL.severity_level_id)
+        JOIN weather_report AS WR ON (AQ.weather_report_id = WR.weather_report_id)
+        JOIN location AS L ON (WR.loc_id = L.loc_id)
+        JOIN county AS C ON (L.county_id = C.county_id)
+        JOIN user_location_assignment AS ULA ON (L.loc_id = ULA.loc_id)
+        WHERE AQ.air_quality_id = ANY(%s) AND AQ.severity_level_id <> %s
+            AND ULA.alert_opt_in = TRUE
+        ON CONFLICT (user_id, alert_table, alert_id) DO NOTHING;
+        """
+
+    with conn.cursor() as cur:
+        cur.execute(sql_query, (air_quality_ids, NO_AIR_QUALITY_ALERT_ID))
+
+
+def enqueue_flood_warnings(conn: connection, flood_ids: list[int]) -> None:
+    """Adds the flood warnings to the outbox of every user subscribed to alerts for
+    their location."""
+    if not flood_ids:
+        return
+
+    sql_query = """
+        INSERT INTO alert_outbox (user_id, alert_table, alert_id, payload)
+        SELECT ULA.user_id, 'flood_warnings', FW.flood_id,
+            jsonb_build_object('severity_level', SL.severity_level,
+                               'loc_name', L.loc_name, 'county', C.name,
+                               'time_raised', FW.time_raised)
+        FROM flood_warnings AS FW
+        JOIN severity_level AS SL ON (FW.severity_level_id = SL.severity_level_id)
+        JOIN location AS L ON (FW.loc_id = L.loc_id)
+        JOIN county AS C ON (L.county_id = C.county_id)
+        JOIN user_location_assignment AS ULA ON (L.loc_id = ULA.loc_id)
+        WHERE FW.flood_id = ANY(%s) AND ULA.alert_opt_in = TRUE
+        ON CONFLICT (user_id, alert_table, alert_id) DO NOTHING;
+        """
+
+    with conn.cursor() as cur:
+        cur.execute(sql_query, (flood_ids,))
+
+
+def enqueue_unnotified_alerts(conn: connection) -> None:
+    """Adds every alert not yet notified to the outbox, e.g. to fill it for alerts
+    loaded before it existed."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT alert_id FROM weather_alert WHERE notified = FALSE;")
+        weather_ids = [row["alert_id"] for row in cur.fetchall()]
+        cur.execute("SELECT air_quality_id FROM air_quality WHERE notified = FALSE;")
+        air_quality_ids = [row["air_quality_id"] for row in cur.fetchall()]
+        cur.execute("SELECT flood_id FROM flood_warnings WHERE notified = FALSE;")
+        flood_ids = [row["flood_id"] for row in cur.fetchall()]
+    enqueue_weather_alerts(conn, weather_ids)
+    enqueue_air_quality(conn, air_quality_ids)
+    enqueue_flood_warnings(conn, flood_ids)
+
+
+def claim_alerts(conn: connection, batch_size: int) -> list[dict]:
+    """Returns up to batch_size recipients with due outbox rows, each with their
+    email, the IDs of those rows and their alerts, locking the recipients until the
+    transaction ends. Recipients locked by another worker are skipped, as are rows
+    that have already failed MAX_DELIVERY_ATTEMPTS times."""
+
+    sql_query = """
+        WITH recipients AS (
+            SELECT UD.user_id, UD.email
+            FROM user_details AS UD
+            WHERE EXISTS (SELECT 1 FROM alert_outbox AS O
+                          WHERE O.user_id = UD.user_id AND O.sent_at IS NULL
+                          AND O.available_at <= CURRENT_TIMESTAMP AND O.attempts < %s)
+            ORDER BY UD.user_id
+            LIMIT %s
+            FOR NO KEY UPDATE SKIP LOCKED
+        )
+        SELECT R.email, ARRAY_AGG(O.outbox_id ORDER BY O.outbox_id) AS outbox_ids,
+            json_agg(json_build_object('alert_table', O.alert_table, 'alert_id', O.alert_id,
+                                       'payload', O.payload) ORDER BY O.outbox_id) AS alerts
+        FROM alert_outbox AS O
+        JOIN recipients AS R ON (O.user_id = R.user_id)
+        WHERE O.sent_at IS NULL AND O.available_at <= CURRENT_TIMESTAMP
+            AND O.attempts < %s
+        GROUP BY R.user_id, R.email
+        ORDER BY R.user_id;
+        """
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(sql_query, (MAX_DELIVERY_ATTEMPTS, batch_size, MAX_DELIVERY_ATTEMPTS))
+        return cur.fetchall()
+
+
+def record_deliveries(conn: connection, sent_ids: list[int], failed_ids: list[int]) -> None:
+    """Marks outbox rows as sent, and those that failed to be retried later unless
+    they have run out of attempts."""
+    with conn.cursor() as cur:
+        if sent_ids:
+            cur.execute("""UPDATE alert_outbox SET sent_at = CURRENT_TIMESTAMP
+                        WHERE outbox_id = ANY(%s);""", (sent_ids,))
+        if failed_ids:
+            cur.execute("""UPDATE alert_outbox
+                        SET attempts = attempts + 1,
+                        available_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute'
+                        WHERE outbox_id = ANY(%s);""", (RETRY_AFTER_MINUTES, failed_ids))
@@ -0,0 +1,134 @@
+"""Database connections shared by the Lambda handlers.
+
+Idle connections are kept at module level, so a warm Lambda container reuses
+the connection from its previous invocation instead of opening a new one.
+Connections idle for longer than HEALTH_CHECK_AFTER are checked before reuse,
+and the session timezone is set as part of the connection handshake. Connections
+count their statements and commits (see query_stats.py)."""
+
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic, perf_counter
+
+from psycopg2 import connect, DatabaseError
+from psycopg2.extensions import connection, TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+from metrics import count
+from query_stats import CountingConnection
+
+POOL_SIZE = 4
+HEALTH_CHECK_AFTER = 30
+DEFAULT_TIMEZONE = "Europe/London"
+
+idle_connections = {}
+pool_lock = Lock()
+connection_stats = {"opened": 0, "reused": 0, "discarded": 0,
+                    "connect_seconds": 0.0, "health_check_seconds": 0.0}
+
+
+def get_pool_key(config: dict) -> tuple:
+    """Returns the key of the pool for a database configuration."""
+    return (config["DB_HOST"], str(config["DB_PORT"]), config["DB_NAME"], config["DB_USER"])
+
+
+def open_connection(config: dict) -> connection:
+    """Returns a new connection to the database."""
+    start = perf_counter()
+    conn = connect(
+        user=config["DB_USER"],
+        password=config["DB_PASSWORD"],
+        host=config["DB_HOST"],
+        port=config["DB_PORT"],
+        database=config["DB_NAME"],
+        options=f"-c timezone={config.get('DB_TIMEZONE', DEFAULT_TIMEZONE)}",
+        connection_factory=CountingConnection
+    )
+    with pool_lock:
+        connection_stats["opened"] += 1
+        connection_stats["connect_seconds"] += perf_counter() - start
+    count("db_connections_opened")
+    return conn
+
+
+def is_healthy(conn: connection, idle_since: float) -> bool:
+    """Returns whether a pooled connection can still be used."""
+    if conn.closed or conn.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if monotonic() - idle_since < HEALTH_CHECK_AFTER:
+        return True
+    start = perf_counter()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except DatabaseError:
+        return False
+    finally:
+        with pool_lock:
+            connection_stats["health_check_seconds"] += perf_counter() - start
+
+
+def get_db_connection(config: dict, cursor_factory: type = None) -> connection:
+    """Returns a connection to the database, reusing an idle one if possible.
+    The connection should be handed back with release_db_connection."""
+    key = get_pool_key(config)
+    while True:
+        with pool_lock:
+            pooled = idle_connections.get(key, [])
+            conn, idle_since = pooled.pop() if pooled else (None, None)
+        if conn is None:
+            conn = open_connection(config)
+            break
+        if is_healthy(conn, idle_since):
+            with pool_lock:
+                connection_stats["reused"] += 1
+            count("db_connections_reused")
+            break
+        conn.close()
+        with pool_lock:
+            connection_stats["discarded"] += 1
+
+    conn.cursor_factory = cursor_factory
+    return conn
+
+
+def release_db_connection(config: dict, conn: connection) -> None:
+    """Returns a connection to the pool, rolling back anything uncommitted."""
+    if conn.closed:
+        return
+    if conn.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+        conn.close()
+        return
+    if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    with pool_lock:
+        pooled = idle_connections.setdefault(get_pool_key(config), [])
+        if len(pooled) < POOL_SIZE:
+            pooled.append((conn, monotonic()))
+            return
+    conn.close()
+
+
+@contextmanager
+def db_connection(config: dict, cursor_factory: type = None):
+    """Yields a pooled connection to the database and releases it afterwards."""
+    conn = get_db_connection(config, cursor_factory)
+    try:
+        yield conn
+    finally:
+        release_db_connection(config, conn)
+
+
+def reset_connection_stats() -> None:
+    """Resets the connection statistics, e.g. at the start of an invocation."""
+    with pool_lock:
+        for stat in connection_stats:
+            connection_stats[stat] = 0 if stat in ("opened", "reused", "discarded") else 0.0
+
+
+def get_connection_stats() -> dict:
+    """Returns the connections opened and reused and the seconds spent connecting
+    and health checking since the statistics were last reset."""
+    with pool_lock:
+        return dict(connection_stats)
@@ -0,0 +1,104 @@
+"""Spans timing the stages of a handler, reported as CloudWatch metrics.
+
+A span times a block of code and counts what happens inside it, such as rows
+loaded or HTTP requests made; a count also goes to every span open around it in
+the same thread or asyncio task. Spans with the same name are added together
+until flush_metrics writes one line per name in CloudWatch embedded metric format
+(EMF): to stdout, where a Lambda's logs turn it into metrics, or appended to the
+JSON lines file named by METRICS_FILE, for benchmarks to read locally."""
+
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from os import environ as ENV
+from threading import Lock
+from time import perf_counter, time
+
+NAMESPACE = "ClimateMonitor"
+DIMENSIONS = ["Service", "Span"]
+# Metrics are counts unless their name ends in one of these suffixes.
+UNIT_SUFFIXES = {"_ms": "Milliseconds", "_bytes": "Bytes"}
+
+open_spans = ContextVar("open_spans", default=())
+recorded_spans = {}
+metrics_lock = Lock()
+
+
+@contextmanager
+def span(name: str):
+    """Times the block as a span, yielding its metrics; the span's calls and
+    duration_ms are added to the totals of every span with the same name."""
+    metrics = {"calls": 1}
+    token = open_spans.set(open_spans.get() + (metrics,))
+    start = perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics["duration_ms"] = (perf_counter() - start) * 1000
+        open_spans.reset(token)
+        with metrics_lock:
+            totals = recorded_spans.setdefault(name, {})
+            for metric, value in metrics.items():
+                totals[metric] = totals.get(metric, 0) + value
+
+
+def count(metric: str, value: float = 1) -> None:
+    """Adds to a metric of every open span; does nothing outside a span."""
+    with metrics_lock:
+        for metrics in open_spans.get():
+            metrics[metric] = metrics.get(metric, 0) + value
+
+
+def instrumented(name: str):
+    """Decorates a function or coroutine function to run as a span."""
+    def decorate(function):
+        if iscoroutinefunction(function):
+            @wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def get_unit(metric: str) -> str:
+    """Returns the CloudWatch unit of a metric from its name."""
+    for suffix, unit in UNIT_SUFFIXES.items():
+        if metric.endswith(suffix):
+            return unit
+    return "Count"
+
+
+def get_metric_documents(service: str, spans: dict) -> list[dict]:
+    """Returns an EMF document for the totals of each span."""
+    timestamp = int(time() * 1000)
+    return [{"_aws": {"Timestamp": timestamp,
+                      "CloudWatchMetrics": [{
+                          "Namespace": NAMESPACE,
+                          "Dimensions": [DIMENSIONS],
+                          "Metrics": [{"Name": metric, "Unit": get_unit(metric)}
+                                      for metric in metrics]}]},
+             "Service": service, "Span": name,
+             **{metric: round(value, 3) for metric, value in metrics.items()}}
+            for name, metrics in spans.items()]
+
+
+def flush_metrics(service: str) -> None:
+    """Writes the totals of every span since the last flush, then resets them."""
+    with metrics_lock:
+        spans = dict(recorded_spans)
+        recorded_spans.clear()
+    lines = "".join(json.dumps(document) + "\n"
+                    for document in get_metric_documents(service, spans))
+    if ENV.get("METRICS_FILE"):
+        with open(ENV["METRICS_FILE"], "a", encoding="utf-8") as file:
+            file.write(lines)
+    else:
+        print(lines, end="")
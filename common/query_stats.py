@@ -0,0 +1,147 @@
+"""Round trips to the database made by the Lambda handlers.
+
+Connections opened with CountingConnection count the statements their cursors
+execute, the rows those statements return or change, and the commits made. The
+counts are kept per invocation like the pool's connection statistics, and go to
+every open metrics span as db_statements, db_rows and db_commits. A statement
+taking longer than SLOW_QUERY_MS is logged with its EXPLAIN plan."""
+
+import json
+from functools import cache
+from os import environ as ENV
+from threading import Lock
+from time import perf_counter
+
+from psycopg2 import DatabaseError
+from psycopg2.extensions import connection, cursor
+from psycopg2.sql import Composable
+
+from metrics import count
+
+DEFAULT_SLOW_QUERY_MS = 500
+# Only these statements can be explained; EXPLAIN does not run them.
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "VALUES")
+
+stats_lock = Lock()
+query_stats = {"statements": 0, "rows": 0, "commits": 0, "slow_statements": 0}
+slow_queries = []
+
+
+def get_query_text(conn: connection, query) -> str:
+    """Returns a query passed to execute as a string."""
+    if isinstance(query, Composable):
+        return query.as_string(conn)
+    if isinstance(query, bytes):
+        return query.decode()
+    return query
+
+
+def explain(conn: connection, query: str, params) -> list[str]:
+    """Returns the plan of a query that has just run, or an empty list if it cannot
+    be explained. Inside a transaction this runs in a savepoint, so a failure does
+    not abort the transaction."""
+    if not query.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    plan_cur = cursor(conn)
+    in_transaction = not conn.autocommit
+    try:
+        if in_transaction:
+            plan_cur.execute("SAVEPOINT explain_slow_query;")
+        plan_cur.execute("EXPLAIN " + query, params)
+        plan = [row[0] for row in plan_cur.fetchall()]
+        if in_transaction:
+            plan_cur.execute("RELEASE SAVEPOINT explain_slow_query;")
+        return plan
+    except DatabaseError:
+        if in_transaction:
+            plan_cur.execute("ROLLBACK TO SAVEPOINT explain_slow_query;")
+        return []
+    finally:
+        plan_cur.close()
+
+
+def record_statements(cur: cursor, query, params, seconds: float,
+                      statements: int = 1) -> None:
+    """Counts executed statements and logs them if they were slow."""
+    rows = max(cur.rowcount, 0)
+    slow = seconds * 1000 >= float(ENV.get("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS))
+    with stats_lock:
+        query_stats["statements"] += statements
+        query_stats["rows"] += rows
+        query_stats["slow_statements"] += slow
+    count("db_statements", statements)
+    count("db_rows", rows)
+    if not slow:
+        return
+    text = get_query_text(cur.connection, query)
+    slow_query = {"query": " ".join(text.split()), "ms": round(seconds * 1000, 1),
+                  "rows": rows,
+                  "plan": explain(cur.connection, text, params) if statements == 1 else []}
+    with stats_lock:
+        slow_queries.append(slow_query)
+    print("Slow query:", json.dumps(slow_query))
+
+
+class CountingCursor:
+    """Mixin counting the statements executed by a cursor class."""
+
+    def execute(self, query, params=None):
+        """Executes a statement, counting it."""
+        start = perf_counter()
+        result = super().execute(query, params)
+        record_statements(self, query, params, perf_counter() - start)
+        return result
+
+    def executemany(self, query, params_list):
+        """Executes a statement once for each set of parameters, counting each."""
+        params_list = list(params_list)
+        start = perf_counter()
+        result = super().executemany(query, params_list)
+        record_statements(self, query, None, perf_counter() - start, len(params_list))
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        """Runs a COPY statement, counting it."""
+        start = perf_counter()
+        result = super().copy_expert(sql, file, size)
+        record_statements(self, sql, None, perf_counter() - start)
+        return result
+
+
+@cache
+def get_counting_cursor(cursor_factory: type) -> type:
+    """Returns a class counting the statements of a cursor class."""
+    return type(f"Counting{cursor_factory.__name__}", (CountingCursor, cursor_factory), {})
+
+
+class CountingConnection(connection):
+    """Connection whose cursors count their statements, and which counts commits."""
+
+    def cursor(self, *args, **kwargs):
+        """Returns a counting cursor of the requested or default cursor class."""
+        cursor_factory = kwargs.pop("cursor_factory", None) or self.cursor_factory or cursor
+        return super().cursor(*args, cursor_factory=get_counting_cursor(cursor_factory),
+                              **kwargs)
+
+    def commit(self):
+        """Commits the transaction, counting it."""
+        super().commit()
+        with stats_lock:
+            query_stats["commits"] += 1
+        count("db_commits")
+
+
+def reset_query_stats() -> None:
+    """Resets the statement counts and slow queries, e.g. at the start of an
+    invocation."""
+    with stats_lock:
+        for stat in query_stats:
+            query_stats[stat] = 0
+        slow_queries.clear()
+
+
+def get_query_stats() -> dict:
+    """Returns the statements, rows, commits and slow statements since the counts
+    were last reset."""
+    with stats_lock:
+        return dict(query_stats)
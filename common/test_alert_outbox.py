@@ -0,0 +1,30 @@
+"""Tests for claiming and recording rows of the alert outbox."""
+from unittest.mock import MagicMock
+
+from alert_outbox import MAX_DELIVERY_ATTEMPTS, RETRY_AFTER_MINUTES, claim_alerts, record_deliveries
+
+
+def test_claim_skips_rows_out_of_attempts():
+    """Test that both the recipients and their rows are limited to rows with
+    attempts left."""
+    conn = MagicMock()
+    cur = conn.cursor.return_value.__enter__.return_value
+
+    claim_alerts(conn, 25)
+
+    sql_query, params = cur.execute.call_args.args
+    assert sql_query.count("O.attempts < %s") == 2
+    assert params == (MAX_DELIVERY_ATTEMPTS, 25, MAX_DELIVERY_ATTEMPTS)
+
+
+def test_failed_rows_use_up_an_attempt():
+    """Test that failed rows are counted and delayed, and sent rows marked sent."""
+    conn = MagicMock()
+    cur = conn.cursor.return_value.__enter__.return_value
+
+    record_deliveries(conn, [1], [2, 3])
+
+    sent, failed = cur.execute.call_args_list
+    assert "sent_at = CURRENT_TIMESTAMP" in sent.args[0]
+    assert "attempts = attempts + 1" in failed.args[0]
+    assert failed.args[1] == (RETRY_AFTER_MINUTES, [2, 3])
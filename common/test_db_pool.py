@@ -0,0 +1,65 @@
+"""Tests for the pooled database connections shared by the Lambda handlers."""
+from unittest.mock import MagicMock, patch
+
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+import db_pool
+from db_pool import db_connection, get_connection_stats, reset_connection_stats
+
+CONFIG = {"DB_HOST": "host", "DB_PORT": 5432, "DB_NAME": "weather",
+          "DB_USER": "user", "DB_PASSWORD": "password"}
+
+
+def make_connection() -> MagicMock:
+    """Returns a mock of an open, idle connection."""
+    conn = MagicMock()
+    conn.closed = 0
+    conn.info.transaction_status = TRANSACTION_STATUS_IDLE
+    return conn
+
+
+def setup_function():
+    """Start every test with an empty pool and no statistics."""
+    db_pool.idle_connections.clear()
+    reset_connection_stats()
+
+
+@patch('db_pool.connect')
+def test_connection_is_reused(mock_connect):
+    """Test that a released connection is handed out again."""
+    mock_connect.return_value = make_connection()
+    with db_connection(CONFIG) as first:
+        pass
+    with db_connection(CONFIG) as second:
+        pass
+    assert first is second
+    assert mock_connect.call_count == 1
+    assert get_connection_stats()["reused"] == 1
+    assert "timezone=Europe/London" in mock_connect.call_args.kwargs["options"]
+
+
+@patch('db_pool.connect')
+def test_unhealthy_connection_is_replaced(mock_connect, monkeypatch):
+    """Test that a connection failing its health check is discarded."""
+    monkeypatch.setattr(db_pool, 'HEALTH_CHECK_AFTER', 0)
+    stale, fresh = make_connection(), make_connection()
+    stale.cursor.return_value.__enter__.return_value.execute.side_effect = \
+        OperationalError("server closed the connection")
+    mock_connect.side_effect = [stale, fresh]
+    with db_connection(CONFIG):
+        pass
+    with db_connection(CONFIG) as conn:
+        assert conn is fresh
+    stale.close.assert_called_once()
+    assert get_connection_stats()["discarded"] == 1
+
+
+@patch('db_pool.connect')
+def test_uncommitted_work_is_rolled_back(mock_connect):
+    """Test that a connection is returned to the pool without an open transaction."""
+    conn = make_connection()
+    mock_connect.return_value = conn
+    with db_connection(CONFIG):
+        conn.info.transaction_status = TRANSACTION_STATUS_INTRANS
+    conn.rollback.assert_called_once()
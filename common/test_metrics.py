@@ -0,0 +1,72 @@
+"""Tests for the spans reporting each handler's metrics."""
+import asyncio
+import json
+
+import metrics
+from metrics import count, flush_metrics, instrumented, span
+
+
+def setup_function():
+    """Start every test with no recorded spans."""
+    metrics.recorded_spans.clear()
+
+
+def test_counts_go_to_every_open_span():
+    """Test that a count inside nested spans is added to each of them."""
+    with span("outer"):
+        count("rows", 2)
+        with span("inner"):
+            count("rows", 3)
+
+    assert metrics.recorded_spans["outer"]["rows"] == 5
+    assert metrics.recorded_spans["inner"]["rows"] == 3
+
+
+def test_spans_with_the_same_name_are_added_together():
+    """Test that repeated spans total their calls and durations."""
+    for _ in range(3):
+        with span("load"):
+            count("rows")
+
+    assert metrics.recorded_spans["load"]["calls"] == 3
+    assert metrics.recorded_spans["load"]["rows"] == 3
+    assert metrics.recorded_spans["load"]["duration_ms"] >= 0
+
+
+def test_count_outside_a_span_is_ignored():
+    """Test that counting with no open span records nothing."""
+    count("rows")
+    assert not metrics.recorded_spans
+
+
+def test_instrumented_coroutine_counts_its_tasks():
+    """Test that a decorated coroutine is a span for the tasks it awaits."""
+    async def fetch():
+        count("http_requests")
+
+    @instrumented("extract")
+    async def extract():
+        await asyncio.gather(fetch(), fetch())
+
+    asyncio.run(extract())
+    assert metrics.recorded_spans["extract"]["http_requests"] == 2
+
+
+def test_flush_metrics_writes_emf(tmp_path, monkeypatch):
+    """Test that flushing appends an EMF line per span and resets the totals."""
+    metrics_file = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv("METRICS_FILE", str(metrics_file))
+    with span("extract"):
+        count("http_bytes", 1024)
+
+    flush_metrics("pipeline")
+
+    document = json.loads(metrics_file.read_text(encoding="utf-8"))
+    assert document["Service"] == "pipeline"
+    assert document["Span"] == "extract"
+    assert document["http_bytes"] == 1024
+    definition = document["_aws"]["CloudWatchMetrics"][0]
+    assert definition["Dimensions"] == [["Service", "Span"]]
+    assert {"Name": "http_bytes", "Unit": "Bytes"} in definition["Metrics"]
+    assert {"Name": "duration_ms", "Unit": "Milliseconds"} in definition["Metrics"]
+    assert not metrics.recorded_spans
@@ -0,0 +1,56 @@
+"""Tests for the database round trips counted by the Lambda handlers."""
+from unittest.mock import MagicMock, patch
+
+from psycopg2.extras import RealDictCursor
+
+import metrics
+import query_stats
+from metrics import span
+from query_stats import (get_counting_cursor, get_query_stats, record_statements,
+                         reset_query_stats)
+
+
+def make_cursor(rowcount: int) -> MagicMock:
+    """Returns a mock of a cursor that has just run a statement."""
+    cur = MagicMock()
+    cur.rowcount = rowcount
+    return cur
+
+
+def setup_function():
+    """Start every test with no counts or spans."""
+    reset_query_stats()
+    metrics.recorded_spans.clear()
+
+
+def test_counting_cursor_keeps_the_cursor_class():
+    """Test that counting cursors are built once per class and keep its behaviour."""
+    counting = get_counting_cursor(RealDictCursor)
+    assert counting is get_counting_cursor(RealDictCursor)
+    assert issubclass(counting, RealDictCursor)
+    assert counting.execute is not RealDictCursor.execute
+
+
+def test_statements_are_counted_in_stats_and_spans():
+    """Test that statements and rows go to the stats and the open spans."""
+    with span("load"):
+        record_statements(make_cursor(3), "SELECT 1;", None, 0.001)
+        record_statements(make_cursor(-1), "INSERT INTO x VALUES (%s);", None, 0.001, 4)
+
+    assert get_query_stats() == {"statements": 5, "rows": 3, "commits": 0,
+                                 "slow_statements": 0}
+    assert metrics.recorded_spans["load"]["db_statements"] == 5
+    assert metrics.recorded_spans["load"]["db_rows"] == 3
+    assert not query_stats.slow_queries
+
+
+@patch('query_stats.explain')
+def test_slow_statement_is_logged_with_its_plan(mock_explain, monkeypatch):
+    """Test that a statement over SLOW_QUERY_MS is kept with its plan."""
+    monkeypatch.setenv("SLOW_QUERY_MS", "100")
+    mock_explain.return_value = ["Seq Scan on forecast"]
+    record_statements(make_cursor(1), b"SELECT *\n  FROM forecast;", None, 0.25)
+
+    assert get_query_stats()["slow_statements"] == 1
+    assert query_stats.slow_queries == [{"query": "SELECT * FROM forecast;", "ms": 250.0,
+                                         "rows": 1, "plan": ["Seq Scan on forecast"]}]
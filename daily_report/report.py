@@ -2,13 +2,18 @@
 import asyncio
 from datetime import datetime
 from os import environ as ENV
+from typing import TYPE_CHECKING
 
-import aioboto3
-import pandas as pd
-from boto3 import client
 from dotenv import load_dotenv
 from psycopg2 import connect
 
+from metrics import count, flush_metrics, span
+from query_stats import CountingConnection, reset_query_stats, get_query_stats
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from boto3 import client
+
 
 WEATHER_EMOJIS = {
     "Clear Sky": "☀️",
@@ -44,20 +49,27 @@ WEATHER_EMOJIS = {
 
 def handler(event: dict = None, context: dict = None) -> None:
     """This is designed to be compatible with the AWS Lambda function format."""
+    reset_query_stats()
     asyncio.run(main())
+    print("Database queries:", get_query_stats())
+    flush_metrics("daily_report")
 
 
 async def main() -> None:
     """Designed to asynchronously send emails."""
+    import aioboto3  # pylint: disable=import-outside-toplevel
     load_dotenv()
     conn = get_db_connection(ENV)
-    df = prepare_data_frame(conn)
-    async with aioboto3.Session().client('ses', aws_access_key_id=ENV['AWS_KEY'],
-                                         aws_secret_access_key=ENV['AWS_SKEY'],
-                                         region_name='eu-west-2') as ses:
-        tasks = [asyncio.create_task(send_email(ses, await format_forecast_report(df, email), email))
-                 for email in df['email'].unique()]
-        await asyncio.gather(*tasks)
+    with span("query"):
+        df = prepare_data_frame(conn)
+        count("rows", len(df))
+    with span("send"):
+        async with aioboto3.Session().client('ses', aws_access_key_id=ENV['AWS_KEY'],
+                                             aws_secret_access_key=ENV['AWS_SKEY'],
+                                             region_name='eu-west-2') as ses:
+            tasks = [asyncio.create_task(send_email(ses, await format_forecast_report(df, email), email))
+                     for email in df['email'].unique()]
+            await asyncio.gather(*tasks)
     conn.close()
 
 
@@ -68,12 +80,14 @@ def get_db_connection(config: dict) -> connect:
         password=config["DB_PASSWORD"],
         host=config["DB_HOST"],
         port=config["DB_PORT"],
-        database=config["DB_NAME"]
+        database=config["DB_NAME"],
+        connection_factory=CountingConnection
     )
 
 
-def execute_query(conn: connect, query: str) -> pd.DataFrame:
+def execute_query(conn: connect, query: str) -> 'pd.DataFrame':
     """Executes a SQL query and returns the results as a pandas DataFrame."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
     with conn.cursor() as cur:
         cur.execute(query)
         rows = cur.fetchall()
@@ -82,7 +96,7 @@ def execute_query(conn: connect, query: str) -> pd.DataFrame:
     return pd.DataFrame(rows, columns=columns)
 
 
-def prepare_data_frame(conn: connect) -> pd.DataFrame:
+def prepare_data_frame(conn: connect) -> 'pd.DataFrame':
     """Prepares a complete data frame combining user details with weather forecasts."""
     user_details_query = """
         SELECT *
@@ -102,8 +116,8 @@ def prepare_data_frame(conn: connect) -> pd.DataFrame:
     forecast_details = forecast_details.loc[:,
                                             ~forecast_details.columns.duplicated()]
 
-    combined_df = pd.merge(user_details, forecast_details,
-                           on='weather_report_id', suffixes=('_user', '_forecast'))
+    combined_df = user_details.merge(forecast_details,
+                                     on='weather_report_id', suffixes=('_user', '_forecast'))
     combined_df = combined_df.loc[:,
                                   ~combined_df.columns.duplicated()]
     return combined_df[combined_df['report_opt_in'] == True]
@@ -114,7 +128,7 @@ def add_unicode(cell: str) -> str:
     return f"{cell} {WEATHER_EMOJIS[cell]}"
 
 
-async def send_email(ses: client, html_content: str, recipient: str):
+async def send_email(ses: 'client', html_content: str, recipient: str):
     """Async function to send email using AWS SES."""
     try:
         response = await ses.send_email(
@@ -127,8 +141,10 @@ async def send_email(ses: client, html_content: str, recipient: str):
             }
         )
         print("Email sent! Message ID:", response['MessageId'])
+        count("emails_sent")
     except Exception as e:
         print("Error sending email:", e)
+        count("email_errors")
 
 
 def format_time(hour: int) -> str:
@@ -175,7 +191,7 @@ def format_html(report: str) -> str:
     """
 
 
-async def format_forecast_report(df: pd.DataFrame, target_email: str) -> str:
+async def format_forecast_report(df: 'pd.DataFrame', target_email: str) -> str:
     """Formats the filtered forecast data into HTML for sending as an email."""
     filtered_df = df[df['email'] == target_email]
     today = datetime.now().date()
@@ -210,7 +226,3 @@ async def format_forecast_report(df: pd.DataFrame, target_email: str) -> str:
 
         reports += f"<h2>{location}</h2>{html}"
     return format_html(reports)
-
-load_dotenv()
-conn = get_db_connection(ENV)
-print(type(conn))
@@ -0,0 +1,35 @@
+"""Queue the alerts not yet notified in the alert outbox.
+
+The email Lambda only sends alerts in the outbox, so alerts loaded before the
+outbox existed and still unnotified would never be sent. Run once after deploying
+the Lambda images that use the outbox, on a database migrated with
+migration.sql. Alerts already queued are skipped, so it is safe to run again."""
+
+import sys
+from os import environ as ENV
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'common'))
+
+# pylint: disable=wrong-import-position
+from alert_outbox import enqueue_unnotified_alerts
+from insert_metadata import get_db_connection
+
+
+def backfill_alert_outbox(config):
+    """Queue every unnotified alert in one transaction, returning how many outbox
+    rows are waiting to be sent."""
+    with get_db_connection(config) as connection:
+        enqueue_unnotified_alerts(connection)
+        with connection.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM alert_outbox WHERE sent_at IS NULL;")
+            pending = cur.fetchone()[0]
+    connection.close()
+    return pending
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    print("Alert emails waiting in the outbox:", backfill_alert_outbox(ENV))
@@ -84,6 +84,39 @@ def insert_weather_codes(conn):
         conn.commit()
 
 
+def get_geocode_cache_rows():
+    """Get geocoding results for the counties in the metadata, so the flood
+    pipeline does not need to ask Nominatim about them.
+    A county is placed at the mean position of its locations."""
+    countries = get_metadata('metadata/countries.txt')
+    counties = [data.split(', ') for data in get_metadata('metadata/counties.txt')]
+    locations = [data.split(', ')
+                 for data in get_metadata('metadata/locations.txt')]
+    rows = []
+    for county_id, (county, country_id) in enumerate(counties, start=1):
+        county_locations = [(float(lat), float(lon)) for lat, lon, _, loc_county_id
+                            in locations if int(loc_county_id) == county_id]
+        if not county_locations:
+            continue
+        rows.append([county,
+                     round(sum(lat for lat, _ in county_locations) /
+                           len(county_locations), 7),
+                     round(sum(lon for _, lon in county_locations) /
+                           len(county_locations), 7),
+                     None, county, countries[int(country_id) - 1]])
+    return rows
+
+
+def insert_geocode_cache(conn):
+    """Pre-warm the geocoding cache from the county and location metadata."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.executemany(
+            "INSERT INTO geocode_cache (query, latitude, longitude, loc_name, \
+                county_name, country_name) VALUES (%s, %s, %s, %s, %s, %s) \
+                ON CONFLICT (query) DO NOTHING", get_geocode_cache_rows())
+        conn.commit()
+
+
 def insert_metadata(config):
     """Insert all metadata into database."""
     with get_db_connection(config) as connection:
@@ -93,6 +126,7 @@ def insert_metadata(config):
         insert_countries(connection)
         insert_counties(connection)
         insert_locations(connection)
+        insert_geocode_cache(connection)
     connection.close()
 
 
@@ -0,0 +1,4 @@
+echo "Connecting to DB"
+export $(cat .env | xargs)
+export PGPASSWORD=$DB_PASSWORD
+psql --host=$DB_HOST --port=$DB_PORT --username=$DB_USER --dbname=$DB_NAME -v ON_ERROR_STOP=1 -f migration.sql
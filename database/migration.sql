@@ -0,0 +1,141 @@
+-- Brings a database created before the performance changes up to schema.sql,
+-- keeping its users and alerts. Safe to run again.
+-- Run before deploying the Lambda images that use the new schema, then run
+-- backfill_alert_outbox.py once they are deployed.
+
+BEGIN;
+
+ALTER TABLE air_quality ALTER COLUMN weather_report_id TYPE BIGINT;
+
+-- Forecasts are now kept once per location and time, with a hash of their content.
+-- Existing forecasts get a hash of 0, so they are rewritten on their next fetch.
+ALTER TABLE forecast ADD COLUMN IF NOT EXISTS content_hash BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE forecast ADD COLUMN IF NOT EXISTS loc_id INT NULL;
+ALTER TABLE forecast ALTER COLUMN content_hash DROP DEFAULT;
+
+UPDATE forecast AS F
+SET loc_id = WR.loc_id
+FROM weather_report AS WR
+WHERE F.weather_report_id = WR.weather_report_id AND F.loc_id IS NULL;
+
+ALTER TABLE forecast ALTER COLUMN loc_id SET NOT NULL;
+
+-- Only the latest forecast for each location and time is kept. Alerts move to it,
+-- keeping one per type and severity, preferring one already notified.
+CREATE TEMPORARY TABLE forecast_kept ON COMMIT DROP AS
+SELECT forecast_id, MAX(forecast_id) OVER (PARTITION BY loc_id, forecast_timestamp) AS kept_id
+FROM forecast;
+
+DELETE FROM weather_alert AS WA
+USING (SELECT WA.alert_id,
+           ROW_NUMBER() OVER (PARTITION BY FK.kept_id, WA.alert_type_id, WA.severity_level_id
+                              ORDER BY WA.notified DESC NULLS LAST, WA.alert_id DESC) AS duplicate
+       FROM weather_alert AS WA
+       JOIN forecast_kept AS FK ON (WA.forecast_id = FK.forecast_id)) AS D
+WHERE WA.alert_id = D.alert_id AND D.duplicate > 1;
+
+UPDATE weather_alert AS WA
+SET forecast_id = FK.kept_id
+FROM forecast_kept AS FK
+WHERE WA.forecast_id = FK.forecast_id AND FK.forecast_id <> FK.kept_id;
+
+DELETE FROM forecast AS F
+USING forecast_kept AS FK
+WHERE F.forecast_id = FK.forecast_id AND FK.forecast_id <> FK.kept_id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'forecast'::regclass
+                   AND conname = 'unique_location_forecast') THEN
+        ALTER TABLE forecast ADD CONSTRAINT unique_location_forecast
+            UNIQUE(loc_id, forecast_timestamp);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'forecast'::regclass
+                   AND conname = 'fk_location') THEN
+        ALTER TABLE forecast ADD CONSTRAINT fk_location
+            FOREIGN KEY(loc_id) REFERENCES location(loc_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'weather_alert'::regclass
+                   AND conname = 'unique_forecast_alert') THEN
+        ALTER TABLE weather_alert ADD CONSTRAINT unique_forecast_alert
+            UNIQUE(forecast_id, alert_type_id, severity_level_id);
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS geocode_cache(
+    query VARCHAR(100) NOT NULL,
+    latitude FLOAT NOT NULL,
+    longitude FLOAT NOT NULL,
+    loc_name VARCHAR(60) NULL,
+    county_name VARCHAR(50) NULL,
+    country_name VARCHAR(30) NULL,
+    expires_at TIMESTAMP NULL,
+    PRIMARY KEY(query)
+);
+
+CREATE TABLE IF NOT EXISTS location_processing_time(
+    loc_id INT NOT NULL,
+    seconds FLOAT NOT NULL,
+    recorded_at TIMESTAMP NOT NULL,
+    PRIMARY KEY(loc_id),
+    CONSTRAINT fk_location
+        FOREIGN KEY(loc_id) 
+            REFERENCES location(loc_id)
+);
+
+CREATE TABLE IF NOT EXISTS forecast_refresh_policy(
+    loc_id INT NOT NULL,
+    horizon VARCHAR(10) NOT NULL,
+    refresh_minutes SMALLINT NOT NULL,
+    volatility FLOAT NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL,
+    PRIMARY KEY(loc_id, horizon),
+    CONSTRAINT fk_location
+        FOREIGN KEY(loc_id) 
+            REFERENCES location(loc_id)
+);
+
+CREATE TABLE IF NOT EXISTS alert_outbox(
+    outbox_id BIGINT NOT NULL UNIQUE GENERATED ALWAYS AS IDENTITY,
+    user_id SMALLINT NOT NULL,
+    alert_table VARCHAR(20) NOT NULL,
+    alert_id BIGINT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    sent_at TIMESTAMP NULL,
+    PRIMARY KEY(outbox_id),
+    CONSTRAINT unique_user_alert
+        UNIQUE(user_id, alert_table, alert_id),
+    CONSTRAINT fk_user
+        FOREIGN KEY(user_id) 
+            REFERENCES user_details(user_id)
+);
+
+CREATE INDEX IF NOT EXISTS alert_outbox_pending
+    ON alert_outbox(user_id, available_at)
+    WHERE sent_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS weather_alert_unnotified
+    ON weather_alert(alert_id)
+    WHERE notified = FALSE;
+
+CREATE INDEX IF NOT EXISTS air_quality_unnotified
+    ON air_quality(air_quality_id)
+    WHERE notified = FALSE;
+
+CREATE INDEX IF NOT EXISTS flood_warnings_unnotified
+    ON flood_warnings(flood_id)
+    WHERE notified = FALSE;
+
+CREATE INDEX IF NOT EXISTS forecast_weather_report
+    ON forecast(weather_report_id);
+
+CREATE INDEX IF NOT EXISTS weather_report_location
+    ON weather_report(loc_id, report_time);
+
+CREATE INDEX IF NOT EXISTS air_quality_weather_report
+    ON air_quality(weather_report_id);
+
+COMMIT;
@@ -2,6 +2,9 @@ DROP DATABASE IF EXISTS weather;
 CREATE DATABASE weather;
 \c weather
 
+DROP TABLE IF EXISTS alert_outbox;
+DROP TABLE IF EXISTS location_processing_time;
+DROP TABLE IF EXISTS forecast_refresh_policy;
 DROP TABLE IF EXISTS air_quality;
 DROP TABLE IF EXISTS user_location_assignment;
 DROP TABLE IF EXISTS weather_alert;
@@ -15,6 +18,7 @@ DROP TABLE IF EXISTS alert_type;
 DROP TABLE IF EXISTS severity_level;
 DROP TABLE IF EXISTS county;
 DROP TABLE IF EXISTS country;
+DROP TABLE IF EXISTS geocode_cache;
 
 CREATE TABLE country(
     country_id SMALLINT NOT NULL UNIQUE GENERATED ALWAYS AS IDENTITY,
@@ -99,13 +103,20 @@ CREATE TABLE forecast(
     apparent_temp FLOAT NOT NULL,
     weather_report_id BIGINT NOT NULL,
     weather_code_id SMALLINT NOT NULL,
+    content_hash BIGINT NOT NULL,
+    loc_id INT NOT NULL,
     PRIMARY KEY(forecast_id),
+    CONSTRAINT unique_location_forecast
+        UNIQUE(loc_id, forecast_timestamp),
     CONSTRAINT fk_weather_report
         FOREIGN KEY(weather_report_id) 
             REFERENCES weather_report(weather_report_id),
     CONSTRAINT fk_weather_code
         FOREIGN KEY(weather_code_id) 
-            REFERENCES weather_code(weather_code_id)
+            REFERENCES weather_code(weather_code_id),
+    CONSTRAINT fk_location
+        FOREIGN KEY(loc_id) 
+            REFERENCES location(loc_id)
 );
 
 CREATE TABLE flood_warnings(
@@ -130,6 +141,8 @@ CREATE TABLE weather_alert(
     severity_level_id SMALLINT NOT NULL,
     notified BOOLEAN DEFAULT FALSE,
     PRIMARY KEY(alert_id),
+    CONSTRAINT unique_forecast_alert
+        UNIQUE(forecast_id, alert_type_id, severity_level_id),
     CONSTRAINT fk_forecast
         FOREIGN KEY(forecast_id) 
             REFERENCES forecast(forecast_id),
@@ -142,7 +155,7 @@ CREATE TABLE air_quality(
     air_quality_id BIGINT NOT NULL UNIQUE GENERATED ALWAYS AS IDENTITY,
     o3_concentration SMALLINT NOT NULL,
     severity_level_id SMALLINT NOT NULL,
-    weather_report_id SMALLINT NOT NULL,
+    weather_report_id BIGINT NOT NULL,
     notified BOOLEAN DEFAULT FALSE,
     PRIMARY KEY(air_quality_id),
     CONSTRAINT fk_weather
@@ -167,3 +180,79 @@ CREATE TABLE user_location_assignment(
         FOREIGN KEY(loc_id) 
             REFERENCES location(loc_id)
 );
+
+CREATE TABLE geocode_cache(
+    query VARCHAR(100) NOT NULL,
+    latitude FLOAT NOT NULL,
+    longitude FLOAT NOT NULL,
+    loc_name VARCHAR(60) NULL,
+    county_name VARCHAR(50) NULL,
+    country_name VARCHAR(30) NULL,
+    expires_at TIMESTAMP NULL,
+    PRIMARY KEY(query)
+);
+
+CREATE TABLE location_processing_time(
+    loc_id INT NOT NULL,
+    seconds FLOAT NOT NULL,
+    recorded_at TIMESTAMP NOT NULL,
+    PRIMARY KEY(loc_id),
+    CONSTRAINT fk_location
+        FOREIGN KEY(loc_id) 
+            REFERENCES location(loc_id)
+);
+
+CREATE TABLE forecast_refresh_policy(
+    loc_id INT NOT NULL,
+    horizon VARCHAR(10) NOT NULL,
+    refresh_minutes SMALLINT NOT NULL,
+    volatility FLOAT NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL,
+    PRIMARY KEY(loc_id, horizon),
+    CONSTRAINT fk_location
+        FOREIGN KEY(loc_id) 
+            REFERENCES location(loc_id)
+);
+
+CREATE TABLE alert_outbox(
+    outbox_id BIGINT NOT NULL UNIQUE GENERATED ALWAYS AS IDENTITY,
+    user_id SMALLINT NOT NULL,
+    alert_table VARCHAR(20) NOT NULL,
+    alert_id BIGINT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    sent_at TIMESTAMP NULL,
+    PRIMARY KEY(outbox_id),
+    CONSTRAINT unique_user_alert
+        UNIQUE(user_id, alert_table, alert_id),
+    CONSTRAINT fk_user
+        FOREIGN KEY(user_id) 
+            REFERENCES user_details(user_id)
+);
+
+CREATE INDEX alert_outbox_pending
+    ON alert_outbox(user_id, available_at)
+    WHERE sent_at IS NULL;
+
+CREATE INDEX weather_alert_unnotified
+    ON weather_alert(alert_id)
+    WHERE notified = FALSE;
+
+CREATE INDEX air_quality_unnotified
+    ON air_quality(air_quality_id)
+    WHERE notified = FALSE;
+
+CREATE INDEX flood_warnings_unnotified
+    ON flood_warnings(flood_id)
+    WHERE notified = FALSE;
+
+CREATE INDEX forecast_weather_report
+    ON forecast(weather_report_id);
+
+CREATE INDEX weather_report_location
+    ON weather_report(loc_id, report_time);
+
+CREATE INDEX air_quality_weather_report
+    ON air_quality(weather_report_id);
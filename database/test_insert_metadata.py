@@ -1,9 +1,12 @@
 """A file to test the functions in insert_metadata.py"""
 
 import os
+from pathlib import Path
+
+from pytest import approx
 
 from insert_metadata import get_metadata, insert_countries, \
-    insert_counties, insert_locations, insert_alert_types
+    insert_counties, insert_locations, insert_alert_types, get_geocode_cache_rows
 
 
 def test_get_location_metadata():
@@ -23,3 +26,28 @@ def test_get_location_metadata():
     assert isinstance(locations, list)
     assert all('\n' not in x for x in locations)
     assert all(len(x.split(', ')) == 4 for x in locations)
+
+
+def test_get_geocode_cache_rows(monkeypatch):
+    """A test for 'get_geocode_cache_rows' which tests that every county
+    gets one row with its country, placed at the mean position of its locations."""
+    monkeypatch.chdir(Path(__file__).parent)
+    countries = get_metadata('metadata/countries.txt')
+    counties = [data.split(', ') for data in get_metadata('metadata/counties.txt')]
+    locations = [data.split(', ') for data in get_metadata('metadata/locations.txt')]
+
+    rows = get_geocode_cache_rows()
+
+    assert len(rows) == len(counties)
+    assert [row[0] for row in rows] == [county for county, _ in counties]
+    for row, (county, country_id) in zip(rows, counties):
+        county_id = counties.index([county, country_id]) + 1
+        latitudes = [float(lat) for lat, _, _, loc_county in locations
+                     if int(loc_county) == county_id]
+        longitudes = [float(lon) for _, lon, _, loc_county in locations
+                      if int(loc_county) == county_id]
+        assert row == [county, approx(sum(latitudes) / len(latitudes)),
+                       approx(sum(longitudes) / len(longitudes)),
+                       None, county, countries[int(country_id) - 1]]
+    assert rows[0] == ['Greater London', 51.4893335, -0.14406, None, 'Greater London',
+                       'England']
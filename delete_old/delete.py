@@ -1,23 +1,15 @@
 """This script deletes the out of date data from the database using sql statements."""
 
 from os import environ as ENV
-from psycopg2 import connect
 from psycopg2.extensions import connection
 from dotenv import load_dotenv
 
-
-def get_db_connection(config: dict) -> connection:
-    """Connect to the database."""
-
-    return connect(
-        user=config["DB_USER"],
-        password=config["DB_PASSWORD"],
-        host=config["DB_HOST"],
-        port=config["DB_PORT"],
-        database=config["DB_NAME"]
-    )
+from db_pool import db_connection, reset_connection_stats, get_connection_stats
+from metrics import count, flush_metrics, instrumented
+from query_stats import reset_query_stats, get_query_stats
 
 
+@instrumented("delete_weather_alert")
 def delete_weather_alert(conn: connection) -> None:
     """Delete any weather update that is out of date and has been notified."""
 
@@ -31,22 +23,27 @@ def delete_weather_alert(conn: connection) -> None:
 
     with conn.cursor() as cur:
         cur.execute(sql_query)
+        count("rows", cur.rowcount)
         conn.commit()
 
 
+@instrumented("delete_weather_forecast")
 def delete_weather_forecast(conn: connection) -> None:
     """Delete any forecast that is out of date."""
 
-    sql_query = """DELETE FROM forecast
-                    WHERE (forecast_timestamp < CURRENT_TIMESTAMP - INTERVAL '30 minutes') AND 
-                    (forecast_id NOT IN (SELECT WA.forecast_id FROM weather_alert AS WA));
+    sql_query = """DELETE FROM forecast AS F
+                    WHERE (F.forecast_timestamp < CURRENT_TIMESTAMP - INTERVAL '30 minutes') AND
+                    NOT EXISTS (SELECT 1 FROM weather_alert AS WA
+                                WHERE WA.forecast_id = F.forecast_id);
                 """
 
     with conn.cursor() as cur:
         cur.execute(sql_query)
+        count("rows", cur.rowcount)
         conn.commit()
 
 
+@instrumented("delete_air_quality")
 def delete_air_quality(conn: connection) -> None:
     """Delete out of date air quality reports."""
 
@@ -57,22 +54,27 @@ def delete_air_quality(conn: connection) -> None:
 
     with conn.cursor() as cur:
         cur.execute(sql_query)
+        count("rows", cur.rowcount)
         conn.commit()
 
 
+@instrumented("delete_weather_reports")
 def delete_weather_reports(conn: connection) -> None:
     """Delete out of date weather reports."""
 
-    sql_query = """DELETE FROM weather_report WHERE
-    (weather_report_id NOT IN (SELECT F.weather_report_id FROM forecast AS F))
-    AND (weather_report_id NOT IN (SELECT AQ.weather_report_id FROM air_quality AS AQ));
+    sql_query = """DELETE FROM weather_report AS WR WHERE
+    NOT EXISTS (SELECT 1 FROM forecast AS F WHERE F.weather_report_id = WR.weather_report_id)
+    AND NOT EXISTS (SELECT 1 FROM air_quality AS AQ
+                    WHERE AQ.weather_report_id = WR.weather_report_id);
                 """
 
     with conn.cursor() as cur:
         cur.execute(sql_query)
+        count("rows", cur.rowcount)
         conn.commit()
 
 
+@instrumented("delete_flood_warnings")
 def delete_flood_warnings(conn: connection) -> None:
     """Delete out of date flood warnings."""
 
@@ -81,23 +83,42 @@ def delete_flood_warnings(conn: connection) -> None:
 
     with conn.cursor() as cur:
         cur.execute(sql_query)
+        count("rows", cur.rowcount)
+        conn.commit()
+
+
+@instrumented("delete_alert_outbox")
+def delete_alert_outbox(conn: connection) -> None:
+    """Delete alert emails queued over a day ago, whether sent or not."""
+
+    sql_query = """DELETE FROM alert_outbox
+    WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '1 day';"""
+
+    with conn.cursor() as cur:
+        cur.execute(sql_query)
+        count("rows", cur.rowcount)
         conn.commit()
 
 
-def clear_the_data(config: connection) -> None:
+def clear_the_data(config: dict) -> None:
     """Delete all out of the out of date data."""
 
-    with get_db_connection(config) as conn:
+    with db_connection(config) as conn:
         delete_weather_alert(conn)
         delete_weather_forecast(conn)
         delete_air_quality(conn)
         delete_weather_reports(conn)
         delete_flood_warnings(conn)
-    conn.close()
+        delete_alert_outbox(conn)
 
 
 def handler(event: list[dict], context: dict = None) -> None:
     """AWS Lambda function handler of the delete function."""
 
     load_dotenv()
+    reset_connection_stats()
+    reset_query_stats()
     clear_the_data(ENV)
+    print("Database connections:", get_connection_stats())
+    print("Database queries:", get_query_stats())
+    flush_metrics("delete_old")
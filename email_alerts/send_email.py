@@ -1,66 +1,243 @@
-"""The main email alert script, calls every other script and sends the emails."""
+"""The main email alert script, calls every other script and sends the emails.
 
+Emails are sent concurrently from one asyncio loop through a shared SES client, at
+most EMAIL_CONCURRENCY at a time and no faster than the account's SES send rate,
+which a token bucket enforces. Sends throttled by SES anyway, or failing to reach
+it, are retried after a jittered, exponentially growing delay. Workers stop claiming
+batches TIME_MARGIN_SECONDS before the Lambda times out, so a batch is never cut off
+between sending its emails and recording them."""
+
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os import environ as ENV
+from time import monotonic
 from dotenv import load_dotenv
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from psycopg2.extensions import connection
 
+from alert_outbox import claim_alerts, record_deliveries
+from db_pool import db_connection, reset_connection_stats, get_connection_stats
+from metrics import count, flush_metrics, span
+from query_stats import reset_query_stats, get_query_stats
 from create_email_messages import assign_messages_to_recipients
-from email_alert_setup import set_up_email_data
-from update_alerts import update_all_alert_tables
+from email_alert_setup import get_recipient_alerts
+from update_alerts import acknowledge_alerts
 
+DEFAULT_WORKERS = 2
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_CONCURRENCY = 10
+MAX_SEND_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 0.5
+TIME_MARGIN_SECONDS = 60
+THROTTLING_ERRORS = {"Throttling", "ThrottlingException", "TooManyRequestsException"}
 
-def send_email(email: str, message: str):
-    """Sends an email report of plant sensor faults using AWS SES."""
 
-    region = ENV['REGION']
-    ses = boto3.client('ses', region_name=region)
-    from_email = ENV['SENDER_EMAIL']
+def create_token_bucket(rate: float) -> dict:
+    """Returns a token bucket allowing rate sends per second, in bursts of up to a
+    second's worth."""
+    capacity = max(rate, 1.0)
+    return {"rate": rate, "capacity": capacity, "tokens": capacity, "updated": None,
+            "lock": asyncio.Lock()}
 
-    try:
-        response = ses.send_email(
-            Destination={
-                'ToAddresses': [email],
-            },
-            Message={
-                'Body': {
-                    'Html': {
-                        'Charset': 'UTF-8',
-                        'Data': f'{message}',
-                    },
-                },
-                'Subject': {
+
+async def take_token(bucket: dict) -> None:
+    """Waits until the bucket has a token for another send and takes it."""
+    loop = asyncio.get_running_loop()
+    async with bucket["lock"]:
+        now = loop.time()
+        if bucket["updated"] is not None:
+            bucket["tokens"] = min(bucket["capacity"],
+                                   bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        bucket["tokens"] -= 1
+        wait = max(0.0, -bucket["tokens"] / bucket["rate"])
+    await asyncio.sleep(wait)
+
+
+def create_delivery(ses, send_rate: float, concurrency: int) -> dict:
+    """Returns what every send shares: the SES client, the token bucket for the send
+    rate and the threads making at most concurrency requests at a time."""
+    return {"ses": ses, "bucket": create_token_bucket(send_rate),
+            "semaphore": asyncio.Semaphore(concurrency),
+            "executor": ThreadPoolExecutor(max_workers=concurrency)}
+
+
+def get_retry_delay(attempt: int) -> float:
+    """Returns a random delay before retrying a throttled send, of up to
+    RETRY_BASE_SECONDS doubled for each attempt made."""
+    return random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt)
+
+
+async def send_email(delivery: dict, email: str, message: str) -> bool:
+    """Sends an email of weather alerts using AWS SES, returning whether it was sent.
+    Throttled sends and connection errors are retried up to MAX_SEND_ATTEMPTS times."""
+
+    request = partial(
+        delivery["ses"].send_email,
+        Destination={
+            'ToAddresses': [email],
+        },
+        Message={
+            'Body': {
+                'Html': {
                     'Charset': 'UTF-8',
-                    'Data': "Weather Alert",
+                    'Data': f'{message}',
                 },
             },
-            Source=from_email,
-        )
-    except ClientError as error:
-        print("Could not send email:", error.response['Error']['Message'])
-    else:
+            'Subject': {
+                'Charset': 'UTF-8',
+                'Data': "Weather Alert",
+            },
+        },
+        Source=ENV['SENDER_EMAIL'],
+    )
+    loop = asyncio.get_running_loop()
+
+    for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+        await take_token(delivery["bucket"])
+        try:
+            async with delivery["semaphore"]:
+                response = await loop.run_in_executor(delivery["executor"], request)
+        except ClientError as error:
+            if (error.response['Error']['Code'] in THROTTLING_ERRORS
+                    and attempt < MAX_SEND_ATTEMPTS):
+                count("email_throttled")
+                await asyncio.sleep(get_retry_delay(attempt))
+                continue
+            print("Could not send email:", error.response['Error']['Message'])
+            count("email_errors")
+            return False
+        except BotoCoreError as error:
+            if attempt < MAX_SEND_ATTEMPTS:
+                count("email_retried")
+                await asyncio.sleep(get_retry_delay(attempt))
+                continue
+            print("Could not send email:", error)
+            count("email_errors")
+            return False
         print("Email sent! Message ID:", response['MessageId'])
+        count("emails_sent")
+        return True
+    return False
+
+
+def claim_batch(conn: connection, tables: list[str], batch_size: int) -> tuple:
+    """Claims a batch of recipients from the alert outbox, returning the recipients
+    claimed, their alerts and their messages. The recipients stay claimed until
+    the transaction ends; if nothing was claimed it is ended straight away."""
+
+    with span("select_alerts"):
+        claimed = claim_alerts(conn, batch_size)
+        if not claimed:
+            conn.commit()
+            return [], {}, {}
+        recipients_alerts = get_recipient_alerts(claimed, tables)
+        count("recipients", len(recipients_alerts))
+    with span("compose"):
+        recipients_msg = assign_messages_to_recipients(recipients_alerts, tables)
+    return claimed, recipients_alerts, recipients_msg
+
+
+def finish_batch(conn: connection, claimed: list[dict], recipients_alerts: dict,
+                 failed: set[str]) -> None:
+    """Marks the alerts of a batch that were sent as notified and their outbox rows
+    as sent, leaving those of failed recipients to be retried, and commits."""
+
+    with span("update_alerts"):
+        acknowledge_alerts(conn, {key: alerts for key, alerts in recipients_alerts.items()
+                                  if key not in failed})
+        record_deliveries(conn,
+                          [outbox_id for recipient in claimed if recipient["email"] not in failed
+                           for outbox_id in recipient["outbox_ids"]],
+                          [outbox_id for recipient in claimed if recipient["email"] in failed
+                           for outbox_id in recipient["outbox_ids"]])
+        conn.commit()
+
+
+async def send_batch(conn: connection, delivery: dict, tables: list[str],
+                     batch_size: int) -> int:
+    """Claims a batch of recipients, sends them their alerts concurrently and records
+    which were sent, all in one transaction. Returns how many recipients were
+    claimed."""
+
+    claimed, recipients_alerts, recipients_msg = await asyncio.to_thread(
+        claim_batch, conn, tables, batch_size)
+    if not claimed:
+        return 0
+    with span("send"):
+        recipients = [key for key, msg in recipients_msg.items() if msg]
+        sent = await asyncio.gather(*[send_email(delivery, key, recipients_msg[key])
+                                      for key in recipients])
+    failed = {key for key, was_sent in zip(recipients, sent) if not was_sent}
+    await asyncio.to_thread(finish_batch, conn, claimed, recipients_alerts, failed)
+    return len(claimed)
+
+
+def get_deadline(context: dict = None) -> float | None:
+    """Returns the monotonic time after which no more batches should be claimed,
+    TIME_MARGIN_SECONDS before the Lambda times out, or None outside a Lambda."""
+    if context is None:
+        return None
+    return monotonic() + context.get_remaining_time_in_millis() / 1000 - TIME_MARGIN_SECONDS
+
+
+async def drain_outbox(config: dict, delivery: dict, tables: list[str], batch_size: int,
+                       deadline: float = None) -> None:
+    """Sends batches of alerts on its own connection until none are left to claim,
+    or until the deadline has passed, leaving the rest for the next run."""
+
+    with db_connection(config) as conn:
+        while deadline is None or monotonic() < deadline:
+            if not await send_batch(conn, delivery, tables, batch_size):
+                return
+        print("Stopped claiming alerts before the Lambda timeout.")
+        count("email_deadline_reached")
+
+
+async def deliver_outbox(config: dict, tables: list[str], deadline: float = None) -> None:
+    """Drains the alert outbox with EMAIL_WORKERS workers claiming EMAIL_BATCH_SIZE
+    recipients at a time until the deadline. Sends are limited to SES_SEND_RATE per
+    second, by default the account's maximum send rate, and EMAIL_CONCURRENCY at a
+    time."""
+
+    workers = int(ENV.get("EMAIL_WORKERS", DEFAULT_WORKERS))
+    batch_size = int(ENV.get("EMAIL_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+    concurrency = int(ENV.get("EMAIL_CONCURRENCY", DEFAULT_CONCURRENCY))
+    ses = boto3.client('ses', region_name=ENV['REGION'],
+                       config=Config(max_pool_connections=concurrency,
+                                     retries={"total_max_attempts": 1}))
+    send_rate = float(ENV.get("SES_SEND_RATE") or ses.get_send_quota()["MaxSendRate"])
+    delivery = create_delivery(ses, send_rate, concurrency)
+    try:
+        await asyncio.gather(*[drain_outbox(config, delivery, tables, batch_size, deadline)
+                               for _ in range(workers)])
+    finally:
+        delivery["executor"].shutdown()
 
 
-def send_to_each_recipient(config: dict, tables: list[str]) -> None:
-    """Gets all the alert information, sorts it and then sends it to all the recipients.
-    The function then updates the respective rows to show that the warning has been notified."""
+def send_to_each_recipient(config: dict, tables: list[str], deadline: float = None) -> None:
+    """Sends every alert in the outbox to its recipient, or as many as can be sent
+    before the deadline, and marks the alerts that were sent as notified."""
 
-    recipients_alerts = set_up_email_data(config, tables)
-    recipients_msg = assign_messages_to_recipients(recipients_alerts, tables)
-    for key in recipients_msg:
-        if not recipients_msg.get(key):
-            continue
-        send_email(key, recipients_msg.get(key))
-    update_all_alert_tables(config, recipients_alerts)
+    asyncio.run(deliver_outbox(config, tables, deadline))
 
 
 def handler(event: list[dict], context: dict = None) -> None:
     """AWS Lambda handler to run the script."""
 
     load_dotenv()
+    reset_connection_stats()
+    reset_query_stats()
     flood_alert = ENV['FLOOD_WARNING_TABLE']
     air_quality = ENV['AIR_QUALITY_TABLE']
     weather_alert = ENV['WEATHER_WARNING_TABLE']
 
-    send_to_each_recipient(ENV, [weather_alert, air_quality, flood_alert])
+    send_to_each_recipient(ENV, [weather_alert, air_quality, flood_alert],
+                           get_deadline(context))
+    print("Database connections:", get_connection_stats())
+    print("Database queries:", get_query_stats())
+    flush_metrics("email_alerts")
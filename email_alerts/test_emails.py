@@ -3,18 +3,10 @@ import pytest
 from datetime import datetime
 
 
-from email_alert_setup import emails_to_dict, add_unicode_symbols_weather, sort_warnings_to_email
+from email_alert_setup import add_unicode_symbols_weather, get_recipient_alerts
 from create_email_messages import get_alert_msg, get_alert_visual, create_html_table_weather, create_html_air_quality, create_html_flood_alerts
 
 
-def test_emails_to_dict():
-    """Test that the emails are made into a dictionary."""
-    test_data = ['email@1.com', 'email@2.com']
-    output = emails_to_dict(test_data)
-    assert isinstance(output, dict)
-    assert output == {'email@1.com': [], 'email@2.com': []}
-
-
 def test_remove_unnecessary_weather_data():
     """Test that data is removed when it doesn't match a weather alert type."""
 
@@ -31,29 +23,6 @@ def test_remove_unnecessary_weather_data():
     assert add_unicode_symbols_weather(test_data) == output
 
 
-def test_sort_warnings_to_email():
-    """Tests that warnings are matched to their respective dictionary key
-    which is their email."""
-
-    test_data1 = [['weather_alert', 'antrim', 'Alert', 'belfast',
-                   'Wind', datetime.strptime('12:00:00', '%H:%M:%S'),
-                   datetime.strptime('14:00:00', '%H:%M:%S'),
-                   "Windy", 7,
-                   'email@1.com']]
-
-    test_data2 = ['email@1.com']
-
-    expected_output = {'email@1.com': [['weather_alert', 'antrim', 'Alert', 'belfast',
-                                        'Wind', datetime.strptime(
-                                            '12:00:00', '%H:%M:%S'),
-                                        datetime.strptime('14:00:00', '%H:%M:%S'), "Windy", 7, '&#x1F32C;']]}
-
-    output = sort_warnings_to_email(test_data2, test_data1)
-    assert isinstance(output, dict)
-    assert isinstance(output.get('email@1.com'), list)
-    assert output == expected_output
-
-
 @pytest.mark.parametrize("test_input1,test_input2,expected", [("Alert", 'Wind', 'Alert! Elevated Wind'),
                                                               ("Warning", 'Rain',
                                                                'Warning! High Rain'),
@@ -115,3 +84,27 @@ def test_create_html_flood_alerts():
     assert "Alert! Elevated Risk of Flooding" in output
     assert ">!</span> Alert!" in output
     assert 'belfast - 12:00:00' in output
+
+
+def test_get_recipient_alerts_groups_weather_alerts():
+    """Tests that a recipient's weather alerts of the same kind are grouped into one
+    warning covering their times, and other alerts are kept as they are."""
+
+    weather = {"county": "antrim", "severity_level": "Alert", "severity_level_id": 3,
+               "loc_name": "belfast", "alert_type": "Wind", "description": "Windy"}
+    claimed = [{"email": "email@1.com", "outbox_ids": [1, 2],
+                "alerts": [{"alert_table": "weather_alert", "alert_id": 7,
+                            "payload": {**weather, "forecast_timestamp": "2024-05-01T14:00:00"}},
+                           {"alert_table": "weather_alert", "alert_id": 8,
+                            "payload": {**weather, "forecast_timestamp": "2024-05-01T12:00:00"}}]},
+               {"email": "email@2.com", "outbox_ids": [3],
+                "alerts": [{"alert_table": "air_quality", "alert_id": 11,
+                            "payload": {"severity_level": "Alert", "loc_name": "belfast",
+                                        "county": "antrim", "o3_concentration": 120}}]}]
+
+    output = get_recipient_alerts(claimed, ["weather_alert", "air_quality", "flood_warnings"])
+
+    assert output == {'email@1.com': [['weather_alert', 'antrim', 'Alert', 'belfast', 'Wind',
+                                       datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 14),
+                                       "Windy", [7, 8], '&#x1F32C;']],
+                      'email@2.com': [['air_quality', 11, 'Alert', 'belfast', 'antrim', 120]]}
@@ -0,0 +1,145 @@
+"""Tests for draining the alert outbox."""
+import asyncio
+from time import monotonic
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from send_email import (MAX_SEND_ATTEMPTS, TIME_MARGIN_SECONDS, create_delivery, drain_outbox,
+                        get_deadline, send_batch, send_email, take_token, create_token_bucket)
+
+TABLES = ["weather_alert", "air_quality", "flood_warnings"]
+CLAIMED = [{"email": "a@1.com", "outbox_ids": [1],
+            "alerts": [{"alert_table": "air_quality", "alert_id": 11,
+                        "payload": {"severity_level": "Alert", "loc_name": "belfast",
+                                    "county": "antrim", "o3_concentration": 120}}]},
+           {"email": "b@1.com", "outbox_ids": [2, 3],
+            "alerts": [{"alert_table": "air_quality", "alert_id": 12,
+                        "payload": {"severity_level": "Alert", "loc_name": "derry",
+                                    "county": "derry", "o3_concentration": 130}},
+                       {"alert_table": "air_quality", "alert_id": 13,
+                        "payload": {"severity_level": "Alert", "loc_name": "newry",
+                                    "county": "down", "o3_concentration": 125}}]}]
+THROTTLED = ClientError({"Error": {"Code": "Throttling",
+                                   "Message": "Maximum sending rate exceeded."}}, "SendEmail")
+
+
+@patch('send_email.acknowledge_alerts')
+@patch('send_email.record_deliveries')
+@patch('send_email.claim_alerts')
+@patch('send_email.send_email')
+def test_failed_emails_are_retried(mock_send_email, mock_claim_alerts,
+                                   mock_record_deliveries, mock_acknowledge_alerts):
+    """Test that only alerts whose email was sent are acknowledged, and the rest are
+    left in the outbox to be retried."""
+    async def fake_send_email(delivery, email, message):
+        return email == "a@1.com"
+    mock_claim_alerts.return_value = CLAIMED
+    mock_send_email.side_effect = fake_send_email
+    conn = MagicMock()
+
+    assert asyncio.run(send_batch(conn, MagicMock(), TABLES, 25)) == 2
+
+    mock_record_deliveries.assert_called_once_with(conn, [1], [2, 3])
+    assert list(mock_acknowledge_alerts.call_args.args[1]) == ["a@1.com"]
+    conn.commit.assert_called_once()
+
+
+@patch('send_email.claim_alerts')
+def test_empty_outbox_claims_nothing(mock_claim_alerts):
+    """Test that a batch with nothing to claim reports it, so the worker stops."""
+    mock_claim_alerts.return_value = []
+    assert asyncio.run(send_batch(MagicMock(), MagicMock(), TABLES, 25)) == 0
+
+
+def test_token_bucket_spaces_sends_beyond_a_burst():
+    """Test that a second's worth of sends go at once and the rest wait their turn."""
+    async def take_tokens():
+        bucket = create_token_bucket(20)
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*[take_token(bucket) for _ in range(25)])
+        return asyncio.get_running_loop().time() - start
+
+    assert 0.2 <= asyncio.run(take_tokens()) < 0.5
+
+
+@patch('send_email.RETRY_BASE_SECONDS', 0)
+def test_throttled_send_is_retried(monkeypatch):
+    """Test that a throttled send is tried again, and other errors are not."""
+    monkeypatch.setenv("SENDER_EMAIL", "alerts@example.com")
+    ses = MagicMock()
+    ses.send_email.side_effect = [THROTTLED, {"MessageId": "1"},
+                                  ClientError({"Error": {"Code": "MessageRejected",
+                                                         "Message": "Rejected"}}, "SendEmail")]
+
+    async def send_twice():
+        delivery = create_delivery(ses, 100, 2)
+        return [await send_email(delivery, "a@1.com", "<p>Alert</p>"),
+                await send_email(delivery, "b@1.com", "<p>Alert</p>")]
+
+    assert asyncio.run(send_twice()) == [True, False]
+    assert ses.send_email.call_count == 3
+
+
+@patch('send_email.RETRY_BASE_SECONDS', 0)
+@patch('send_email.acknowledge_alerts')
+@patch('send_email.record_deliveries')
+@patch('send_email.claim_alerts')
+def test_unreachable_ses_fails_only_its_recipient(mock_claim_alerts, mock_record_deliveries,
+                                                  mock_acknowledge_alerts, monkeypatch):
+    """Test that a send which cannot reach SES fails its own recipient after its
+    retries, while the rest of the batch is still acknowledged."""
+    def send(**message):
+        if message["Destination"]["ToAddresses"] == ["b@1.com"]:
+            raise EndpointConnectionError(endpoint_url="https://email.eu-west-2.amazonaws.com")
+        return {"MessageId": "1"}
+    monkeypatch.setenv("SENDER_EMAIL", "alerts@example.com")
+    mock_claim_alerts.return_value = CLAIMED
+    ses = MagicMock()
+    ses.send_email.side_effect = send
+    conn = MagicMock()
+
+    async def send_one_batch():
+        return await send_batch(conn, create_delivery(ses, 100, 2), TABLES, 25)
+
+    assert asyncio.run(send_one_batch()) == 2
+
+    assert ses.send_email.call_count == 1 + MAX_SEND_ATTEMPTS
+    mock_record_deliveries.assert_called_once_with(conn, [1], [2, 3])
+    assert list(mock_acknowledge_alerts.call_args.args[1]) == ["a@1.com"]
+    conn.commit.assert_called_once()
+
+
+@patch('send_email.monotonic', side_effect=[0, 100, 200])
+@patch('send_email.db_connection')
+@patch('send_email.send_batch')
+def test_drain_stops_claiming_at_the_deadline(mock_send_batch, mock_db_connection,
+                                              mock_monotonic):
+    """Test that a worker claims no more batches once the deadline has passed, even
+    with alerts left in the outbox."""
+    async def fake_send_batch(conn, delivery, tables, batch_size):
+        return batch_size
+    mock_send_batch.side_effect = fake_send_batch
+
+    asyncio.run(drain_outbox({}, MagicMock(), TABLES, 25, 150))
+    assert mock_send_batch.call_count == 2
+
+
+@patch('send_email.db_connection')
+@patch('send_email.send_batch')
+def test_drain_without_deadline_empties_the_outbox(mock_send_batch, mock_db_connection):
+    """Test that a worker outside a Lambda claims batches until none are left."""
+    async def fake_send_batch(conn, delivery, tables, batch_size):
+        return 0 if mock_send_batch.call_count == 3 else batch_size
+    mock_send_batch.side_effect = fake_send_batch
+
+    asyncio.run(drain_outbox({}, MagicMock(), TABLES, 25))
+    assert mock_send_batch.call_count == 3
+
+
+def test_deadline_leaves_a_margin_before_the_timeout():
+    """Test that the deadline falls TIME_MARGIN_SECONDS before the Lambda's timeout."""
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 300_000
+    assert abs(get_deadline(context) - (monotonic() + 300 - TIME_MARGIN_SECONDS)) < 1
+    assert get_deadline(None) is None
@@ -0,0 +1,58 @@
+"""Tests for marking the alerts that were emailed as notified."""
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from update_alerts import get_sent_alert_ids, acknowledge_alerts
+
+TABLES = {"WEATHER_WARNING_TABLE": "weather_alert", "FLOOD_WARNING_TABLE": "flood_warnings",
+          "AIR_QUALITY_TABLE": "air_quality"}
+RECIPIENTS = {
+    'email@1.com': [['weather_alert', 'antrim', 'Alert', 'belfast', 'Wind',
+                     datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 14), "Windy", [7, 8],
+                     '&#x1F32C;'],
+                    ['flood_warnings', 3, 'Flood Warning', 'belfast', 'antrim',
+                     datetime(2024, 5, 1, 9)]],
+    'email@2.com': [['weather_alert', 'antrim', 'Alert', 'belfast', 'Wind',
+                     datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 14), "Windy", [8, 9],
+                     '&#x1F32C;'],
+                    ['air_quality', 11, 'Alert', 'belfast', 'antrim', 120]],
+    'email@3.com': []
+}
+
+
+@pytest.fixture(autouse=True)
+def alert_tables(monkeypatch):
+    """Names the alert tables as in the deployed environment."""
+    for key, table in TABLES.items():
+        monkeypatch.setenv(key, table)
+
+
+def test_get_sent_alert_ids():
+    """Test that the alert IDs are gathered per table without duplicates."""
+    assert get_sent_alert_ids(RECIPIENTS) == {"weather_alert": {7, 8, 9},
+                                              "flood_warnings": {3},
+                                              "air_quality": {11}}
+
+
+def test_one_update_per_table():
+    """Test that each table is updated once with the IDs that were sent."""
+    conn = MagicMock()
+    execute = conn.cursor.return_value.__enter__.return_value.execute
+
+    acknowledge_alerts(conn, RECIPIENTS)
+
+    assert execute.call_count == 3
+    assert [call.args[1] for call in execute.call_args_list] == [([7, 8, 9],), ([3],), ([11],)]
+    assert all("ANY(%s)" in call.args[0] for call in execute.call_args_list)
+
+
+def test_nothing_sent_updates_nothing():
+    """Test that no statements run when no alerts were sent."""
+    conn = MagicMock()
+
+    acknowledge_alerts(conn, {'email@3.com': []})
+
+    conn.cursor.assert_not_called()
+    conn.commit.assert_not_called()
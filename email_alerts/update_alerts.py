@@ -2,77 +2,71 @@
 
 from os import environ as ENV
 
-from psycopg2 import connect
 from psycopg2.extensions import connection
 
 
 TABLE_ID_POS = 1
+WEATHER_IDS_POS = 8
 
 
-def get_db_connection(config: dict):
-    """Connect to the database."""
-    return connect(
-        user=config["DB_USER"],
-        password=config["DB_PASSWORD"],
-        host=config["DB_HOST"],
-        port=config["DB_PORT"],
-        database=config["DB_NAME"]
-    )
-
-
-def update_weather_alert(conn: connection) -> bool:
-    """Update the weather alert table based on forecast_id and alert_type_id. 
-    Notified is updated to to true."""
+def update_weather_alert(conn: connection, alert_ids: list[int]) -> None:
+    """Update the weather alert table so notified is true for the given alerts."""
     sql_query = """UPDATE weather_alert
                         SET
                         notified = True
+                        WHERE alert_id = ANY(%s)
                         ;"""
     with conn.cursor() as cur:
-        cur.execute(sql_query)
-    conn.commit()
+        cur.execute(sql_query, (alert_ids,))
 
 
-def update_flood_alert(conn: connection, table_id: int) -> bool:
-    """Update the flood alert table so notified is true."""
+def update_flood_alert(conn: connection, flood_ids: list[int]) -> None:
+    """Update the flood alert table so notified is true for the given floods."""
     sql_query = """UPDATE flood_warnings
                         SET
                         notified = True
-                        WHERE flood_id = %s
+                        WHERE flood_id = ANY(%s)
                         ;"""
     with conn.cursor() as cur:
-        cur.execute(sql_query, (table_id,))
-    conn.commit()
+        cur.execute(sql_query, (flood_ids,))
 
 
-def update_air_alert(conn: connection, table_id: int) -> bool:
-    """Update the air quality table so notified is true."""
+def update_air_alert(conn: connection, air_quality_ids: list[int]) -> None:
+    """Update the air quality table so notified is true for the given readings."""
     sql_query = """UPDATE air_quality
                         SET
                         notified = True
-                        WHERE air_quality_id = %s
+                        WHERE air_quality_id = ANY(%s)
                         ;"""
 
     with conn.cursor() as cur:
-        cur.execute(sql_query, (table_id,))
-    conn.commit()
+        cur.execute(sql_query, (air_quality_ids,))
 
 
-def update_all_alert_tables(config: dict, recipients: dict) -> None:
-    """Sorts through all the alerts and updates their respective row in the database."""
+def get_sent_alert_ids(recipients: dict) -> dict[str, set]:
+    """Returns the IDs of the alerts sent to the recipients, by table."""
 
     weather_alert = ENV['WEATHER_WARNING_TABLE']
     flood_alert = ENV['FLOOD_WARNING_TABLE']
     air_quality = ENV['AIR_QUALITY_TABLE']
-    with get_db_connection(config) as conn:
-        for key in recipients.keys():
-            if not recipients.get(key):
-                continue
-            for alert in recipients.get(key):
-                if alert[0] == weather_alert:
-                    update_weather_alert(conn)
-                if alert[0] == air_quality:
-                    update_air_alert(conn, alert[TABLE_ID_POS])
-                if alert[0] == flood_alert:
-                    update_flood_alert(conn, alert[TABLE_ID_POS])
-    conn.close()
-    print('Finished')
+    alert_ids = {weather_alert: set(), flood_alert: set(), air_quality: set()}
+    for alerts in recipients.values():
+        for alert in alerts or []:
+            if alert[0] == weather_alert:
+                alert_ids[weather_alert].update(alert[WEATHER_IDS_POS])
+            elif alert[0] in alert_ids:
+                alert_ids[alert[0]].add(alert[TABLE_ID_POS])
+    return alert_ids
+
+
+def acknowledge_alerts(conn: connection, recipients: dict) -> None:
+    """Marks every alert sent to the recipients as notified, with one update per
+    table. Nothing is committed, so this is part of the caller's transaction."""
+
+    alert_ids = get_sent_alert_ids(recipients)
+    updates = {ENV['WEATHER_WARNING_TABLE']: update_weather_alert,
+               ENV['FLOOD_WARNING_TABLE']: update_flood_alert,
+               ENV['AIR_QUALITY_TABLE']: update_air_alert}
+    for table, update in updates.items():
+        if alert_ids[table]:
+            update(conn, sorted(alert_ids[table]))
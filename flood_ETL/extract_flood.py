@@ -1,9 +1,14 @@
 """This file fetches flood information."""
 import requests
 
+from metrics import count, instrumented
 
+
+@instrumented("extract")
 def get_flood_warning_json() -> dict:
     """Returns information for the whole of the UK regarding floods."""
     response = requests.get(
         'http://environment.data.gov.uk/flood-monitoring/id/floods', timeout=10)
+    count("http_requests")
+    count("http_bytes", len(response.content))
     return response.json()
@@ -0,0 +1,91 @@
+"""A geocoding cache shared by the flood transform and load stages.
+
+Results are kept in memory for the life of the Lambda container and in the
+geocode_cache table between runs, so Nominatim is only asked about places
+that have not been seen before or whose cached result has expired."""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import cache
+from typing import TYPE_CHECKING
+
+from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import connection
+
+if TYPE_CHECKING:
+    from geopy.geocoders import Nominatim
+
+MEMORY_CACHE_SIZE = 1024
+CACHE_TTL = timedelta(days=30)
+
+memory_cache = OrderedDict()
+
+
+@cache
+def get_geolocator() -> 'Nominatim':
+    """Returns the geolocator shared by every lookup in this container.
+    geopy is only imported once a lookup misses both caches."""
+    from geopy.geocoders import Nominatim  # pylint: disable=import-outside-toplevel
+    return Nominatim(user_agent="my_application", timeout=10)
+
+
+def recall_from_memory(query: str) -> dict | None:
+    """Returns an unexpired result from the in-memory cache."""
+    if query not in memory_cache:
+        return None
+    expires_at, result = memory_cache[query]
+    if expires_at and expires_at <= datetime.now():
+        del memory_cache[query]
+        return None
+    memory_cache.move_to_end(query)
+    return result
+
+
+def remember_in_memory(query: str, result: dict, expires_at: datetime | None) -> None:
+    """Adds a result to the in-memory cache, evicting the least recently used."""
+    memory_cache[query] = (expires_at, result)
+    memory_cache.move_to_end(query)
+    while len(memory_cache) > MEMORY_CACHE_SIZE:
+        memory_cache.popitem(last=False)
+
+
+def get_cached(conn: connection, query: str) -> dict | None:
+    """Returns the cached result of a geocoding query, or None if it is not cached."""
+    result = recall_from_memory(query)
+    if result:
+        return result
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""SELECT latitude, longitude, loc_name, county_name,
+                    country_name, expires_at
+                    FROM geocode_cache
+                    WHERE query = %s
+                    AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)""",
+                    (query,))
+        row = cur.fetchone()
+    if not row:
+        return None
+    expires_at = row.pop("expires_at")
+    remember_in_memory(query, dict(row), expires_at)
+    return dict(row)
+
+
+def set_cached(conn: connection, query: str, result: dict) -> None:
+    """Caches the result of a geocoding query in memory and in the database."""
+    expires_at = datetime.now() + CACHE_TTL
+    remember_in_memory(query, result, expires_at)
+    with conn.cursor() as cur:
+        cur.execute("""INSERT INTO geocode_cache
+                    (query, latitude, longitude, loc_name, county_name,
+                    country_name, expires_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (query) DO UPDATE
+                    SET latitude = EXCLUDED.latitude,
+                    longitude = EXCLUDED.longitude,
+                    loc_name = EXCLUDED.loc_name,
+                    county_name = EXCLUDED.county_name,
+                    country_name = EXCLUDED.country_name,
+                    expires_at = EXCLUDED.expires_at""",
+                    (query, result["latitude"], result["longitude"],
+                     result.get("loc_name"), result.get("county_name"),
+                     result.get("country_name"), expires_at))
+    conn.commit()
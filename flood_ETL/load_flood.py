@@ -1,88 +1,19 @@
 """Load flood warnings into the database"""
 
-from psycopg2 import connect
 from psycopg2.extras import RealDictCursor
 from psycopg2.extensions import connection
-from geopy.geocoders import Nominatim
 
+from alert_outbox import enqueue_flood_warnings
+from location_index import (get_locations, build_location_index, find_nearest_location,
+                            DEFAULT_MAX_DISTANCE_KM)
+from metrics import count
 
-def get_db_connection(config: dict):
-    """Connect to the database."""
-    return connect(
-        user=config["DB_USER"],
-        password=config["DB_PASSWORD"],
-        host=config["DB_HOST"],
-        port=config["DB_PORT"],
-        database=config["DB_NAME"]
-    )
 
-
-def get_location(address: dict) -> str:
-    """Extract the city/town/village name of a location."""
-    if 'city' in address:
-        return address['city']
-    if 'town' in address:
-        return address['town']
-    if 'village' in address:
-        return address['village']
-    return ""
-
-
-def get_county(address: dict) -> str:
-    """Extract the county name of a location."""
-    if 'county' in address:
-        return address['county']
-    if 'state_district' in address:
-        return address['state_district']
-    return ""
-
-
-def get_country(address: dict) -> str:
-    """Extract the country name of a location."""
-    items = address.values()
-    if 'England' in items:
-        return 'England'
-    if 'Alba / Scotland' in items:
-        return 'Scotland'
-    if 'Cymru / Wales' in items:
-        return 'Wales'
-    if 'Northern Ireland / Tuaisceart Éireann' in items:
-        return 'Northern Ireland'
-    return ""
-
-
-def get_location_names(latitude: float, longitude: float) -> tuple[str]:
-    """Extract the location names from a longitude and latitude."""
-    geolocator = Nominatim(user_agent="my_application", timeout=10)
-    location_obj = geolocator.reverse(
-        f"{latitude}, {longitude}")
-    address = location_obj.raw['address']
-    country = get_country(address)
-    county = get_county(address)
-    location = get_location(address)
-    if not location:
-        location = county
-    if not county:
-        county = location
-    return location, county, country
-
-
-def get_location_id(conn: connection, latitude: float, longitude: float) -> int:
-    """Obtain the location id from the database."""
-
-    location, county, country = get_location_names(latitude, longitude)
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(f"""SELECT loc_id FROM location
-                    WHERE loc_name = '{location}'""")
-        loc_id = cur.fetchone()
-    if loc_id:
-        return loc_id["loc_id"]
-    return 0
-
-
-def insert_flood(conn: connection, flood: dict) -> None:
-    """Insert a flood into the database."""
-    loc_id = get_location_id(conn, flood['latitude'], flood['longitude'])
+def insert_flood(conn: connection, flood: dict, location_index: dict) -> None:
+    """Insert a flood into the database against the nearest monitored location,
+    adding it to the alert outbox in the same transaction."""
+    loc_id = find_nearest_location(
+        location_index, flood['latitude'], flood['longitude'])
     if loc_id:
         severity_level_id = flood['severity_level_id']
         time_raised = flood['time_raised']
@@ -95,13 +26,17 @@ def insert_flood(conn: connection, flood: dict) -> None:
             if not flood:
                 cur.execute(f"""INSERT INTO flood_warnings
                             (severity_level_id, time_raised, loc_id, notified)
-                            VALUES ({severity_level_id}, '{time_raised}', {loc_id}, False)""")
+                            VALUES ({severity_level_id}, '{time_raised}', {loc_id}, False)
+                            RETURNING flood_id""")
+                enqueue_flood_warnings(conn, [cur.fetchone()["flood_id"]])
                 conn.commit()
+                count("floods_loaded")
 
 
-def insert_all_floods(config: dict, floods: list[dict]) -> None:
-    """Insert all floods in the data into the database."""
-    with get_db_connection(config) as conn:
-        for flood in floods:
-            insert_flood(conn, flood)
-    conn.close()
+def insert_all_floods(conn: connection, floods: list[dict],
+                      max_distance: float = DEFAULT_MAX_DISTANCE_KM) -> None:
+    """Insert all floods in the data into the database, each against the nearest
+    location within max_distance kilometres."""
+    location_index = build_location_index(get_locations(conn), max_distance)
+    for flood in floods:
+        insert_flood(conn, flood, location_index)
@@ -0,0 +1,72 @@
+"""An in-memory spatial index of the monitored locations.
+
+Locations are bucketed into a grid of cells roughly max_distance across, so the
+nearest location to a point is found by measuring only the locations in the
+cells around it rather than every location in the database."""
+
+from collections import defaultdict
+from math import asin, ceil, cos, floor, radians, sin, sqrt
+
+from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import connection
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.195
+DEFAULT_MAX_DISTANCE_KM = 30
+
+
+def get_locations(conn: connection) -> list[dict]:
+    """Obtain the id and coordinates of every monitored location."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT loc_id, latitude, longitude FROM location")
+        return cur.fetchall()
+
+
+def get_distance_km(latitude_1: float, longitude_1: float,
+                    latitude_2: float, longitude_2: float) -> float:
+    """Returns the great-circle distance between two points in kilometres."""
+    lat_1, lat_2 = radians(latitude_1), radians(latitude_2)
+    d_lat = lat_2 - lat_1
+    d_lon = radians(longitude_2 - longitude_1)
+    a = sin(d_lat / 2) ** 2 + cos(lat_1) * cos(lat_2) * sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def get_grid_cell(latitude: float, longitude: float, cell_size: float) -> tuple[int]:
+    """Returns the grid cell containing a point."""
+    return floor(latitude / cell_size), floor(longitude / cell_size)
+
+
+def build_location_index(locations: list[dict],
+                         max_distance: float = DEFAULT_MAX_DISTANCE_KM) -> dict:
+    """Returns a grid index of the locations for nearest-location lookups
+    within max_distance kilometres."""
+    cell_size = max_distance / KM_PER_DEGREE
+    cells = defaultdict(list)
+    for location in locations:
+        cell = get_grid_cell(location["latitude"],
+                             location["longitude"], cell_size)
+        cells[cell].append((location["loc_id"], location["latitude"],
+                            location["longitude"]))
+    return {"cell_size": cell_size, "max_distance": max_distance, "cells": dict(cells)}
+
+
+def find_nearest_location(index: dict, latitude: float, longitude: float) -> int:
+    """Returns the id of the nearest location within the index's maximum distance,
+    or 0 if there is none."""
+    cell_size = index["cell_size"]
+    row, column = get_grid_cell(latitude, longitude, cell_size)
+    # A cell is narrower than max_distance away from the equator, so check more
+    # columns either side the further north or south the point is.
+    column_reach = ceil(1 / max(cos(radians(latitude)), 1e-6))
+
+    nearest_id, nearest_distance = 0, index["max_distance"]
+    for cell_row in range(row - 1, row + 2):
+        for cell_column in range(column - column_reach, column + column_reach + 1):
+            for loc_id, loc_latitude, loc_longitude in index["cells"].get(
+                    (cell_row, cell_column), []):
+                distance = get_distance_km(latitude, longitude,
+                                           loc_latitude, loc_longitude)
+                if distance <= nearest_distance:
+                    nearest_id, nearest_distance = loc_id, distance
+    return nearest_id
@@ -4,15 +4,28 @@ from os import environ as ENV
 
 from dotenv import load_dotenv
 
+from db_pool import db_connection, reset_connection_stats, get_connection_stats
+from metrics import flush_metrics, span
+from query_stats import reset_query_stats, get_query_stats
 from transform_flood import get_all_floods
 from load_flood import insert_all_floods
+from location_index import DEFAULT_MAX_DISTANCE_KM
 
 
 def flood_pipeline() -> None:
     """Loads data from flood API to a database."""
     load_dotenv()
-    floods = get_all_floods()
-    insert_all_floods(ENV, floods)
+    reset_connection_stats()
+    reset_query_stats()
+    with db_connection(ENV) as conn:
+        with span("transform"):
+            floods = get_all_floods(conn)
+        with span("load"):
+            insert_all_floods(conn, floods, float(
+                ENV.get("FLOOD_MAX_DISTANCE_KM", DEFAULT_MAX_DISTANCE_KM)))
+    print("Database connections:", get_connection_stats())
+    print("Database queries:", get_query_stats())
+    flush_metrics("flood")
 
 
 def handler(event: None, context: dict = None) -> None:
@@ -0,0 +1,49 @@
+"""Tests for the flood pipeline's geocoding cache."""
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import geocode_cache
+from geocode_cache import recall_from_memory, remember_in_memory, get_cached, set_cached
+
+
+def setup_function():
+    """Start every test with an empty in-memory cache."""
+    geocode_cache.memory_cache.clear()
+
+
+def test_memory_cache_evicts_least_recently_used(monkeypatch):
+    """Test that the oldest unused entry is evicted once the cache is full."""
+    monkeypatch.setattr(geocode_cache, 'MEMORY_CACHE_SIZE', 2)
+    remember_in_memory('Cumbria', {'latitude': 1}, None)
+    remember_in_memory('Devon', {'latitude': 2}, None)
+    recall_from_memory('Cumbria')
+    remember_in_memory('Kent', {'latitude': 3}, None)
+    assert recall_from_memory('Devon') is None
+    assert recall_from_memory('Cumbria') == {'latitude': 1}
+
+
+def test_memory_cache_expires_entries():
+    """Test that expired entries are not returned."""
+    remember_in_memory('Cumbria', {'latitude': 1},
+                       datetime.now() - timedelta(seconds=1))
+    assert recall_from_memory('Cumbria') is None
+
+
+def test_get_cached_reads_through_to_database():
+    """Test that a database hit is kept in memory for the next lookup."""
+    conn = MagicMock()
+    cur = conn.cursor.return_value.__enter__.return_value
+    cur.fetchone.return_value = {'latitude': 54.5, 'longitude': -3.0, 'loc_name': None,
+                                 'county_name': None, 'country_name': None,
+                                 'expires_at': None}
+    assert get_cached(conn, 'Cumbria')['latitude'] == 54.5
+    assert get_cached(conn, 'Cumbria')['longitude'] == -3.0
+    assert cur.execute.call_count == 1
+
+
+def test_set_cached_stores_in_memory_and_database():
+    """Test that a new result is written to the database and kept in memory."""
+    conn = MagicMock()
+    set_cached(conn, 'Cumbria', {'latitude': 54.5, 'longitude': -3.0})
+    conn.commit.assert_called_once()
+    assert recall_from_memory('Cumbria') == {'latitude': 54.5, 'longitude': -3.0}
@@ -0,0 +1,41 @@
+"""Tests for the nearest-location index used by the flood pipeline."""
+import pytest
+
+from location_index import build_location_index, find_nearest_location, get_distance_km
+
+LOCATIONS = [{'loc_id': 1, 'latitude': 51.4893335, 'longitude': -0.14406},
+             {'loc_id': 6, 'latitude': 50.9025349, 'longitude': -1.404189},
+             {'loc_id': 13, 'latitude': 50.8214626, 'longitude': -0.1400561},
+             {'loc_id': 15, 'latitude': 55.9533456, 'longitude': -3.1883749}]
+
+
+def test_get_distance_km():
+    """Test the distance between London and Brighton."""
+    assert get_distance_km(51.4893335, -0.14406,
+                           50.8214626, -0.1400561) == pytest.approx(74.3, abs=0.5)
+
+
+@pytest.mark.parametrize("latitude,longitude,expected", [
+    (51.5, -0.1, 1),
+    (50.95, -1.3, 6),
+    (50.83, -0.15, 13),
+    (55.9, -3.2, 15),
+    (54.5, -3.0, 0)])
+def test_find_nearest_location(latitude, longitude, expected):
+    """Test that points map to the nearest location within the maximum distance."""
+    index = build_location_index(LOCATIONS, max_distance=30)
+    assert find_nearest_location(index, latitude, longitude) == expected
+
+
+def test_find_nearest_location_matches_brute_force():
+    """Test that the grid finds the same location as measuring every location."""
+    index = build_location_index(LOCATIONS, max_distance=200)
+    for latitude in range(500, 560, 3):
+        for longitude in range(-40, 5, 3):
+            point = (latitude / 10, longitude / 10)
+            distances = {loc['loc_id']: get_distance_km(*point, loc['latitude'],
+                                                        loc['longitude'])
+                         for loc in LOCATIONS}
+            nearest = min(distances, key=distances.get)
+            expected = nearest if distances[nearest] <= 200 else 0
+            assert find_nearest_location(index, *point) == expected
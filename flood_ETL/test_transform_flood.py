@@ -0,0 +1,27 @@
+"""Tests for the flood pipeline's transform stage."""
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+from transform_flood import get_all_floods
+
+
+@patch('transform_flood.get_lat_lon', side_effect=lambda conn, county: (len(county), 0.0))
+@patch('transform_flood.get_flood_warning_json')
+def test_get_all_floods(mock_get_flood_warning_json, mock_get_lat_lon):
+    """Test that recent warnings are split per county and de-duplicated."""
+    recent = (datetime.now() - timedelta(minutes=10)).isoformat(timespec='seconds')
+    old = (datetime.now() - timedelta(hours=2)).isoformat(timespec='seconds')
+    mock_get_flood_warning_json.return_value = {'items': [
+        {'floodArea': {'county': 'Kent, Devon'}, 'severityLevel': 3,
+         'timeRaised': '2024-05-01T10:00:00', 'timeMessageChanged': recent},
+        {'floodArea': {'county': 'Kent'}, 'severityLevel': '3',
+         'timeRaised': '2024-05-01T10:00:00', 'timeMessageChanged': recent},
+        {'floodArea': {'county': 'Essex'}, 'severityLevel': 1,
+         'timeRaised': '2024-05-01T10:00:00', 'timeMessageChanged': old}]}
+
+    floods = get_all_floods(MagicMock())
+
+    assert floods == [{'latitude': 4, 'longitude': 0.0, 'severity_level_id': 3,
+                       'time_raised': datetime(2024, 5, 1, 10)},
+                      {'latitude': 5, 'longitude': 0.0, 'severity_level_id': 3,
+                       'time_raised': datetime(2024, 5, 1, 10)}]
@@ -2,59 +2,62 @@
 
 from datetime import datetime, timedelta
 
-import pandas as pd
-from geopy.geocoders import Nominatim
+from psycopg2.extensions import connection
 
 from extract_flood import get_flood_warning_json
+from geocode_cache import get_cached, set_cached, get_geolocator
+from metrics import count
 
 
-def get_lat_lon(county: str) -> tuple[float]:
+def get_lat_lon(conn: connection, county: str) -> tuple[float]:
     """Get the latitude and longitude from a county."""
-    geolocator = Nominatim(user_agent="my_application", timeout=10)
-    location = geolocator.geocode(county)
-    return round(float(location.latitude), 7), round(float(location.longitude), 7)
+    cached = get_cached(conn, county)
+    if not cached:
+        count("geocode_requests")
+        location = get_geolocator().geocode(county)
+        cached = {"latitude": round(float(location.latitude), 7),
+                  "longitude": round(float(location.longitude), 7)}
+        set_cached(conn, county, cached)
+    return round(float(cached["latitude"]), 7), round(float(cached["longitude"]), 7)
 
 
-def convert_dtypes(data: pd.DataFrame) -> pd.DataFrame:
-    """Convert the datatypes of 'time_raised' and 'severity_level_id' columns."""
-    data['time_raised'] = data['time_raised'].apply(pd.to_datetime)
-    data['severity_level_id'] = data['severity_level_id'].apply(pd.to_numeric)
-    return data
+def convert_dtypes(warning: dict) -> dict:
+    """Convert the datatypes of 'time_raised' and 'severity_level_id'."""
+    warning['time_raised'] = datetime.fromisoformat(warning['time_raised'])
+    warning['severity_level_id'] = int(warning['severity_level_id'])
+    return warning
 
 
-def clean_data(data: pd.DataFrame) -> pd.DataFrame:
+def clean_data(items: list[dict]) -> list[dict]:
     """Restrict the data to just the past hour,
-    Extract the county name from given location info,
-    Separate cells with a list of counties into separate rows,
-    Rename the columns."""
-    data['timeMessageChanged'] = data['timeMessageChanged'].apply(
-        pd.to_datetime)
-    data = data[data['timeMessageChanged'] >
-                datetime.now() - timedelta(hours=1)]
-    data.loc[:, 'floodArea'] = data.loc[:, 'floodArea'].apply(
-        lambda x: x['county'].split(', '))
-    data = data.explode('floodArea')
-    data = data.rename(
-        columns={'severityLevel': 'severity_level_id', 'timeRaised': 'time_raised'})
-    return data
-
-
-def get_location_columns(data: pd.DataFrame) -> pd.DataFrame:
-    """Create 'latitude' and 'longitude' columns."""
-    data['floodArea'] = data['floodArea'].apply(get_lat_lon)
-    data['latitude'] = data['floodArea'].apply(lambda x: x[0])
-    data['longitude'] = data['floodArea'].apply(lambda x: x[1])
-    return data
-
-
-def get_all_floods() -> list[dict]:
+    Extract the county names from given location info,
+    Give each county its own warning,
+    Rename the keys."""
+    an_hour_ago = datetime.now() - timedelta(hours=1)
+    return [{'floodArea': county,
+             'severity_level_id': item['severityLevel'],
+             'time_raised': item['timeRaised']}
+            for item in items
+            if datetime.fromisoformat(item['timeMessageChanged']) > an_hour_ago
+            for county in item['floodArea']['county'].split(', ')]
+
+
+def get_location_columns(conn: connection, warnings: list[dict]) -> list[dict]:
+    """Add 'latitude' and 'longitude' to each warning."""
+    for warning in warnings:
+        warning['latitude'], warning['longitude'] = get_lat_lon(conn, warning['floodArea'])
+    return warnings
+
+
+def get_all_floods(conn: connection) -> list[dict]:
     """Obtains a information about latest floods in the UK."""
-    flood_warnings = pd.DataFrame(get_flood_warning_json()['items'])
-    flood_warnings = clean_data(flood_warnings)
-    flood_warnings = convert_dtypes(flood_warnings)
-    flood_warnings = get_location_columns(flood_warnings)
-    flood_warnings = flood_warnings[['latitude', 'longitude',
-                                     'severity_level_id',
-                                     'time_raised']].drop_duplicates(ignore_index=True)
-    flood_warnings = flood_warnings.reset_index(drop=True)
-    return flood_warnings.to_dict(orient="records")
+    flood_warnings = clean_data(get_flood_warning_json()['items'])
+    flood_warnings = [convert_dtypes(warning) for warning in flood_warnings]
+    flood_warnings = get_location_columns(conn, flood_warnings)
+    floods = {}
+    for warning in flood_warnings:
+        flood = {key: warning[key] for key in ('latitude', 'longitude',
+                                               'severity_level_id', 'time_raised')}
+        floods.setdefault(tuple(flood.values()), flood)
+    count("floods", len(floods))
+    return list(floods.values())
@@ -1,57 +1,114 @@
 """This script separates the locations into chunks for mapping to AWS Lambdas."""
 
+from heapq import heappop, heappush
+from math import ceil
 from os import environ as ENV
 
 from dotenv import load_dotenv
-from psycopg2 import connect
 from psycopg2.extras import RealDictCursor
 from psycopg2.extensions import connection
 
+from db_pool import db_connection, reset_connection_stats, get_connection_stats
+from query_stats import reset_query_stats, get_query_stats
 
-def get_db_connection(config: dict) -> connection:
-    """Returns a connection to the database."""
+# Open-Meteo answers from a model grid, so locations closer together than its
+# resolution receive the same forecast and only need fetching once.
+DEFAULT_GRID_RESOLUTION = 0.02
 
-    return connect(
-        user=config["DB_USER"],
-        password=config["DB_PASSWORD"],
-        host=config["DB_HOST"],
-        port=config["DB_PORT"],
-        database=config["DB_NAME"],
-        cursor_factory=RealDictCursor
-    )
+# Chunks are sized so a pipeline Lambda uses at most TIMEOUT_SAFETY of its timeout,
+# estimating DEFAULT_LOCATION_SECONDS for locations that have not been timed yet.
+DEFAULT_LOCATION_SECONDS = 1.0
+DEFAULT_PIPELINE_TIMEOUT = 600
+DEFAULT_MAP_CONCURRENCY = 10
+TIMEOUT_SAFETY = 0.5
 
 
-def query_locations(conn: connection) -> dict[float]:
-    """Returns a list of dictionaries representing the latitude and
-    longitude of each location in the database."""
+def query_locations(conn: connection) -> list[dict]:
+    """Returns a list of dictionaries representing the ID, latitude, longitude
+    and expected processing seconds of each location in the database."""
 
     sql_query = """
-                SELECT latitude, longitude
-                FROM location;
+                SELECT L.loc_id, L.latitude, L.longitude,
+                COALESCE(LPT.seconds, %s) AS seconds
+                FROM location AS L
+                LEFT JOIN location_processing_time AS LPT ON (L.loc_id = LPT.loc_id);
                 """
 
     with conn.cursor() as cur:
-        cur.execute(sql_query)
+        cur.execute(sql_query, (DEFAULT_LOCATION_SECONDS,))
         coordinates = cur.fetchall()
 
-    return [{"latitude": c["latitude"], "longitude": c["longitude"]}
+    return [{"loc_id": c["loc_id"], "latitude": c["latitude"], "longitude": c["longitude"],
+             "seconds": c["seconds"]}
             for c in coordinates]
 
 
-def chunk_locations(locations: list[dict], chunk_size: int = 100) -> list[list[dict]]:
-    """Returns a list of location chunks (list of dictionaries)."""
+def snap_to_grid(value: float, resolution: float) -> float:
+    """Returns the coordinate of the grid cell centre nearest to a value."""
+    return round(round(value / resolution) * resolution, 6)
 
-    return [locations[i:i+chunk_size]
-            for i in range(0, len(locations), chunk_size)]
+
+def group_by_grid_cell(locations: list[dict],
+                       resolution: float = DEFAULT_GRID_RESOLUTION) -> list[dict]:
+    """Returns one dictionary per forecast grid cell with the cell's latitude and
+    longitude, the IDs of every location inside it and their expected seconds."""
+
+    cells = {}
+    for location in locations:
+        latitude = snap_to_grid(location["latitude"], resolution)
+        longitude = snap_to_grid(location["longitude"], resolution)
+        cell = cells.setdefault((latitude, longitude), {"latitude": latitude,
+                                                        "longitude": longitude,
+                                                        "loc_ids": [],
+                                                        "seconds": 0.0})
+        cell["loc_ids"].append(location["loc_id"])
+        cell["seconds"] += location.get("seconds", DEFAULT_LOCATION_SECONDS)
+
+    return list(cells.values())
+
+
+def get_chunk_count(cells: list[dict], pipeline_timeout: float, map_concurrency: int) -> int:
+    """Returns how many chunks to split the cells into: at least the target Map
+    concurrency, and enough that no chunk should exceed its share of the timeout."""
+
+    if not cells:
+        return 0
+    total_seconds = sum(cell["seconds"] for cell in cells)
+    needed = ceil(total_seconds / (pipeline_timeout * TIMEOUT_SAFETY))
+    return min(len(cells), max(needed, map_concurrency, 1))
+
+
+def chunk_locations(cells: list[dict], chunk_count: int) -> list[list[dict]]:
+    """Returns a list of location chunks (list of dictionaries) with similar
+    expected processing times, assigning the slowest cells first."""
+
+    chunks = [[] for _ in range(chunk_count)]
+    chunk_seconds = [(0.0, i) for i in range(chunk_count)]
+    for cell in sorted(cells, key=lambda c: c["seconds"], reverse=True):
+        seconds, i = heappop(chunk_seconds)
+        chunks[i].append(cell)
+        heappush(chunk_seconds, (seconds + cell["seconds"], i))
+
+    return [chunk for chunk in chunks if chunk]
 
 
 def handler(event: dict = None, context: dict = None) -> dict[list[list[dict]]]:
-    """AWS Lambda function handler for chunking locations, returns
-    JSON list of list of dictionaries."""
+    """AWS Lambda function handler for chunking locations by forecast grid cell
+    into chunks of similar cost, returns JSON list of list of dictionaries."""
 
     load_dotenv()
-    conn = get_db_connection(ENV)
-    locations = query_locations(conn)
-    conn.close()
+    reset_connection_stats()
+    reset_query_stats()
+    with db_connection(ENV, RealDictCursor) as conn:
+        locations = query_locations(conn)
+    print("Database connections:", get_connection_stats())
+    print("Database queries:", get_query_stats())
+
+    cells = group_by_grid_cell(locations, float(
+        ENV.get("GRID_RESOLUTION", DEFAULT_GRID_RESOLUTION)))
+
+    chunk_count = get_chunk_count(
+        cells, float(ENV.get("PIPELINE_TIMEOUT", DEFAULT_PIPELINE_TIMEOUT)),
+        int(ENV.get("MAP_CONCURRENCY", DEFAULT_MAP_CONCURRENCY)))
 
-    return {"data": chunk_locations(locations)}
+    return {"data": chunk_locations(cells, chunk_count)}
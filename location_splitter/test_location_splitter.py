@@ -0,0 +1,45 @@
+"""Tests for the location splitter."""
+from location_splitter import snap_to_grid, group_by_grid_cell, get_chunk_count, chunk_locations
+
+
+def test_snap_to_grid():
+    """Test that coordinates snap to the nearest cell centre."""
+    assert snap_to_grid(51.4893335, 0.02) == 51.48
+    assert snap_to_grid(-0.14406, 0.02) == -0.14
+
+
+def test_group_by_grid_cell():
+    """Test that locations sharing a grid cell are fetched once."""
+    locations = [{"loc_id": 1, "latitude": 51.4893335, "longitude": -0.14406, "seconds": 1.5},
+                 {"loc_id": 2, "latitude": 51.4850000, "longitude": -0.14100, "seconds": 0.5},
+                 {"loc_id": 3, "latitude": 53.4794892, "longitude": -2.2451148, "seconds": 1.0}]
+    assert group_by_grid_cell(locations, 0.02) == [
+        {"latitude": 51.48, "longitude": -0.14, "loc_ids": [1, 2], "seconds": 2.0},
+        {"latitude": 53.48, "longitude": -2.24, "loc_ids": [3], "seconds": 1.0}]
+
+
+def test_get_chunk_count_uses_map_concurrency():
+    """Test that small workloads are spread over the target concurrency."""
+    cells = [{"seconds": 1.0}] * 40
+    assert get_chunk_count(cells, 600, 10) == 10
+
+
+def test_get_chunk_count_respects_timeout():
+    """Test that large workloads get enough chunks to finish within the timeout."""
+    cells = [{"seconds": 1.0}] * 9000
+    assert get_chunk_count(cells, 600, 10) == 30
+
+
+def test_get_chunk_count_small():
+    """Test that there are never more chunks than cells."""
+    assert get_chunk_count([{"seconds": 1.0}] * 3, 600, 10) == 3
+    assert get_chunk_count([], 600, 10) == 0
+
+
+def test_chunk_locations_balances_cost():
+    """Test that chunks have similar expected processing times."""
+    cells = [{"seconds": s} for s in [8, 7, 6, 5, 4, 3, 2, 1, 1, 1]]
+    chunks = chunk_locations(cells, 3)
+    totals = sorted(sum(cell["seconds"] for cell in chunk) for chunk in chunks)
+    assert sum(len(chunk) for chunk in chunks) == 10
+    assert totals[-1] - totals[0] <= 1
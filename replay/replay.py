@@ -0,0 +1,236 @@
+"""Replay the Step Function graph locally, offline, and time each stage.
+
+A disposable Postgres is created from database/schema.sql and the metadata, users
+sign up through the backend, and then the graph runs as it does in AWS: the
+location splitter and a Map of pipeline Lambdas in parallel with the flood
+pipeline, followed by the email alerts. Every external API answers from the
+recordings in fixtures/ (see replay_stubs.py).
+
+Run from the repository root with `python replay/replay.py`. By default a temporary
+cluster is started with the initdb and pg_ctl on the PATH (or --pg-bin); with
+--use-env-server a throwaway database is created on the server in the DB_*
+environment variables instead."""
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import chdir, contextmanager
+from os import environ as ENV
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from psycopg2 import connect
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / directory) for directory in
+                ("replay", "common", "ETL_pipeline", "location_splitter", "flood_ETL",
+                 "email_alerts", "backend", "database")]
+
+# pylint: disable=wrong-import-position
+import insert_metadata
+import location_splitter
+import pipeline
+import pipeline_flood
+import send_email
+import utils
+import utils_db
+from replay_stubs import load_fixture, replayed_services
+# pylint: enable=wrong-import-position
+
+REPLAY_CONFIG = {"API_KEY": "replay", "REGION": "eu-west-2",
+                 "SENDER_EMAIL": "replay@example.com",
+                 "WEATHER_WARNING_TABLE": "weather_alert",
+                 "AIR_QUALITY_TABLE": "air_quality",
+                 "FLOOD_WARNING_TABLE": "flood_warnings"}
+COUNTED_TABLES = ("forecast", "weather_alert", "air_quality", "flood_warnings",
+                  "user_location_assignment")
+
+
+@contextmanager
+def temporary_cluster(pg_bin: Path):
+    """Yields the connection details of a new Postgres cluster, listening only on a
+    socket in a temporary directory, which is stopped and deleted afterwards."""
+    with TemporaryDirectory(prefix="replay-pg-") as directory:
+        data = Path(directory) / "data"
+        subprocess.run([pg_bin / "initdb", "-D", data, "-U", "postgres", "-A", "trust",
+                        "-E", "UTF8", "--no-sync"], check=True, capture_output=True)
+        subprocess.run([pg_bin / "pg_ctl", "-D", data, "-l", Path(directory) / "log", "-w",
+                        "-o", f"-k {directory} -c listen_addresses='' -c fsync=off",
+                        "start"], check=True, capture_output=True)
+        try:
+            yield {"DB_HOST": directory, "DB_PORT": "5432",
+                   "DB_USER": "postgres", "DB_PASSWORD": ""}
+        finally:
+            subprocess.run([pg_bin / "pg_ctl", "-D", data, "-m", "immediate", "stop"],
+                           check=False, capture_output=True)
+
+
+@contextmanager
+def existing_server():
+    """Yields the connection details of the server in the DB_* environment variables."""
+    yield {key: ENV[key] for key in ("DB_HOST", "DB_PORT", "DB_USER", "DB_PASSWORD")}
+
+
+def connect_to(server: dict, database: str, connection_factory: type = None):
+    """Returns a connection to a database on the server."""
+    return connect(user=server["DB_USER"], password=server["DB_PASSWORD"],
+                   host=server["DB_HOST"], port=server["DB_PORT"], database=database,
+                   connection_factory=connection_factory)
+
+
+@contextmanager
+def throwaway_database(server: dict):
+    """Yields the configuration of a new database on the server, created from
+    database/schema.sql and the metadata, which is dropped afterwards."""
+    name = f"replay_{uuid4().hex[:12]}"
+    admin = connect_to(server, "postgres")
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE DATABASE {name};")
+
+    config = {**server, "DB_NAME": name}
+    try:
+        schema = (ROOT / "database" / "schema.sql").read_text(encoding="utf-8")
+        with connect_to(server, name) as conn, conn.cursor() as cur:
+            cur.execute(schema.split("\\c weather", 1)[1])
+        conn.close()
+        with chdir(ROOT / "database"):
+            insert_metadata.insert_metadata(config)
+        yield config
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE);")
+        admin.close()
+
+
+def timed(timings: dict, stage: str, function, *args):
+    """Runs a stage, adding its seconds to the timings, and returns its result."""
+    start = perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + perf_counter() - start
+
+
+def sign_up_users(config: dict) -> None:
+    """Signs the recorded users up to their locations through the backend."""
+    conn = utils_db.get_db_connection(config)
+    try:
+        for user in load_fixture("users"):
+            details = utils.get_details_from_post_code(user["postcode"])
+            utils_db.setup_user_location(details, user["name"], user["email"],
+                                         user["newsletter"], user["alerts"], user["password"],
+                                         conn)
+    finally:
+        conn.close()
+
+
+def run_forecasts(timings: dict, map_concurrency: int) -> None:
+    """Runs the location splitter, then a pipeline per chunk like the Map state."""
+    chunks = timed(timings, "location_splitter", location_splitter.handler, {})["data"]
+    with ThreadPoolExecutor(max_workers=map_concurrency) as executor:
+        runs = [executor.submit(timed, timings, f"pipeline[{i}]", pipeline.handler, chunk)
+                for i, chunk in enumerate(chunks)]
+        for run in runs:
+            run.result()
+
+
+def run_graph(timings: dict, map_concurrency: int) -> None:
+    """Runs the Step Function graph once: the forecast branch in parallel with the
+    flood branch, then the email alerts."""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        branches = [executor.submit(timed, timings, "forecast_branch",
+                                    run_forecasts, timings, map_concurrency),
+                    executor.submit(timed, timings, "flood", pipeline_flood.handler, None)]
+        for branch in branches:
+            branch.result()
+    timed(timings, "email_alerts", send_email.handler, [])
+
+
+def count_rows(config: dict) -> dict[str, int]:
+    """Returns the number of rows in each of the tables the graph writes to."""
+    with connect_to(config, config["DB_NAME"]) as conn, conn.cursor() as cur:
+        counts = {}
+        for table in COUNTED_TABLES:
+            cur.execute(f"SELECT COUNT(*) FROM {table};")
+            counts[table] = cur.fetchone()[0]
+    conn.close()
+    return counts
+
+
+def replay(config: dict, runs: int, map_concurrency: int, latency: float) -> list[dict]:
+    """Signs up the users and replays the graph the given number of times against a
+    database, returning the stage timings, API calls and row counts of every run."""
+    ENV.update(REPLAY_CONFIG)
+    ENV.update(config)
+    ENV["MAP_CONCURRENCY"] = str(map_concurrency)
+
+    results = []
+    with replayed_services(latency) as services:
+        timings = {}
+        timed(timings, "sign_up", sign_up_users, config)
+        for run in range(runs):
+            services.calls.clear()
+            services.emails.clear()
+            timed(timings, "graph", run_graph, timings, map_concurrency)
+            results.append({"run": run + 1, "timings": timings,
+                            "api_calls": dict(services.calls),
+                            "emails_sent": len(services.emails),
+                            "rows": count_rows(config)})
+            timings = {}
+    return results
+
+
+def print_results(results: list[dict]) -> None:
+    """Prints the timings of every stage, the API calls made and the rows written."""
+    for result in results:
+        print(f"\nRun {result['run']}")
+        for stage, seconds in result["timings"].items():
+            print(f"  {stage:<20} {seconds * 1000:9.1f} ms")
+        print("  API calls:", ", ".join(f"{host} {count}" for host, count
+                                        in sorted(result["api_calls"].items())))
+        print("  Emails sent:", result["emails_sent"])
+        print("  Rows:", ", ".join(f"{table} {count}"
+                                   for table, count in result["rows"].items()))
+
+
+def main() -> None:
+    """Replays the graph against a disposable database and reports the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--runs", type=int, default=2,
+                        help="times to replay the graph against the same database")
+    parser.add_argument("--map-concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds each stubbed API request takes")
+    parser.add_argument("--pg-bin", type=Path,
+                        help="directory containing initdb and pg_ctl")
+    parser.add_argument("--use-env-server", action="store_true",
+                        help="create the throwaway database on the DB_* server")
+    parser.add_argument("--output", type=Path, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.use_env_server:
+        server = existing_server()
+    else:
+        initdb = shutil.which("initdb", path=args.pg_bin)
+        if initdb is None:
+            parser.error("initdb not found; pass --pg-bin or --use-env-server")
+        server = temporary_cluster(Path(initdb).parent)
+
+    with server as server_config, throwaway_database(server_config) as config:
+        results = replay(config, args.runs, args.map_concurrency, args.latency)
+
+    print_results(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
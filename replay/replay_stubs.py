@@ -0,0 +1,207 @@
+"""Stand-ins for the external services, answering from recorded responses in fixtures/.
+
+Recorded forecasts and flood warnings are re-timed to the moment they are replayed,
+so the handlers see data for the windows they ask for. Forecast values are chosen by
+timestamp, so replaying the same hour twice gives the same forecast."""
+
+import asyncio
+import json
+from collections import Counter, deque
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from math import dist
+from pathlib import Path
+from threading import Lock
+from time import monotonic, sleep
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.parse import parse_qs, unquote, urlparse
+
+from botocore.exceptions import ClientError
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+# The send rate of a production SES account; sends beyond it are throttled.
+STUB_SEND_RATE = 200.0
+
+FORECAST_WINDOWS = {"hourly": ("start_hour", "end_hour", timedelta(hours=1)),
+                    "minutely_15": ("start_minutely_15", "end_minutely_15",
+                                    timedelta(minutes=15))}
+
+
+def load_fixture(name: str) -> dict | list:
+    """Returns a recorded response from the fixtures directory."""
+    with open(FIXTURES / f"{name}.json", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def replay_series(recorded: dict, start: datetime, end: datetime, step: timedelta) -> dict:
+    """Returns a recorded forecast series re-timed from start to end, taking each
+    timestamp's values from the recording at the same offset, wrapping around."""
+    recorded_start = datetime.fromisoformat(recorded["time"][0])
+    times = []
+    while start <= end:
+        times.append(start)
+        start += step
+    rows = [int((time - recorded_start) / step) % len(recorded["time"]) for time in times]
+    series = {column: [values[row] for row in rows]
+              for column, values in recorded.items() if column != "time"}
+    return {"time": [time.isoformat(timespec="minutes") for time in times], **series}
+
+
+def replay_open_meteo(url: str) -> dict | list:
+    """Returns the recorded Open-Meteo forecast for every coordinate in a request."""
+    query = parse_qs(urlparse(url).query)
+    recorded = load_fixture("open_meteo_forecast")
+    latitudes = query["latitude"][0].split(",")
+    longitudes = query["longitude"][0].split(",")
+
+    responses = []
+    for latitude, longitude in zip(latitudes, longitudes):
+        response = {key: value for key, value in recorded.items()
+                    if key not in FORECAST_WINDOWS and not key.endswith("_units")
+                    and key != "recorded_at"}
+        response.update(latitude=float(latitude), longitude=float(longitude))
+        for key, (start, end, step) in FORECAST_WINDOWS.items():
+            if key in query:
+                response[f"{key}_units"] = recorded[f"{key}_units"]
+                response[key] = replay_series(recorded[key],
+                                              datetime.fromisoformat(query[start][0]),
+                                              datetime.fromisoformat(query[end][0]), step)
+        responses.append(response)
+    return responses if len(responses) > 1 else responses[0]
+
+
+def replay_floods() -> dict:
+    """Returns the recorded flood warnings, changed as long before now as they were
+    before the recording. They are raised a whole number of hours after they were
+    in the recording, so replays within the same hour raise the same warnings."""
+    floods = load_fixture("environment_agency_floods")
+    shift = datetime.now() - datetime.fromisoformat(floods.pop("recorded_at"))
+    raised_shift = shift // timedelta(hours=1) * timedelta(hours=1)
+    for item in floods["items"]:
+        for key, by in (("timeMessageChanged", shift), ("timeRaised", raised_shift),
+                        ("timeSeverityChanged", raised_shift)):
+            item[key] = (datetime.fromisoformat(item[key]) + by).isoformat(timespec="seconds")
+    return floods
+
+
+def create_fetch_json(calls: Counter, latency: float):
+    """Returns a stand-in for extract.fetch_json that answers from the fixtures after
+    the given latency, still respecting the extract's per-host rate limits."""
+    from extract import wait_for_rate_limit  # pylint: disable=import-outside-toplevel
+
+    async def fetch_json(session, rate_limiters: dict, url: str,
+                         headers: dict = None) -> dict | list:
+        host = urlparse(url).hostname
+        await wait_for_rate_limit(rate_limiters[host])
+        await asyncio.sleep(latency)
+        calls[host] += 1
+        if host == "api.open-meteo.com":
+            return replay_open_meteo(url)
+        return load_fixture("api_ninjas_air_quality")
+
+    return fetch_json
+
+
+def create_requests_get(calls: Counter):
+    """Returns a stand-in for requests.get serving the flood and postcode APIs."""
+
+    def get(url: str, *args, **kwargs) -> SimpleNamespace:
+        host = urlparse(url).hostname
+        calls[host] += 1
+        if host == "environment.data.gov.uk":
+            data = replay_floods()
+        elif host == "api.postcodes.io":
+            postcode = unquote(urlparse(url).path.rsplit("/", 1)[-1])
+            data = load_fixture("postcodes_io").get(
+                postcode.upper(), {"status": 404, "error": "Postcode not found"})
+        else:
+            raise ValueError(f"No recorded responses for {url}")
+        return SimpleNamespace(status_code=data.get("status", 200), json=lambda: data,
+                               content=json.dumps(data).encode())
+
+    return get
+
+
+class StubGeolocator:
+    """Answers Nominatim geocode and reverse lookups from the recorded places."""
+
+    def __init__(self, calls: Counter):
+        self.calls = calls
+        self.places = load_fixture("nominatim")
+
+    def geocode(self, query: str, *args, **kwargs) -> SimpleNamespace | None:
+        """Returns the recorded place with the given name, if there is one."""
+        self.calls["nominatim.openstreetmap.org"] += 1
+        for place in self.places:
+            if place["query"].lower() == query.lower():
+                return self.to_location(place)
+        return None
+
+    def reverse(self, query: str, *args, **kwargs) -> SimpleNamespace:
+        """Returns the recorded place nearest to a "latitude, longitude" string."""
+        self.calls["nominatim.openstreetmap.org"] += 1
+        point = tuple(float(value) for value in query.split(","))
+        return self.to_location(min(self.places, key=lambda place: dist(
+            point, (float(place["lat"]), float(place["lon"])))))
+
+    @staticmethod
+    def to_location(place: dict) -> SimpleNamespace:
+        """Returns a place in the shape of a geopy Location."""
+        return SimpleNamespace(latitude=float(place["lat"]), longitude=float(place["lon"]),
+                               address=place["display_name"], raw=place)
+
+
+class StubSES:
+    """Records the emails that would have been sent through SES, taking latency
+    seconds per send. Like SES, sends over max_send_rate in any second are rejected
+    as throttled."""
+
+    def __init__(self, calls: Counter, latency: float = 0.0,
+                 max_send_rate: float = STUB_SEND_RATE):
+        self.calls = calls
+        self.latency = latency
+        self.max_send_rate = max_send_rate
+        self.sent = []
+        self.throttled = 0
+        self.recent = deque()
+        self.lock = Lock()
+
+    def get_send_quota(self) -> dict:
+        """Returns the sending limits of the account."""
+        return {"Max24HourSend": 50000.0, "MaxSendRate": self.max_send_rate,
+                "SentLast24Hours": float(len(self.sent))}
+
+    def send_email(self, **message) -> dict:
+        """Records an email and returns its message ID, or raises a throttling error
+        if max_send_rate emails were already sent in the last second."""
+        sleep(self.latency)
+        with self.lock:
+            self.calls["email.eu-west-2.amazonaws.com"] += 1
+            now = monotonic()
+            while self.recent and now - self.recent[0] >= 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.max_send_rate:
+                self.throttled += 1
+                raise ClientError({"Error": {"Code": "Throttling",
+                                             "Message": "Maximum sending rate exceeded."}},
+                                  "SendEmail")
+            self.recent.append(now)
+            self.sent.append(message)
+            return {"MessageId": f"replay-{len(self.sent)}"}
+
+
+@contextmanager
+def replayed_services(latency: float = 0.0):
+    """Replaces every external service with its recorded responses while active,
+    yielding the count of calls per host and the emails sent."""
+    calls = Counter()
+    ses = StubSES(calls, latency)
+    geolocator = StubGeolocator(calls)
+    with ExitStack() as stack:
+        stack.enter_context(patch("extract.fetch_json", create_fetch_json(calls, latency)))
+        stack.enter_context(patch("requests.get", create_requests_get(calls)))
+        stack.enter_context(patch("transform_flood.get_geolocator", return_value=geolocator))
+        stack.enter_context(patch("utils.get_geolocator", return_value=geolocator))
+        stack.enter_context(patch("boto3.client", return_value=ses))
+        yield SimpleNamespace(calls=calls, emails=ses.sent)
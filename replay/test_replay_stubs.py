@@ -0,0 +1,58 @@
+"""Tests for the recorded stand-ins used by the local replay."""
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from botocore.exceptions import ClientError
+
+from replay_stubs import StubSES, replay_floods, replay_open_meteo, replay_series
+
+RECORDED = {"time": ["2024-05-01T12:00", "2024-05-01T13:00", "2024-05-01T14:00"],
+            "temperature_2m": [10.0, 11.0, 12.0]}
+
+
+def test_replay_series_wraps_around_by_timestamp():
+    """Test that each timestamp takes the recorded values at the same offset."""
+    series = replay_series(RECORDED, datetime(2024, 5, 2, 13), datetime(2024, 5, 2, 15),
+                           timedelta(hours=1))
+
+    assert series == {"time": ["2024-05-02T13:00", "2024-05-02T14:00", "2024-05-02T15:00"],
+                      "temperature_2m": [11.0, 12.0, 10.0]}
+
+
+def test_replay_open_meteo_answers_every_coordinate():
+    """Test that a batched request gets one forecast per coordinate in its window."""
+    url = ("https://api.open-meteo.com/v1/forecast?latitude=51.5,52.1&longitude=-0.1,1.2"
+           "&minutely_15=temperature_2m&start_minutely_15=2024-05-02T10:00"
+           "&end_minutely_15=2024-05-02T11:00")
+
+    responses = replay_open_meteo(url)
+
+    assert [response["latitude"] for response in responses] == [51.5, 52.1]
+    assert "hourly" not in responses[0]
+    assert responses[1]["minutely_15"]["time"][0] == "2024-05-02T10:00"
+    assert len(responses[1]["minutely_15"]["time"]) == 5
+
+
+def test_replay_floods_changed_within_the_last_hour():
+    """Test that replayed warnings are recent and repeat within the same hour."""
+    first, second = replay_floods(), replay_floods()
+
+    changed = [datetime.fromisoformat(item["timeMessageChanged"]) for item in first["items"]]
+    assert all(time <= datetime.now() for time in changed)
+    assert sum(time > datetime.now() - timedelta(hours=1) for time in changed) == 3
+    assert ([item["timeRaised"] for item in first["items"]]
+            == [item["timeRaised"] for item in second["items"]])
+
+
+def test_stub_ses_throttles_beyond_the_send_rate():
+    """Test that sends over the stub's send rate in a second raise a throttling error."""
+    ses = StubSES(Counter(), max_send_rate=2)
+    ses.send_email(Destination={"ToAddresses": ["a@1.com"]})
+    ses.send_email(Destination={"ToAddresses": ["b@1.com"]})
+
+    with pytest.raises(ClientError) as error:
+        ses.send_email(Destination={"ToAddresses": ["c@1.com"]})
+
+    assert error.value.response["Error"]["Code"] == "Throttling"
+    assert len(ses.sent) == 2 and ses.throttled == 1
@@ -102,7 +102,7 @@ resource "aws_lambda_function" "c10-climate-email-alert" {
         }
       
     }
-    timeout = 15
+    timeout = 300
 }
 
 data "aws_ecr_repository" "flood-warnings-repo" {
@@ -152,7 +152,10 @@ resource "aws_lambda_function" "c10-location-splitter" {
           DB_NAME = var.DB_NAME,
           DB_PASSWORD = var.DB_PASSWORD,
           DB_PORT = var.DB_PORT,
-          DB_USER = var.DB_USER
+          DB_USER = var.DB_USER,
+          GRID_RESOLUTION = var.GRID_RESOLUTION,
+          PIPELINE_TIMEOUT = aws_lambda_function.c10-climate-pipeline.timeout,
+          MAP_CONCURRENCY = var.MAP_CONCURRENCY
         }
       
     }
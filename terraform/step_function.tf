@@ -39,6 +39,7 @@ resource "aws_sfn_state_machine" "c10-climate-step-function-pipeline" {
             },
             "Map": {
               "Type": "Map",
+              "MaxConcurrency": ${var.MAP_CONCURRENCY},
               "ItemProcessor": {
                 "ProcessorConfig": {
                   "Mode": "INLINE"
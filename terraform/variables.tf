@@ -48,4 +48,14 @@ variable "WEATHER_WARNING_TABLE" {
 
 variable "HASH_KEY" {
     type = string
-}
\ No newline at end of file
+}
+
+variable "MAP_CONCURRENCY" {
+    type = number
+    default = 10
+}
+
+variable "GRID_RESOLUTION" {
+    type = number
+    default = 0.02
+}